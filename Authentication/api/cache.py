@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from . import db
+from .metrics import PROFILE_CACHE
+from .models import User
+
+# Cached for ids with no user, so unknown ids on /verify don't reach the
+# database either
+MISSING = object()
+
+
+class ProfileCache:
+    """User.to_dict() by id, kept for ttl seconds in an LRU of max_size.
+
+    Reads go through the cache; committed changes to a user drop its entry.
+    The cache is per process, so another process's writes show up once the
+    entry expires. A max_size of 0 turns it off.
+    """
+
+    def __init__(self):
+        self.max_size = 0
+        self.ttl = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_size = app.config['PROFILE_CACHE_SIZE']
+        self.ttl = app.config['PROFILE_CACHE_TTL']
+        event.listen(db.session, 'after_flush', self._changed)
+        event.listen(db.session, 'after_commit', self._committed)
+
+    def _changed(self, session, flush_context):
+        changed = session.info.setdefault('profile_cache_changed', set())
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, User):
+                changed.add(obj.id)
+
+    def _committed(self, session):
+        for user_id in session.info.pop('profile_cache_changed', ()):
+            self.invalidate(user_id)
+
+    def _cached(self, user_id, now):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] <= now:
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[0]
+
+    def _store(self, profiles, now):
+        if not self.max_size:
+            return
+        with self._lock:
+            for user_id, profile in profiles.items():
+                self._entries[user_id] = (profile, now + self.ttl)
+                self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_many(self, user_ids):
+        """Profiles by id, None for unknown ids; misses load in one query."""
+        now = time.monotonic()
+        profiles = {}
+        with self._lock:
+            for user_id in user_ids:
+                profile = self._cached(user_id, now)
+                if profile is not None:
+                    profiles[user_id] = profile
+        PROFILE_CACHE.labels('hit').inc(len(profiles))
+
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in profiles]
+        if missing:
+            PROFILE_CACHE.labels('miss').inc(len(missing))
+            loaded = {user.id: user.to_dict() for user in User.query.filter(User.id.in_(missing))}
+            fetched = {user_id: loaded.get(user_id, MISSING) for user_id in missing}
+            self._store(fetched, now)
+            profiles.update(fetched)
+
+        return {user_id: None if profile is MISSING else profile for user_id, profile in profiles.items()}
+
+    def get(self, user_id):
+        return self.get_many([user_id])[user_id]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+profile_cache = ProfileCache()
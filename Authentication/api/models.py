@@ -8,10 +8,13 @@ class User(db.Model):
 
     __tablename__ = 'users'
 
-    id = db.Column(db.String(36), primary_key=True, default=str(uuid.uuid4()))
-    username = db.Column(db.String(50), unique=True, nullable=False)
+    # Called per row; a plain str(uuid.uuid4()) gave every user the same id
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    # Login looks users up by username and register relies on both unique
+    # indexes to reject duplicates
+    username = db.Column(db.String(50), unique=True, index=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
-    email = db.Column(db.String(50), unique=True, nullable=False)
+    email = db.Column(db.String(50), unique=True, index=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
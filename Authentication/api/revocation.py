@@ -0,0 +1,58 @@
+import time
+
+import redis
+from jwt_revocation import RevocationCache, revoked_key
+
+from .metrics import REVOCATION_CHECKS
+
+
+class RevocationList:
+    """Revoked tokens and sessions, kept in Redis until the tokens expire.
+
+    A token is revoked when its jti or its session id (the sid claim every
+    token from one login shares) is on the list. This service writes the
+    list; checks go through jwt_revocation's cache like everywhere else.
+    """
+
+    def __init__(self):
+        self.r = None
+        self.session_ttl = 0
+        self.checks = None
+
+    def init_app(self, app, jwt):
+        self.r = redis.Redis.from_url(
+            app.config['REVOCATION_REDIS_URL'],
+            socket_timeout=app.config['REVOCATION_TIMEOUT'],
+            socket_connect_timeout=app.config['REVOCATION_TIMEOUT']
+        )
+        self.checks = RevocationCache(
+            self.r,
+            app.config['REVOCATION_RECHECK'],
+            app.config['REVOCATION_CACHE_SIZE'],
+            observe=lambda source: REVOCATION_CHECKS.labels(source).inc()
+        )
+        # A session lasts as long as its newest refresh token
+        self.session_ttl = app.config['JWT_REFRESH_TOKEN_EXPIRES'].total_seconds()
+        jwt.token_in_blocklist_loader(self._in_blocklist)
+
+    def _in_blocklist(self, jwt_header, jwt_payload):
+        return self.is_revoked(jwt_payload)
+
+    def is_revoked(self, claims):
+        return self.checks.is_revoked(claims)
+
+    def revoke(self, claims):
+        """Revoke the session a token belongs to, or the token alone if it has none."""
+        if claims.get('sid'):
+            revoked, expires_at = claims['sid'], time.time() + self.session_ttl
+        else:
+            revoked, expires_at = claims['jti'], claims['exp']
+        self.r.set(revoked_key(revoked), 1, exat=int(expires_at) + 1)
+        self.checks.forget(revoked)
+
+    def use_refresh_token(self, claims):
+        """Mark a refresh token used; False when it already was, i.e. it was replayed."""
+        return bool(self.r.set(f"jwt:used:{claims['jti']}", 1, nx=True, exat=int(claims['exp']) + 1))
+
+
+revocation_list = RevocationList()
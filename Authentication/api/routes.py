@@ -1,9 +1,15 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import get_jwt_identity, jwt_required, create_access_token, create_refresh_token
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required, create_access_token, create_refresh_token
+import redis
+from sqlalchemy.exc import IntegrityError
+
+import uuid
 
 from api import db
+from api.cache import profile_cache
+from api.revocation import revocation_list
 from api.models import User
-from api.utils import hashing_password, compare_password
+from api.utils import PasswordPoolBusy, hashing_password, compare_password, needs_rehash
 
 
 auth_blueprint = Blueprint('auth', __name__)
@@ -13,11 +19,7 @@ auth_blueprint = Blueprint('auth', __name__)
 def register():
     data = request.json
 
-    user_exist = User.query.filter_by(username=data['username']).first()
-    if user_exist:
-        return jsonify({'msg': 'User already exists'}), 400
-
-    hashed_password = hashing_password(data['password'])    
+    hashed_password = hashing_password(data['password'])
 
     user = User(
         username=data['username'],
@@ -25,8 +27,14 @@ def register():
         email=data['email']
     )
 
+    # A single INSERT; the unique indexes on username and email catch
+    # duplicates without a lookup first
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'msg': 'User already exists'}), 400
 
     return jsonify({
         'msg': 'User registered successfully'
@@ -56,9 +64,21 @@ def login():
         return jsonify({
             'msg': 'Invalid credentials'
         }), 400
+
+    # The cost factor changed since this password was stored
+    if needs_rehash(hashed_pswd):
+        try:
+            user.password = hashing_password(password)
+            db.session.commit()
+        except PasswordPoolBusy:
+            # Try again at the next login rather than fail this one
+            pass
     
-    access_token = create_access_token(identity=user.id)
-    refresh_token = create_refresh_token(identity=user.id)
+    # Every token of this login shares the session id, so logout or a
+    # replayed refresh token can revoke them all at once
+    session = {'sid': uuid.uuid4().hex}
+    access_token = create_access_token(identity=user.id, additional_claims=session)
+    refresh_token = create_refresh_token(identity=user.id, additional_claims=session)
     
     return jsonify({
         'msg': 'login successfully',
@@ -70,27 +90,56 @@ def login():
 @jwt_required(refresh=True)
 def refresh():
     current_user = get_jwt_identity()
-    access_token = create_access_token(identity=current_user)
+    claims = get_jwt()
+
+    # Refresh tokens are single use: each call returns the next one
+    try:
+        first_use = revocation_list.use_refresh_token(claims)
+    except redis.RedisError:
+        return jsonify({'msg': 'Try again shortly'}), 503
+    if not first_use:
+        # Someone else has this token too; end the session for both
+        revocation_list.revoke(claims)
+        return jsonify({'msg': 'Refresh token reused, please log in again'}), 401
+
+    session = {'sid': claims['sid']} if claims.get('sid') else {}
+    access_token = create_access_token(identity=current_user, additional_claims=session)
+    refresh_token = create_refresh_token(identity=current_user, additional_claims=session)
+    return jsonify({
+        'access_token': access_token,
+        'refresh_token': refresh_token
+    })
+
+@auth_blueprint.route('/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def logout():
+    try:
+        revocation_list.revoke(get_jwt())
+    except redis.RedisError:
+        return jsonify({'msg': 'Try again shortly'}), 503
+
     return jsonify({
-        'access_token': access_token
+        'msg': 'logged out'
     })
 
 @auth_blueprint.route('/user', methods=['GET'])
 @jwt_required()
 def get_user():
     current_user = get_jwt_identity()
-    user = User.query.filter_by(id=current_user).first()
+    user = profile_cache.get(current_user)
+    if not user:
+        return jsonify({'msg': 'User not found'}), 404
 
     return jsonify({
-        'username': user.username,
-        'email': user.email
+        'username': user['username'],
+        'email': user['email']
     }), 200
 
 @auth_blueprint.route('/verify', methods=['GET'])
 def verify_user():
     user_id = request.json.get("user_id")
 
-    user = User.query.filter_by(id=user_id).first()
+    user = profile_cache.get(user_id) if isinstance(user_id, str) else None
 
     if not user:
         return jsonify(
@@ -104,3 +153,20 @@ def verify_user():
                 "status": True
             }
         )
+
+@auth_blueprint.route('/verify/batch', methods=['POST'])
+def verify_users():
+    user_ids = (request.json or {}).get("user_ids")
+
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+        return jsonify({'msg': 'user_ids must be a list of ids'}), 400
+    if len(user_ids) > current_app.config['VERIFY_BATCH_MAX']:
+        return jsonify({'msg': f"At most {current_app.config['VERIFY_BATCH_MAX']} user_ids per call"}), 400
+
+    profiles = profile_cache.get_many(user_ids)
+
+    return jsonify(
+            {
+                "statuses": {user_id: profile is not None for user_id, profile in profiles.items()}
+            }
+        )
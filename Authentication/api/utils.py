@@ -1,15 +1,113 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+
+from flask import current_app, jsonify
 from flask_bcrypt import generate_password_hash, check_password_hash
-from pyotp import TOTP
 import os
 import base64
 
+from .metrics import BCRYPT_PENDING, BCRYPT_SHED, bcrypt_timer
+
+
+class PasswordPoolBusy(Exception):
+    """Too many hashes are already waiting for a worker."""
+
+
+def _hash(password, rounds):
+    return generate_password_hash(password, rounds).decode('utf-8')
+
+
+def _check(hashed_pwd, password):
+    return check_password_hash(hashed_pwd, password)
+
+
+class PasswordPool:
+    """Runs bcrypt on worker processes so it never holds up a request thread.
+
+    At most max_pending hashes wait or run at once; past that, callers get
+    PasswordPoolBusy, which the app turns into a 503. With no workers the
+    hashes run inline, as they used to. A pool broken by a worker dying is
+    dropped, and the next call starts a new one.
+    """
+
+    def __init__(self):
+        self.workers = 0
+        self.max_pending = 0
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config['BCRYPT_WORKERS']
+        self.max_pending = app.config['BCRYPT_MAX_PENDING'] or 4 * self.workers
+        app.register_error_handler(PasswordPoolBusy, self._busy)
+
+    def _busy(self, error):
+        response = jsonify({'msg': 'Server busy, try again shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            BCRYPT_PENDING.set(self._pending)
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                BCRYPT_SHED.inc()
+                raise PasswordPoolBusy()
+            # Spawned rather than forked, so workers don't inherit the
+            # listening socket and keep the port after the server stops
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            executor = self._executor
+            self._pending += 1
+            BCRYPT_PENDING.set(self._pending)
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException as e:
+            self._release(None)
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordPool()
+
 
 def hashing_password(password):
-    hashed_pswd = generate_password_hash(password, 14)
+    with bcrypt_timer('hash'):
+        hashed_pswd = password_pool.run(_hash, password, current_app.config['BCRYPT_LOG_ROUNDS'])
 
     return hashed_pswd
 
 def compare_password(hashed_pwd, password):
-    matched = check_password_hash(hashed_pwd, password)
+    with bcrypt_timer('verify'):
+        matched = password_pool.run(_check, hashed_pwd, password)
 
     return matched
+
+def needs_rehash(hashed_pwd):
+    # bcrypt hashes look like $2b$<cost>$<salt and digest>
+    return int(hashed_pwd.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
@@ -3,26 +3,46 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 
 import os
-from dotenv import load_dotenv
 
 from config import Config
 from api import db
+from api import metrics
+from api.cache import profile_cache
+from api.revocation import revocation_list
 from api.routes import auth_blueprint
+from api.utils import password_pool
 
-if __name__ == '__main__':
-    load_dotenv()
+
+def create_app(config=Config):
     app = Flask(__name__)
     CORS(app)
 
-    app.config.from_object(Config)
-    JWTManager(app)
+    app.config.from_object(config)
+    jwt = JWTManager(app)
     db.init_app(app)
+    metrics.init_app(app, db)
+    password_pool.init_app(app)
+    profile_cache.init_app(app)
+    revocation_list.init_app(app, jwt)
 
     with app.app_context():
         from api.models import User
 
         db.create_all()
-    
+        # Workers forked from a preloaded app must not share these
+        # connections; each opens its own on first use
+        db.engine.dispose()
+
     app.register_blueprint(auth_blueprint, url_prefix='/api/v2/auth')
 
+    # Probed by the gateway's health checker
+    @app.route('/health')
+    def health():
+        return {'status': 'ok'}
+
+    return app
+
+
+if __name__ == '__main__':
+    app = create_app()
     app.run(port=os.getenv('PORT'), host=os.getenv('HOST'), debug=os.getenv('DEBUG'))
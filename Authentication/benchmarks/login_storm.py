@@ -0,0 +1,144 @@
+"""Load benchmark: other auth routes during a burst of logins.
+
+Runs the auth service twice, hashing on the request thread and on the
+bcrypt worker pool. Each run keeps a number of clients logging in as fast
+as they can while a prober calls /user and /refresh, and reports login
+throughput, how many logins were shed and the prober's latency.
+
+    cd Authentication && python benchmarks/login_storm.py --clients 16
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+AUTH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 18090
+PREFIX = f'http://127.0.0.1:{PORT}/api/v2/auth'
+MODES = {
+    'inline': '0',
+    'pool': str(os.cpu_count() or 1),
+}
+
+
+def call(path, body=None, token=None, method=None):
+    request = urllib.request.Request(PREFIX + path, method=method or ('POST' if body is not None else 'GET'))
+    if body is not None:
+        request.data = json.dumps(body).encode()
+        request.add_header('Content-Type', 'application/json')
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    try:
+        with urllib.request.urlopen(request, timeout=120) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers
+
+
+def wait_for(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def storm(clients, duration, credentials, tokens):
+    stop = time.perf_counter() + duration
+    logins = {'ok': 0, 'shed': 0, 'error': 0}
+    probes = []
+    lock = threading.Lock()
+
+    def login():
+        while time.perf_counter() < stop:
+            status, body = call('/login', credentials)
+            outcome = 'ok' if status == 200 else 'shed' if status == 503 else 'error'
+            with lock:
+                logins[outcome] += 1
+            if status == 503:
+                # Back off the way the frontend would
+                time.sleep(float(body.get('Retry-After', 1)))
+
+    def probe():
+        while time.perf_counter() < stop:
+            for path, token, method in (('/user', tokens['access_token'], 'GET'),
+                                        ('/refresh', tokens['refresh_token'], 'POST')):
+                start = time.perf_counter()
+                call(path, token=token, method=method)
+                probes.append(time.perf_counter() - start)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=login) for _ in range(clients)] + [threading.Thread(target=probe)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    probes.sort()
+    return {
+        'logins_per_s': logins['ok'] / elapsed,
+        'shed': logins['shed'],
+        'errors': logins['error'],
+        'p50_ms': statistics.median(probes) * 1000,
+        'p99_ms': probes[max(int(len(probes) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def run(mode, workers, args):
+    db_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DB_URI=f'sqlite:///{db_dir}/auth.db',
+        SECRET_KEY='benchmark',
+        JWT_SECRET_KEY='benchmark',
+        HOST='127.0.0.1',
+        PORT=str(PORT),
+        DEBUG='',
+        BCRYPT_LOG_ROUNDS=str(args.rounds),
+        BCRYPT_WORKERS=workers,
+    )
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=AUTH_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(f'http://127.0.0.1:{PORT}/health')
+        credentials = {'username': 'storm', 'password': 'correct horse battery staple'}
+        call('/register', dict(credentials, email='storm@example.com'))
+        _, tokens = call('/login', credentials)
+        result = storm(args.clients, args.duration, credentials, tokens)
+    finally:
+        # Interrupted, the server exits cleanly and stops the pool's workers
+        proc.send_signal(signal.SIGINT)
+        proc.wait()
+    print(f"{mode:>6}: {result['logins_per_s']:6.2f} logins/s  shed {result['shed']:4d}  "
+          f"errors {result['errors']}  /user,/refresh p50 {result['p50_ms']:7.1f}ms  "
+          f"p99 {result['p99_ms']:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16, help='concurrent login clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor')
+    args = parser.parse_args()
+
+    print(f'{args.clients} login clients for {args.duration:.0f}s at cost {args.rounds}, '
+          f'{os.cpu_count()} cores')
+    for mode, workers in MODES.items():
+        run(mode, workers, args)
+
+
+if __name__ == '__main__':
+    main()
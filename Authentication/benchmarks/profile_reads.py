@@ -0,0 +1,128 @@
+"""Database reads behind /user and /verify, with and without the profile cache.
+
+Runs the auth service on SQLite twice, with PROFILE_CACHE_SIZE=0 and with
+the default cache, sends the same mix of /user, /verify and /verify/batch
+calls to each and counts the SELECTs they caused from /metrics.
+
+    cd Authentication && python benchmarks/profile_reads.py --requests 2000
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+AUTH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 18092
+BASE = f'http://127.0.0.1:{PORT}'
+SELECTS = re.compile(r'^auth_sql_duration_seconds_count\{operation="SELECT"\} (\S+)$', re.M)
+MODES = {
+    'no cache': '0',
+    'cache': '10000',
+}
+
+
+def call(path, body=None, token=None, method=None):
+    request = urllib.request.Request(BASE + '/api/v2/auth' + path, method=method or ('POST' if body is not None else 'GET'))
+    if body is not None:
+        request.data = json.dumps(body).encode()
+        request.add_header('Content-Type', 'application/json')
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    try:
+        with urllib.request.urlopen(request, timeout=30) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def selects():
+    with urllib.request.urlopen(BASE + '/metrics', timeout=5) as resp:
+        match = SELECTS.search(resp.read().decode())
+    return float(match.group(1)) if match else 0
+
+
+def wait_for(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def subject(token):
+    payload = token.split('.')[1]
+    return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['sub']
+
+
+def run(mode, cache_size, args):
+    db_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DB_URI=f'sqlite:///{db_dir}/auth.db',
+        SECRET_KEY='benchmark',
+        JWT_SECRET_KEY='benchmark',
+        HOST='127.0.0.1',
+        PORT=str(PORT),
+        DEBUG='',
+        BCRYPT_LOG_ROUNDS='4',
+        BCRYPT_WORKERS='0',
+        PROFILE_CACHE_SIZE=cache_size,
+    )
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=AUTH_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(BASE + '/health')
+        tokens = []
+        for i in range(args.users):
+            credentials = {'username': f'user{i}', 'password': 'pw'}
+            call('/register', dict(credentials, email=f'user{i}@example.com'))
+            tokens.append(call('/login', credentials)[1]['access_token'])
+        # The tokens' subjects are the user ids; mix in some unknown ones
+        user_ids = [subject(token) for token in tokens]
+        unknown = [str(uuid.uuid4()) for _ in range(args.users // 4 or 1)]
+
+        before = selects()
+        start = time.perf_counter()
+        for i in range(args.requests):
+            kind = i % 3
+            if kind == 0:
+                call('/user', token=tokens[i % len(tokens)])
+            elif kind == 1:
+                ids = user_ids + unknown
+                call('/verify', {'user_id': ids[i % len(ids)]}, method='GET')
+            else:
+                call('/verify/batch', {'user_ids': user_ids[:20] + unknown[:5]})
+        elapsed = time.perf_counter() - start
+        reads = selects() - before
+    finally:
+        proc.send_signal(signal.SIGINT)
+        proc.wait()
+    print(f'{mode:>9}: {reads:7.0f} SELECTs for {args.requests} requests '
+          f'({reads / args.requests:.3f} per request), {args.requests / elapsed:7.1f} req/s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f'{args.requests} requests over {args.users} users, a third each to /user, /verify and /verify/batch')
+    for mode, cache_size in MODES.items():
+        run(mode, cache_size, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""SQL statements per request for the main auth routes, on SQLite.
+
+Starts the auth service on a fresh SQLite database and reads the
+auth_sql_duration_seconds counts from /metrics around each request, so
+the numbers are the statements the routes actually sent.
+
+    cd Authentication && python benchmarks/queries_per_request.py
+"""
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+AUTH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 18091
+BASE = f'http://127.0.0.1:{PORT}'
+SQL_COUNT = re.compile(r'^auth_sql_duration_seconds_count\{operation="(\w+)"\} (\S+)$', re.M)
+
+
+def call(path, body=None, token=None):
+    request = urllib.request.Request(BASE + '/api/v2/auth' + path, method='POST' if body is not None else 'GET')
+    if body is not None:
+        request.data = json.dumps(body).encode()
+        request.add_header('Content-Type', 'application/json')
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    try:
+        with urllib.request.urlopen(request, timeout=30) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def sql_counts():
+    with urllib.request.urlopen(BASE + '/metrics', timeout=5) as resp:
+        text = resp.read().decode()
+    return {operation: float(count) for operation, count in SQL_COUNT.findall(text)}
+
+
+def measured(label, *args, **kwargs):
+    before = sql_counts()
+    status, body = call(*args, **kwargs)
+    after = sql_counts()
+    statements = {op: int(after[op] - before.get(op, 0)) for op in after if after[op] != before.get(op, 0)}
+    summary = ', '.join(f'{count} {op}' for op, count in sorted(statements.items())) or 'none'
+    print(f'{label:<28}{status:>5}{sum(statements.values()):>6}  {summary}')
+    return body
+
+
+def wait_for(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def main():
+    db_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DB_URI=f'sqlite:///{db_dir}/auth.db',
+        SECRET_KEY='benchmark',
+        JWT_SECRET_KEY='benchmark',
+        HOST='127.0.0.1',
+        PORT=str(PORT),
+        DEBUG='',
+        BCRYPT_LOG_ROUNDS='4',
+        BCRYPT_WORKERS='0',
+    )
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=AUTH_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(BASE + '/health')
+        # The first request also opens the pool's connection
+        call('/register', {'username': 'warmup', 'password': 'pw', 'email': 'warmup@example.com'})
+
+        print(f"{'request':<28}{'status':>5}{'SQL':>6}  statements")
+        alice = {'username': 'alice', 'password': 'pw', 'email': 'alice@example.com'}
+        measured('register', '/register', alice)
+        measured('register, same username', '/register', dict(alice, email='other@example.com'))
+        measured('register, same email', '/register', dict(alice, username='other'))
+        measured('login, wrong password', '/login', {'username': 'alice', 'password': 'nope'})
+        tokens = measured('login', '/login', {'username': 'alice', 'password': 'pw'})
+        measured('user', '/user', token=tokens['access_token'])
+    finally:
+        proc.send_signal(signal.SIGINT)
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark: cold start and per-worker memory of the auth service.
+
+Cold start runs a fresh interpreter that imports the app, calls
+create_app() and serves its first /health request, on a fresh SQLite
+database, and reports the time of each step and the resident memory at
+the end. Workers then emulates a preforking server with --workers
+children that each register a user as their first request. Without
+preloading each worker imports and creates the app itself; with it the
+parent does before forking. Worker memory is read from /proc, where PSS
+splits shared pages between the processes sharing them.
+
+Results can be written with --output and compared with --baseline, which
+exits non-zero if a figure grew by more than --tolerance.
+
+    cd Authentication && python benchmarks/startup.py --output startup.json
+    cd Authentication && python benchmarks/startup.py --baseline startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+AUTH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory(pid='self'):
+    """RSS, PSS and USS of a process in MB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def child_cold_start():
+    start = time.perf_counter()
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    app.test_client().get('/health')
+    served = time.perf_counter()
+    print(json.dumps({
+        'import': imported - start,
+        'create_app': created - imported,
+        'first_request': served - created,
+        'rss': memory()['rss'],
+    }))
+
+
+def child_workers(workers, preload):
+    if preload:
+        from app import create_app
+
+        app = create_app()
+    children = []
+    for n in range(workers):
+        ready, done = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready)
+            if not preload:
+                from app import create_app
+
+                app = create_app()
+            app.test_client().post('/api/v2/auth/register', json={
+                'username': f'worker{n}', 'password': 'pw', 'email': f'worker{n}@example.com'
+            })
+            os.write(done, b'1')
+            time.sleep(3600)
+            os._exit(0)
+        os.close(done)
+        children.append((pid, ready))
+
+    for _, ready in children:
+        os.read(ready, 1)
+    stats = [memory(pid) for pid, _ in children]
+    for pid, _ in children:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+    print(json.dumps({key: statistics.mean(s[key] for s in stats) for key in ('rss', 'pss', 'uss')}))
+
+
+def run_child(args):
+    db_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DB_URI=f'sqlite:///{db_dir}/auth.db',
+        SECRET_KEY='benchmark',
+        JWT_SECRET_KEY='benchmark',
+        BCRYPT_LOG_ROUNDS='4',
+        BCRYPT_WORKERS='0',
+    )
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__)] + args,
+        cwd=AUTH_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(runs, workers):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        sample = run_child(['--child', 'cold-start'])
+        sample['total'] = time.perf_counter() - start
+        samples.append(sample)
+    results = {'cold_start_s': statistics.median(s['total'] for s in samples)}
+    for step in ('import', 'create_app', 'first_request'):
+        results[f'{step}_s'] = statistics.median(s[step] for s in samples)
+    results['rss_after_start_mb'] = statistics.median(s['rss'] for s in samples)
+
+    for label, extra in (('lazy', []), ('preload', ['--preload'])):
+        worker = run_child(['--child', 'workers', '--workers', str(workers)] + extra)
+        for key in ('rss', 'pss', 'uss'):
+            results[f'{label}.worker_{key}_mb'] = worker[key]
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressed = []
+    for key, value in sorted(results.items()):
+        before = baseline.get(key)
+        change = f'{(value - before) / before:+7.1%}' if before else ''
+        print(f'{key:<32}{value:10.3f}  {change}')
+        if before and value > before * (1 + tolerance):
+            regressed.append(key)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help='write the results here as JSON')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--child', choices=('cold-start', 'workers'), help=argparse.SUPPRESS)
+    parser.add_argument('--preload', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, AUTH_DIR)
+        if args.child == 'cold-start':
+            child_cold_start()
+        else:
+            child_workers(args.workers, args.preload)
+        return
+
+    results = measure(args.runs, args.workers)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressed = compare(results, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressed:
+        sys.exit(f"regressed by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,47 @@ import os
 
 from dotenv import load_dotenv
 
+# The one place .env is read
+load_dotenv()
+
+
+def engine_options(uri):
+    options = {
+        # Drops connections the database closed while they sat in the pool
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() != 'false',
+    }
+    if uri and not uri.startswith('sqlite'):
+        options.update(
+            pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+            max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            # Under MySQL's wait_timeout, so connections are replaced before
+            # the server drops them
+            pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        )
+    return options
+
+
 class Config():
-    load_dotenv()
     SQLALCHEMY_DATABASE_URI=os.getenv('DB_URI')
+    SQLALCHEMY_ENGINE_OPTIONS=engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS=os.getenv('TRACK_MODIFICATIONS')
     SECRET_KEY=os.getenv('SECRET_KEY')
     JWT_SECRET_KEY=os.getenv('JWT_SECRET_KEY')
+    # Changing the cost rehashes each password at its owner's next login
+    BCRYPT_LOG_ROUNDS=int(os.getenv('BCRYPT_LOG_ROUNDS', 14))
+    # Worker processes for bcrypt; 0 hashes on the request thread
+    BCRYPT_WORKERS=int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 1))
+    # Hashes allowed to wait or run before requests get a 503; 0 means 4 per worker
+    BCRYPT_MAX_PENDING=int(os.getenv('BCRYPT_MAX_PENDING', 0))
+    # Profiles served to /user and /verify without a query; 0 turns it off
+    PROFILE_CACHE_SIZE=int(os.getenv('PROFILE_CACHE_SIZE', 10000))
+    PROFILE_CACHE_TTL=int(os.getenv('PROFILE_CACHE_TTL', 300))
+    # Most user ids one /verify/batch call may check
+    VERIFY_BATCH_MAX=int(os.getenv('VERIFY_BATCH_MAX', 500))
+    # Revoked tokens and sessions, shared with the gateway and the backend
+    REVOCATION_REDIS_URL=os.getenv('REVOCATION_REDIS_URL', 'redis://localhost:6379/0')
+    REVOCATION_TIMEOUT=float(os.getenv('REVOCATION_TIMEOUT', 0.5))
+    # Seconds a token found not revoked is trusted before asking Redis again
+    REVOCATION_RECHECK=int(os.getenv('REVOCATION_RECHECK', 5))
+    REVOCATION_CACHE_SIZE=int(os.getenv('REVOCATION_CACHE_SIZE', 100000))
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from config import Config, engine_options  # noqa: E402
+from api import db  # noqa: E402
+from api.cache import profile_cache  # noqa: E402
+from api.models import User  # noqa: E402
+from api.revocation import revocation_list  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The auth service on a fresh SQLite database, with cheap hashes."""
+    uri = f"sqlite:///{tmp_path_factory.mktemp('db')}/auth.db"
+
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = uri
+        SQLALCHEMY_ENGINE_OPTIONS = engine_options(uri)
+        SECRET_KEY = 'test'
+        JWT_SECRET_KEY = 'a-test-secret-long-enough-for-hs256'
+        BCRYPT_LOG_ROUNDS = 4
+        BCRYPT_WORKERS = 0
+
+    app = create_app(TestConfig)
+    revocation_list.r = revocation_list.checks.r = fakeredis.FakeRedis()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    yield app.test_client()
+    with app.app_context():
+        User.query.delete()
+        db.session.commit()
+    revocation_list.r.flushall()
+    profile_cache._entries.clear()
+
+
+@pytest.fixture
+def queries(app):
+    """SQL statements sent to the database, for counting them per request."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split(None, 1)[0].upper())
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
@@ -0,0 +1,80 @@
+from sqlalchemy import inspect
+
+from api import db
+from config import engine_options
+
+ALICE = {'username': 'alice', 'password': 'pw', 'email': 'alice@example.com'}
+
+
+def measured(queries, call):
+    """The response to call() and the SQL statements it sent."""
+    queries.clear()
+    response = call()
+    return response, list(queries)
+
+
+def login(client, username='alice', password='pw'):
+    return client.post('/api/v2/auth/login', json={'username': username, 'password': password})
+
+
+def test_register_is_a_single_insert(client, queries):
+    response, sent = measured(queries, lambda: client.post('/api/v2/auth/register', json=ALICE))
+
+    assert response.status_code == 200
+    assert sent == ['INSERT']
+
+
+def test_duplicate_username_or_email_is_rejected_without_a_500(client, queries):
+    client.post('/api/v2/auth/register', json=ALICE)
+
+    for duplicate in (dict(ALICE, email='other@example.com'), dict(ALICE, username='other')):
+        response, sent = measured(queries, lambda: client.post('/api/v2/auth/register', json=duplicate))
+        assert response.status_code == 400
+        assert response.get_json() == {'msg': 'User already exists'}
+        # The unique indexes catch it; no lookup before the INSERT
+        assert sent == ['INSERT']
+
+    assert login(client).status_code == 200
+
+
+def test_login_is_a_single_select(client, queries):
+    client.post('/api/v2/auth/register', json=ALICE)
+
+    response, sent = measured(queries, lambda: login(client))
+    assert response.status_code == 200
+    assert sent == ['SELECT']
+
+    response, sent = measured(queries, lambda: login(client, password='nope'))
+    assert response.status_code == 400
+    assert sent == ['SELECT']
+
+
+def test_user_is_one_select_then_cached(client, queries):
+    client.post('/api/v2/auth/register', json=ALICE)
+    headers = {'Authorization': f"Bearer {login(client).get_json()['access_token']}"}
+
+    response, sent = measured(queries, lambda: client.get('/api/v2/auth/user', headers=headers))
+    assert response.get_json() == {'username': 'alice', 'email': 'alice@example.com'}
+    assert sent == ['SELECT']
+
+    response, sent = measured(queries, lambda: client.get('/api/v2/auth/user', headers=headers))
+    assert response.status_code == 200
+    assert sent == []
+
+
+def test_username_and_email_have_unique_indexes(app):
+    with app.app_context():
+        indexes = inspect(db.engine).get_indexes('users')
+
+    assert {(tuple(index['column_names']), bool(index['unique'])) for index in indexes} >= {
+        (('username',), True), (('email',), True),
+    }
+
+
+def test_pool_options_apply_to_server_databases_only():
+    assert 'pool_size' not in engine_options('sqlite:///auth.db')
+
+    options = engine_options('mysql+pymysql://user:pw@db/auth')
+    assert options['pool_pre_ping']
+    assert options['pool_recycle'] < 28800
+    assert options['pool_size'] > 0
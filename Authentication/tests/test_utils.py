@@ -0,0 +1,56 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from api import utils
+from api.utils import PasswordPool
+
+
+class FakeExecutor:
+    """Runs tasks inline; broken ones fail like a pool whose worker died."""
+
+    created = []
+
+    def __init__(self, max_workers, mp_context):
+        self.broken_on = None
+        self.shut_down = False
+        self.created.append(self)
+
+    def submit(self, fn, *args):
+        if self.broken_on == 'submit':
+            raise BrokenProcessPool('a worker died')
+        future = Future()
+        if self.broken_on == 'run':
+            future.set_exception(BrokenProcessPool('a worker died'))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeExecutor.created = []
+    monkeypatch.setattr(utils, 'ProcessPoolExecutor', FakeExecutor)
+    pool = PasswordPool()
+    pool.workers = 1
+    pool.max_pending = 2
+    return pool
+
+
+@pytest.mark.parametrize('broken_on', ['submit', 'run'])
+def test_broken_pool_is_replaced_and_frees_its_slot(pool, broken_on):
+    assert pool.run(abs, -1) == 1
+    broken = FakeExecutor.created[0]
+    broken.broken_on = broken_on
+
+    with pytest.raises(BrokenProcessPool):
+        pool.run(abs, -1)
+
+    assert pool._pending == 0
+    assert broken.shut_down
+    assert [pool.run(abs, -2) for _ in range(3)] == [2, 2, 2]
+    assert len(FakeExecutor.created) == 2
@@ -1,16 +1,21 @@
+import threading
 import time
 import uuid
-import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask, request, Response, g
 from flask_cors import CORS
-from pythonjsonlogger import jsonlogger
 from config import config
-from utils import proxy_request
+from utils import proxy_request, forward_headers, fetch, probe, build_log_handler
+from identity import authenticate, InvalidToken
+from ratelimit import rate_limiter, concurrency_limiter
+from cache import response_cache, cache_key, cacheable, entry_headers
+from pool import pool_stats
+from breaker import CircuitOpenError, HealthChecker, upstream_states
 from flask_talisman import Talisman
+import metrics
 
 # Initialize Flask app
 app = Flask(__name__)
+metrics.init_app(app)
 
 Talisman(
     app,
@@ -34,19 +39,13 @@ CORS(
 )
 
 # Logging setup
-handler = RotatingFileHandler(
-    filename=config.logging['file'],
-    maxBytes=10 * 1024 * 1024,
-    backupCount=5
-)
-handler.setLevel(config.logging.get('level', 'INFO'))
-formatter = jsonlogger.JsonFormatter(
-    fmt='%(levelname)s %(asctime)s %(message)s'
-)
-handler.setFormatter(formatter)
-app.logger.addHandler(handler)
+app.logger.addHandler(build_log_handler())
 app.logger.setLevel(config.logging.get('level', 'INFO'))
 
+# Active upstream health checks
+if config.resilience.get('health_check', {}).get('enabled', False):
+    HealthChecker(config.resilience['health_check'], probe).start()
+
 # Request tracing and timing
 @app.before_request
 def start_request():
@@ -55,6 +54,18 @@ def start_request():
     # Short-circuit CORS preflights
     if request.method == 'OPTIONS':
         return Response(status=200)
+    # Verify bearer tokens here so bad ones never reach an upstream
+    if request.path.startswith('/api/v2/'):
+        try:
+            g.user_id = authenticate(request.headers.get('Authorization'))
+        except InvalidToken as e:
+            return {'msg': str(e)}, 401
+
+        if rate_limiter is not None:
+            identity = g.user_id or f'ip:{request.remote_addr}'
+            retry_after = rate_limiter.check(identity, request.path)
+            if retry_after:
+                return {'msg': 'Too many requests'}, 429, {'Retry-After': str(retry_after)}
 
 @app.after_request
 def after_request(response):
@@ -83,37 +94,115 @@ def after_request(response):
 def health():
     return {'status': 'ok'}
 
-# Auth proxy
-@app.route('/api/v2/auth/<path:subpath>', methods=['GET','POST','PUT','PATCH','DELETE','OPTIONS'])
-def auth_proxy(subpath):
+# Upstream connection pool usage
+@app.route('/health/pools')
+def health_pools():
+    return pool_stats()
+
+# Circuit breaker and health check state per upstream
+@app.route('/health/upstreams')
+def health_upstreams():
+    return upstream_states()
+
+def _proxy(service):
+    # Shed load before the upstream falls over rather than queueing on it
+    if not concurrency_limiter.acquire(service):
+        return Response('Upstream busy', status=503, headers={'Retry-After': '1'})
+
     try:
-        return proxy_request(config.services['auth'], request)
+        response = proxy_request(config.services[service], request, g.user_id)
+    except CircuitOpenError as e:
+        concurrency_limiter.release(service)
+        return Response('Upstream unavailable', status=503, headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
+        concurrency_limiter.release(service)
         app.logger.error(
             'proxy error',
             extra={
                 'trace_id': g.trace_id,
-                'target': config.services['auth'],
+                'target': config.services[service],
                 'error': str(e)
             }
         )
         return Response('Upstream error', status=502)
 
-# Backend proxy
-@app.route('/api/v2/bd/<path:subpath>', methods=['GET','POST','PUT','PATCH','DELETE','OPTIONS'])
-def backend_proxy(subpath):
+    # Streamed responses stay in flight until the body has been sent
+    response.call_on_close(lambda: concurrency_limiter.release(service))
+    return response
+
+def _cached_response(entry, state):
+    headers = [('ETag', entry.etag), ('X-Cache', state)]
+    if entry.matches(request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    return Response(entry.body, entry.status, entry.headers + headers)
+
+def _revalidate(service, path, query, headers, key, rule):
     try:
-        return proxy_request(config.services['backend'], request)
+        status, response_headers, body = fetch(
+            config.services[service], path, query, headers, response_cache.max_body
+        )
+        if status == 200 and cacheable(response_headers, response_cache.max_body):
+            response_cache.put(key, status, entry_headers(response_headers), body, rule)
     except Exception as e:
         app.logger.error(
-            'proxy error',
+            'revalidation error',
             extra={
-                'trace_id': g.trace_id,
-                'target': config.services['backend'],
+                'target': config.services[service],
+                'path': path,
                 'error': str(e)
             }
         )
-        return Response('Upstream error', status=502)
+    finally:
+        response_cache.finish_revalidation(key)
+
+def _cached_proxy(service, rule):
+    key = cache_key('GET', request.path, request.query_string, g.user_id)
+    entry, fresh = response_cache.get(key)
+    if entry is not None:
+        if not fresh and response_cache.claim_revalidation(key):
+            # Serve the stale copy now and refresh it in the background
+            headers = forward_headers(request.headers, g.user_id)
+            for name in ('If-None-Match', 'If-Modified-Since'):
+                headers.pop(name, None)
+            threading.Thread(
+                target=_revalidate,
+                args=(service, request.path, request.query_string.decode(), headers, key, rule),
+                daemon=True
+            ).start()
+        return _cached_response(entry, 'HIT' if fresh else 'STALE')
+
+    response = _proxy(service)
+    if response.status_code != 200 or not cacheable(response.headers.items(), response_cache.max_body):
+        return response
+
+    # Content-Length is within max_body, so buffering the body is bounded
+    try:
+        body = response.get_data()
+    finally:
+        # Frees the concurrency slot even when the upstream resets mid-body
+        response.close()
+    entry = response_cache.put(key, 200, entry_headers(response.headers.items()), body, rule)
+    if entry is None:
+        return Response(body, response.status_code, response.headers)
+    return _cached_response(entry, 'MISS')
+
+def _route(service):
+    rule = response_cache.rule(request.path) if response_cache and request.method == 'GET' else None
+    # Without a verified identity, a request carrying credentials can't be
+    # keyed safely, so it always goes upstream
+    if rule is None or (not g.user_id and 'Authorization' in request.headers):
+        return _proxy(service)
+    return _cached_proxy(service, rule)
+
+# Auth proxy
+@app.route('/api/v2/auth/<path:subpath>', methods=['GET','POST','PUT','PATCH','DELETE','OPTIONS'])
+def auth_proxy(subpath):
+    return _route('auth')
+
+# Backend proxy
+@app.route('/api/v2/bd/<path:subpath>', methods=['GET','POST','PUT','PATCH','DELETE','OPTIONS'])
+def backend_proxy(subpath):
+    return _route('backend')
 
 if __name__ == '__main__':
     app.run(host=config.server['host'], port=config.server['port'])
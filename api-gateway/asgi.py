@@ -0,0 +1,431 @@
+"""Asyncio gateway engine.
+
+Serves the same routes as app.py, but proxies with aiohttp on an event loop
+so a slow upstream call holds a coroutine rather than a worker thread.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import contextlib
+import logging
+import time
+import uuid
+
+import aiohttp
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from config import config
+from metrics import IN_FLIGHT, metrics_response, observe_request, observe_upstream
+from identity import authenticate, cached_identity, revocation_list, InvalidToken
+from ratelimit import rate_limiter, concurrency_limiter
+from cache import response_cache, cache_key, cacheable, entry_headers
+from utils import HOP_BY_HOP_HEADERS, build_log_handler, probe
+from breaker import CircuitOpenError, HealthChecker, RETRYABLE_STATUSES, get_upstream, upstream_states
+
+logger = logging.getLogger('api-gateway')
+logger.addHandler(build_log_handler())
+logger.setLevel(config.logging.get('level', 'INFO'))
+
+# Mirrors the headers Talisman adds to the Flask engine's responses
+SECURITY_HEADERS = [
+    (b'x-frame-options', b'DENY'),
+    (b'x-content-type-options', b'nosniff'),
+    (b'referrer-policy', b'strict-origin-when-cross-origin'),
+    (b'permissions-policy', b'browsing-topics=()'),
+]
+
+clients = {}
+# Keeps background revalidations referenced until they finish
+revalidations = set()
+
+
+def _build_client(options):
+    maxsize = options.get('pool_maxsize', 50)
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=options.get('max_connections', maxsize),
+            limit_per_host=maxsize,
+            keepalive_timeout=options.get('idle_timeout', 60),
+        ),
+        timeout=aiohttp.ClientTimeout(
+            sock_connect=options.get('connect_timeout', 3.05),
+            sock_read=options.get('read_timeout', 30),
+        ),
+        # Shared by every client: never remember upstream cookies
+        cookie_jar=aiohttp.DummyCookieJar(),
+        auto_decompress=False,
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    for url in config.services.values():
+        clients[url] = _build_client(config.proxy)
+    # Probes are blocking, so they run on their own thread
+    health_checker = None
+    if config.resilience.get('health_check', {}).get('enabled', False):
+        health_checker = HealthChecker(config.resilience['health_check'], probe)
+        health_checker.start()
+    yield
+    if health_checker is not None:
+        health_checker.stop()
+    for client in clients.values():
+        await client.close()
+    clients.clear()
+
+
+class RequestLogMiddleware:
+    """Assigns a trace id, logs one line per request, records request metrics
+    and adds security headers."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        state = scope.setdefault('state', {})
+        state['trace_id'] = str(uuid.uuid4())
+        start = time.time()
+        metrics_start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + SECURITY_HEADERS
+                observe_request(scope['path'], scope['method'], message['status'],
+                                time.perf_counter() - metrics_start)
+                log_data = {
+                    'level': 'info',
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'trace_id': state['trace_id'],
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'status': message['status'],
+                    'duration': time.time() - start,
+                    'client_ip': scope['client'][0] if scope.get('client') else '',
+                    'user_id': state.get('user_id', '')
+                }
+                logger.info("request", extra=log_data)
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+
+
+class _UpstreamResponse(StreamingResponse):
+    """Streams an upstream response, then releases it and calls on_close once.
+
+    The body generator's finally only runs once iteration has started, so
+    sending also releases in a finally: a client gone before the first
+    chunk, or a cancelled send, would otherwise keep the upstream
+    connection and the concurrency slot.
+    """
+
+    def __init__(self, resp, chunk_size, on_close):
+        self._resp = resp
+        self._on_close = on_close
+        self._closed = False
+        super().__init__(self._body(chunk_size), status_code=resp.status)
+
+    async def _body(self, chunk_size):
+        try:
+            async for chunk in self._resp.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._resp.release()
+        if self._on_close is not None:
+            self._on_close()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.close()
+
+
+def _client(target_url):
+    client = clients.get(target_url)
+    if client is None:
+        client = clients[target_url] = _build_client(config.proxy)
+    return client
+
+
+def _forward_headers(request, user_id, skipped=('host', 'transfer-encoding')):
+    # Never trust an identity header sent by the client
+    identity_header = config.jwt.get('identity_header', 'X-User-Id')
+    skipped = skipped + (identity_header.lower(),)
+    headers = [(k, v) for k, v in request.headers.items() if k not in skipped]
+    if user_id:
+        headers.append((identity_header, user_id))
+    return headers
+
+
+async def proxy_request(target_url, request, user_id='', on_close=None):
+    streaming = config.proxy.get('streaming', True)
+    chunk_size = config.proxy.get('chunk_size', 64 * 1024)
+
+    # Build proxied URL
+    query = request.url.query
+    url = f"{target_url}{request.url.path}" + (f"?{query}" if query else "")
+
+    # Forward headers and body; aiohttp re-chunks bodies of unknown length
+    headers = _forward_headers(request, user_id)
+    has_body = request.headers.get('content-length', '0') != '0' or \
+        request.headers.get('transfer-encoding', '').lower() == 'chunked'
+    if not has_body:
+        data = None
+    elif streaming:
+        data = request.stream()
+    else:
+        data = await request.body()
+
+    upstream = get_upstream(target_url)
+    upstream.budget.record_request()
+    replayable = data is None or isinstance(data, bytes)
+    attempt = 0
+    while True:
+        # Fails fast with CircuitOpenError while the upstream is unhealthy
+        upstream.breaker.before_call()
+        start = time.monotonic()
+        try:
+            resp = await _client(target_url).request(
+                request.method,
+                url,
+                headers=headers,
+                data=data,
+                allow_redirects=False
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            duration = time.monotonic() - start
+            upstream.breaker.record(True, duration)
+            observe_upstream(upstream.name, 'error', duration)
+            if not upstream.should_retry(request.method, replayable, attempt):
+                raise
+        except BaseException:
+            # Cancelled, or failed in a way that says nothing about the
+            # upstream; don't keep a half-open probe slot
+            upstream.breaker.release()
+            raise
+        else:
+            duration = time.monotonic() - start
+            upstream.breaker.record(resp.status >= 500, duration)
+            observe_upstream(upstream.name, resp.status, duration)
+            if resp.status not in RETRYABLE_STATUSES or \
+                    not upstream.should_retry(request.method, replayable, attempt):
+                break
+            resp.release()
+
+        await asyncio.sleep(upstream.backoff(attempt))
+        attempt += 1
+
+    response = _UpstreamResponse(resp, chunk_size, on_close)
+    response.raw_headers = [
+        (name, value) for (name, value) in resp.raw_headers
+        if name.decode('latin-1').lower() not in HOP_BY_HOP_HEADERS
+    ]
+    return response
+
+
+async def _proxy(service, request):
+    # Shed load before the upstream falls over rather than queueing on it
+    if not concurrency_limiter.acquire(service):
+        return PlainTextResponse('Upstream busy', status_code=503, headers={'Retry-After': '1'})
+
+    try:
+        return await proxy_request(config.services[service], request, request.state.user_id,
+                                   on_close=lambda: concurrency_limiter.release(service))
+    except CircuitOpenError as e:
+        concurrency_limiter.release(service)
+        return PlainTextResponse('Upstream unavailable', status_code=503,
+                                 headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        concurrency_limiter.release(service)
+        logger.error(
+            'proxy error',
+            extra={
+                'trace_id': request.state.trace_id,
+                'target': config.services[service],
+                'error': str(e)
+            }
+        )
+        return PlainTextResponse('Upstream error', status_code=502)
+    except BaseException:
+        # Cancelled before a response existed to release the slot
+        concurrency_limiter.release(service)
+        raise
+
+
+def _encode_headers(headers):
+    return [(name.encode('latin-1'), value.encode('latin-1')) for (name, value) in headers]
+
+
+def _decode_headers(raw_headers):
+    return [(name.decode('latin-1'), value.decode('latin-1')) for (name, value) in raw_headers]
+
+
+def _cached_response(request, entry, state):
+    headers = [('ETag', entry.etag), ('X-Cache', state)]
+    if entry.matches(request.headers.get('if-none-match')):
+        response = Response(status_code=304)
+        response.raw_headers = _encode_headers(headers)
+        return response
+    response = Response(entry.body, status_code=entry.status)
+    response.raw_headers = _encode_headers(entry.headers + headers) + \
+        [(b'content-length', str(len(entry.body)).encode())]
+    return response
+
+
+async def _revalidate(service, url, headers, key, rule):
+    try:
+        async with _client(config.services[service]).get(url, headers=headers, allow_redirects=False) as resp:
+            response_headers = _decode_headers(resp.raw_headers)
+            if resp.status != 200 or not cacheable(response_headers, response_cache.max_body):
+                return
+            body = await resp.read()
+        response_cache.put(key, resp.status, entry_headers(response_headers), body, rule)
+    except Exception as e:
+        logger.error(
+            'revalidation error',
+            extra={
+                'target': config.services[service],
+                'path': url,
+                'error': str(e)
+            }
+        )
+    finally:
+        response_cache.finish_revalidation(key)
+
+
+async def _cached_proxy(service, request, rule):
+    key = cache_key('GET', request.url.path, request.scope['query_string'], request.state.user_id)
+    entry, fresh = response_cache.get(key)
+    if entry is not None:
+        if not fresh and response_cache.claim_revalidation(key):
+            # Serve the stale copy now and refresh it in the background
+            headers = _forward_headers(
+                request, request.state.user_id,
+                skipped=('host', 'transfer-encoding', 'if-none-match', 'if-modified-since')
+            )
+            query = request.url.query
+            url = f"{config.services[service]}{request.url.path}" + (f"?{query}" if query else "")
+            task = asyncio.create_task(_revalidate(service, url, headers, key, rule))
+            revalidations.add(task)
+            task.add_done_callback(revalidations.discard)
+        return _cached_response(request, entry, 'HIT' if fresh else 'STALE')
+
+    response = await _proxy(service, request)
+    response_headers = _decode_headers(response.raw_headers)
+    if response.status_code != 200 or not cacheable(response_headers, response_cache.max_body):
+        return response
+
+    # Content-Length is within max_body, so buffering the body is bounded
+    body = b''.join([chunk async for chunk in response.body_iterator])
+    entry = response_cache.put(key, 200, entry_headers(response_headers), body, rule)
+    if entry is None:
+        uncached = Response(body, status_code=response.status_code)
+        uncached.raw_headers = response.raw_headers
+        return uncached
+    return _cached_response(request, entry, 'MISS')
+
+
+async def _route(service, request):
+    # Verify bearer tokens here so bad ones never reach an upstream
+    authorization = request.headers.get('authorization')
+    try:
+        user_id = cached_identity(authorization)
+        if user_id is None:
+            # The revocation check asks Redis, which blocks
+            if revocation_list is not None:
+                user_id = await run_in_threadpool(authenticate, authorization)
+            else:
+                user_id = authenticate(authorization)
+        request.state.user_id = user_id
+    except InvalidToken as e:
+        return JSONResponse({'msg': str(e)}, status_code=401)
+
+    if rate_limiter is not None:
+        identity = request.state.user_id or f'ip:{request.client.host if request.client else ""}'
+        if rate_limiter.store.blocking:
+            retry_after = await run_in_threadpool(rate_limiter.check, identity, request.url.path)
+        else:
+            retry_after = rate_limiter.check(identity, request.url.path)
+        if retry_after:
+            return JSONResponse({'msg': 'Too many requests'}, status_code=429,
+                                headers={'Retry-After': str(retry_after)})
+
+    rule = response_cache.rule(request.url.path) if response_cache and request.method == 'GET' else None
+    # Without a verified identity, a request carrying credentials can't be
+    # keyed safely, so it always goes upstream
+    if rule is None or (not request.state.user_id and 'authorization' in request.headers):
+        return await _proxy(service, request)
+    return await _cached_proxy(service, request, rule)
+
+
+# Health check
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def metrics(request):
+    body, content_type = metrics_response()
+    return Response(body, headers={'Content-Type': content_type})
+
+
+# Circuit breaker and health check state per upstream
+async def health_upstreams(request):
+    return JSONResponse(upstream_states())
+
+
+# Auth proxy
+async def auth_proxy(request):
+    return await _route('auth', request)
+
+
+# Backend proxy
+async def backend_proxy(request):
+    return await _route('backend', request)
+
+
+PROXY_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+
+app = Starlette(
+    routes=[
+        Route('/health', health),
+        Route('/health/upstreams', health_upstreams),
+        Route('/metrics', metrics),
+        Route('/api/v2/auth/{subpath:path}', auth_proxy, methods=PROXY_METHODS),
+        Route('/api/v2/bd/{subpath:path}', backend_proxy, methods=PROXY_METHODS),
+    ],
+    middleware=[
+        Middleware(RequestLogMiddleware),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=config.cors.get("origins", []),
+            allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+            allow_headers=["Authorization", "Content-Type"],
+            allow_credentials=True
+        ),
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=config.server['host'], port=config.server['port'])
@@ -0,0 +1,67 @@
+"""Micro-benchmark: per-request cost of the metrics hooks.
+
+Times the work the gateway adds to every request (two clock reads, the
+in-flight gauge, the route label, a counter and a histogram observation)
+and a full Flask request with and without the hooks installed.
+
+    cd api-gateway && python benchmarks/metrics_overhead.py
+"""
+import argparse
+import os
+import sys
+import time
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GATEWAY_DIR)
+os.chdir(GATEWAY_DIR)
+
+from flask import Flask  # noqa: E402
+
+import metrics  # noqa: E402
+
+
+def per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def observe_once():
+    start = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+    metrics.observe_request('/api/v2/bd/youtube/videos', 'GET', 200, time.perf_counter() - start)
+    metrics.IN_FLIGHT.dec()
+
+
+def build_app(instrumented):
+    app = Flask(__name__)
+    if instrumented:
+        metrics.init_app(app)
+
+    @app.route('/api/v2/bd/<path:path>')
+    def handler(path):
+        return 'ok'
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f'observe only:      {per_call(observe_once, args.iterations * 10):8.2f} us/request')
+
+    results = {}
+    for instrumented in (False, True):
+        client = build_app(instrumented).test_client()
+        results[instrumented] = per_call(
+            lambda: client.get('/api/v2/bd/youtube/videos').close(), args.iterations)
+    print(f'flask, no metrics: {results[False]:8.2f} us/request')
+    print(f'flask, metrics:    {results[True]:8.2f} us/request '
+          f'(+{(results[True] - results[False]) / results[False]:.1%})')
+
+
+if __name__ == '__main__':
+    main()
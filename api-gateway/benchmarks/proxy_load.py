@@ -0,0 +1,157 @@
+"""Load benchmark: Flask gateway engine vs. the asyncio (ASGI) engine.
+
+Starts a stub upstream that answers after a fixed delay (standing in for a
+slow LLM call), runs each engine in its own process pointed at it, and
+drives both with the same number of concurrent clients.
+
+    cd api-gateway && python benchmarks/proxy_load.py --concurrency 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UPSTREAM_PORT = 18001
+ENGINES = {
+    'flask': 18080,
+    'asgi': 18081,
+}
+
+
+async def run_upstream(port, delay):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                if not head:
+                    break
+                await asyncio.sleep(delay)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: 11\r\n\r\n{"ok":true}')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+def serve(engine, port, upstream):
+    sys.path.insert(0, GATEWAY_DIR)
+    os.chdir(GATEWAY_DIR)
+    from config import config
+
+    config.services = {'auth': upstream, 'backend': upstream}
+    config.logging['file'] = os.devnull
+
+    if engine == 'flask':
+        import logging
+        from werkzeug.serving import run_simple
+        from app import app
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        run_simple('127.0.0.1', port, app, threaded=True)
+    else:
+        import uvicorn
+        from asgi import app
+
+        uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+
+async def load(url, concurrency, total):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    async with client.get(url) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'rps': total / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+def wait_for(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--delay', type=float, default=0.1, help='upstream latency in seconds')
+    parser.add_argument('--serve', nargs=2, metavar=('ENGINE', 'PORT'), help=argparse.SUPPRESS)
+    parser.add_argument('--upstream', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve[0], int(args.serve[1]), args.upstream)
+
+    upstream = f'http://127.0.0.1:{UPSTREAM_PORT}'
+    procs = [subprocess.Popen([sys.executable, '-c',
+                               'import asyncio, sys; sys.path.insert(0, sys.argv[1]); '
+                               'import proxy_load; asyncio.run(proxy_load.run_upstream(int(sys.argv[2]), float(sys.argv[3])))',
+                               os.path.dirname(os.path.abspath(__file__)), str(UPSTREAM_PORT), str(args.delay)])]
+    try:
+        for engine, port in ENGINES.items():
+            procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                           '--serve', engine, str(port), '--upstream', upstream],
+                                           stderr=subprocess.DEVNULL))
+
+        print(f'upstream delay {args.delay * 1000:.0f}ms, '
+              f'{args.requests} requests, concurrency {args.concurrency}')
+        for engine, port in ENGINES.items():
+            wait_for(f'http://127.0.0.1:{port}/health')
+            result = asyncio.run(load(f'http://127.0.0.1:{port}/api/v2/bd/youtube/status',
+                                      args.concurrency, args.requests))
+            print(f"{engine:>6}: {result['rps']:8.1f} req/s  p50 {result['p50_ms']:7.1f}ms  "
+                  f"p99 {result['p99_ms']:7.1f}ms  errors {result['errors']}")
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
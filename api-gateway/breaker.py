@@ -0,0 +1,243 @@
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from config import config
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Safe to send twice; requests with a streamed body are never replayed
+RETRYABLE_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRYABLE_STATUSES = {502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'circuit open for {name}')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Trips when too many recent calls failed or were slow.
+
+    Calls are tracked over a sliding window. Once open, calls fail fast for
+    open_seconds, then a few probe calls decide whether to close again. A
+    failing health check also fails calls fast, whatever the state.
+    """
+
+    def __init__(self, name, options):
+        self.name = name
+        self.window = options.get('window', 30)
+        self.min_requests = options.get('min_requests', 20)
+        self.error_rate = options.get('error_rate', 0.5)
+        self.slow_call = options.get('slow_call', 5)
+        self.slow_rate = options.get('slow_rate', 0.8)
+        self.open_seconds = options.get('open_seconds', 15)
+        self.half_open_calls = options.get('half_open_calls', 3)
+
+        self.state = CLOSED
+        self.healthy = True
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go upstream now.
+
+        A call let through must end in record(), or in release() if it
+        ended without an outcome, or a half-open probe slot stays taken.
+        """
+        with self._lock:
+            if not self.healthy:
+                raise CircuitOpenError(self.name, self.open_seconds)
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, math.ceil(remaining))
+                self.state = HALF_OPEN
+                self._probes = 0
+                self._successes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    raise CircuitOpenError(self.name, 1)
+                self._probes += 1
+
+    def record(self, failed, duration):
+        now = time.monotonic()
+        slow = duration >= self.slow_call
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._successes += 1
+                    if self._successes >= self.half_open_calls:
+                        self.state = CLOSED
+                return
+            if self.state == OPEN:
+                return
+
+            self._calls.append((now, failed, slow))
+            self._failures += failed
+            self._slow += slow
+            while self._calls and self._calls[0][0] < now - self.window:
+                _, old_failed, old_slow = self._calls.popleft()
+                self._failures -= old_failed
+                self._slow -= old_slow
+
+            total = len(self._calls)
+            if total >= self.min_requests and (
+                    self._failures / total >= self.error_rate or self._slow / total >= self.slow_rate):
+                self._open(now)
+
+    def release(self):
+        """Give back the slot of a call that ended saying nothing about the upstream.
+
+        Such as one cancelled because the client went away.
+        """
+        with self._lock:
+            # Only probes still waiting for an outcome hold a slot
+            if self.state == HALF_OPEN and self._probes > self._successes:
+                self._probes -= 1
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+    def to_dict(self):
+        with self._lock:
+            return {'state': self.state, 'healthy': self.healthy}
+
+
+class RetryBudget:
+    """Allows retries up to a ratio of recent requests, plus a small floor.
+
+    Stops retries from multiplying load on an upstream that is already
+    failing most requests.
+    """
+
+    def __init__(self, ratio, minimum, window):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, events, now):
+        while events and events[0] < now - self.window:
+            events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._requests.append(now)
+            self._prune(self._requests, now)
+
+    def try_retry(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(self._retries, now)
+            self._prune(self._requests, now)
+            if len(self._retries) >= max(self.minimum, self.ratio * len(self._requests)):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class Upstream:
+    """Breaker, retry budget and retry policy for one upstream service."""
+
+    def __init__(self, name, options):
+        retries = options.get('retries', {})
+        self.name = name
+        self.breaker = CircuitBreaker(name, options.get('circuit_breaker', {}))
+        self.budget = RetryBudget(
+            retries.get('budget_ratio', 0.2),
+            retries.get('budget_min', 3),
+            retries.get('budget_window', 10)
+        )
+        self.max_retries = retries.get('max_retries', 2)
+        self.backoff_base = retries.get('backoff_base', 0.05)
+        self.backoff_max = retries.get('backoff_max', 1)
+
+    def should_retry(self, method, replayable, attempt):
+        return method in RETRYABLE_METHODS and replayable \
+            and attempt < self.max_retries and self.budget.try_retry()
+
+    def backoff(self, attempt):
+        # Full jitter keeps retrying gateway threads from synchronising
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class HealthChecker(threading.Thread):
+    """Probes each service's health endpoint and marks its breaker.
+
+    A service turns unhealthy after unhealthy_threshold failed probes in a
+    row and healthy again after healthy_threshold good ones.
+    """
+
+    def __init__(self, options, probe):
+        super().__init__(name='upstream-health-checker', daemon=True)
+        self.path = options.get('path', '/health')
+        self.interval = options.get('interval', 5)
+        self.timeout = options.get('timeout', 2)
+        self.unhealthy_threshold = options.get('unhealthy_threshold', 3)
+        self.healthy_threshold = options.get('healthy_threshold', 2)
+        self.probe = probe
+        self._streaks = {}
+        self._stopped = threading.Event()
+
+    def check(self, url):
+        try:
+            ok = self.probe(url, self.path, self.timeout)
+        except Exception:
+            ok = False
+
+        breaker = get_upstream(url).breaker
+        streak_ok, streak = self._streaks.get(url, (ok, 0))
+        streak = streak + 1 if streak_ok == ok else 1
+        self._streaks[url] = (ok, streak)
+        if ok and streak >= self.healthy_threshold:
+            breaker.healthy = True
+        elif not ok and streak >= self.unhealthy_threshold:
+            breaker.healthy = False
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for url in config.services.values():
+                self.check(url)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(target_url):
+    upstream = _upstreams.get(target_url)
+    if upstream is None:
+        with _upstreams_lock:
+            upstream = _upstreams.get(target_url)
+            if upstream is None:
+                name = next((n for n, url in config.services.items() if url == target_url), target_url)
+                upstream = _upstreams[target_url] = Upstream(name, config.resilience)
+    return upstream
+
+
+def upstream_states():
+    return {upstream.name: upstream.breaker.to_dict() for upstream in list(_upstreams.values())}
@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import config
+
+# Rough per-entry bookkeeping cost on top of the body and headers
+ENTRY_OVERHEAD = 256
+
+
+class CachedResponse:
+
+    def __init__(self, status, headers, body, ttl, stale_while_revalidate):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.stored_at = time.monotonic()
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers) + ENTRY_OVERHEAD
+
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+    def matches(self, if_none_match):
+        """Whether an If-None-Match header value covers this entry."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return self.etag in tags or f'W/{self.etag}' in tags
+
+
+class ResponseCache:
+    """LRU of upstream GET responses bounded by a total byte budget.
+
+    Entries are fresh for their route's ttl, then may still be served for
+    stale_while_revalidate seconds while a single refresh runs.
+    """
+
+    def __init__(self, max_bytes, max_body, routes):
+        self.max_bytes = max_bytes
+        self.max_body = max_body
+        self.routes = sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+        self.size = 0
+        self._entries = OrderedDict()
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    def rule(self, path):
+        for prefix, rule in self.routes:
+            if path.startswith(prefix):
+                return rule
+        return None
+
+    def get(self, key):
+        """Return (entry, fresh), or (None, False) when nothing usable is cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            age = entry.age()
+            if age > entry.ttl + entry.stale_while_revalidate:
+                self._remove(key)
+                return None, False
+            self._entries.move_to_end(key)
+            return entry, age <= entry.ttl
+
+    def put(self, key, status, headers, body, rule):
+        if len(body) > self.max_body:
+            return None
+        entry = CachedResponse(status, headers, body, rule['ttl'], rule.get('stale_while_revalidate', 0))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def claim_revalidation(self, key):
+        """True for the one caller that should refresh a stale entry."""
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def finish_revalidation(self, key):
+        with self._lock:
+            self._revalidating.discard(key)
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key).size
+
+
+def cache_key(method, path, query, user_id):
+    return (method, path, query, user_id)
+
+
+def entry_headers(response_headers):
+    """Headers worth storing; length and ETag are recomputed when serving."""
+    excluded = ('transfer-encoding', 'connection', 'content-length', 'etag')
+    return [(name, value) for (name, value) in response_headers if name.lower() not in excluded]
+
+
+def cacheable(response_headers, max_body):
+    """Only cache bodies of known length, up to max_body, that the upstream hasn't marked private.
+
+    Callers buffer the body only after this passes, so a response too large
+    to cache streams through instead of being read into memory first.
+    """
+    headers = {name.lower(): value for name, value in response_headers}
+    length = headers.get('content-length', '').strip()
+    if not length.isdigit() or int(length) > max_body:
+        return False
+    cache_control = headers.get('cache-control', '').lower()
+    return 'set-cookie' not in headers and 'no-store' not in cache_control and 'no-cache' not in cache_control
+
+
+_options = config.response_cache
+response_cache = ResponseCache(
+    _options.get('max_bytes', 64 * 1024 * 1024),
+    _options.get('max_body', 1024 * 1024),
+    _options.get('routes', {})
+) if _options.get('enabled', False) else None
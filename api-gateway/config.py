@@ -7,7 +7,12 @@ class Config:
         self.server = data.get("server", {})
         self.cors = data.get("cors", {})
         self.services = data.get("services", {})
+        self.proxy = data.get("proxy", {})
+        self.resilience = data.get("resilience", {})
         self.jwt = data.get("jwt", {})
+        self.rate_limit = data.get("rate_limit", {})
+        self.response_cache = data.get("response_cache", {})
         self.logging = data.get("logging", {})
+        self.metrics = data.get("metrics", {})
 
 config = Config()
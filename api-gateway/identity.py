@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+import redis
+from jwt_revocation import lookup
+
+from config import config
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenCache:
+    """LRU of verified tokens, each kept only until the token expires."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user_id
+
+    def set(self, token, user_id, expires_at):
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class RevocationList:
+    """Tokens the auth service revoked, by jti or by session id (sid).
+
+    Only read here. When Redis is unreachable checks fail open.
+    """
+
+    def __init__(self, r):
+        self.r = r
+
+    def is_revoked(self, claims):
+        try:
+            return lookup(self.r, claims)
+        except redis.RedisError:
+            return False
+
+
+token_cache = TokenCache(config.jwt.get('cache_size', 10000))
+
+_revocation = config.jwt.get('revocation', {})
+revocation_list = RevocationList(
+    redis.Redis.from_url(
+        # The auth service's setting wins, so every service reads one list
+        os.getenv('REVOCATION_REDIS_URL', _revocation['redis_url']),
+        socket_timeout=_revocation.get('timeout', 0.5),
+        socket_connect_timeout=_revocation.get('timeout', 0.5)
+    )
+) if _revocation.get('enabled', False) else None
+# Verified tokens are checked against the list again after this long
+REVOCATION_RECHECK = _revocation.get('recheck', 5)
+
+
+def bearer_token(authorization):
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def verify_token(token):
+    """Return the identity carried by a token signed with the shared JWT secret.
+
+    Raises InvalidToken when the signature, expiry or claims don't check out.
+    """
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    try:
+        claims = jwt.decode(
+            token,
+            config.jwt['secret'],
+            algorithms=config.jwt.get('algorithms', ['HS256']),
+            leeway=config.jwt.get('leeway', 0),
+            options={'require': ['sub']}
+        )
+    except jwt.ExpiredSignatureError:
+        raise InvalidToken('Token has expired')
+    except jwt.InvalidTokenError as e:
+        raise InvalidToken(str(e))
+
+    if revocation_list is not None and revocation_list.is_revoked(claims):
+        raise InvalidToken('Token has been revoked')
+
+    user_id = str(claims['sub'])
+    if 'exp' in claims:
+        expires_at = claims['exp']
+        if revocation_list is not None:
+            expires_at = min(expires_at, time.time() + REVOCATION_RECHECK)
+        token_cache.set(token, user_id, expires_at)
+    return user_id
+
+
+def cached_identity(authorization):
+    """What authenticate would return, if it can answer without I/O; otherwise None."""
+    if not config.jwt.get('verify', True):
+        return ''
+    token = bearer_token(authorization)
+    if token is None:
+        return ''
+    return token_cache.get(token)
+
+
+def authenticate(authorization):
+    """Identity for an Authorization header, or '' when it carries no bearer token."""
+    if not config.jwt.get('verify', True):
+        return ''
+    token = bearer_token(authorization)
+    if token is None:
+        return ''
+    return verify_token(token)
@@ -0,0 +1,133 @@
+import atexit
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler
+
+from metrics import LOG_DROPPED, LOG_QUEUE_DEPTH
+
+DROP = 'drop'
+BLOCK = 'block'
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to a bounded queue instead of writing them inline.
+
+    Successful request lines can be sampled. When the queue is full a
+    record is either dropped straight away or, with the block policy, the
+    caller waits up to block_timeout for room before dropping it. Warnings
+    and errors are never sampled out.
+    """
+
+    def __init__(self, records, overflow=DROP, block_timeout=1.0, sample_rate=1.0):
+        super().__init__(records)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.sample_rate = sample_rate
+
+    def handle(self, record):
+        # The queue does its own locking; taking the handler lock as well
+        # would serialise request threads behind a blocked put
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def emit(self, record):
+        if self.sample_rate < 1 and getattr(record, 'status', 500) < 400 \
+                and random.random() >= self.sample_rate:
+            LOG_DROPPED.labels('sampled').inc()
+            return
+        # Formatting is left to the writer thread; the request fields are
+        # plain values, so the record can cross threads as it is
+        try:
+            if self.overflow == BLOCK:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels('queue_full').inc()
+
+
+class BatchWriter(threading.Thread):
+    """Drains the log queue and writes records to a rotating file in batches.
+
+    A batch is written once batch_size records are waiting or flush_interval
+    has passed, with one write and one flush under the file handler's lock.
+    """
+
+    def __init__(self, records, handler, batch_size=256, flush_interval=0.5):
+        super().__init__(name='log-writer', daemon=True)
+        self.records = records
+        self.handler = handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not (self._stopped.is_set() and self.records.empty()):
+            batch = []
+            try:
+                batch.append(self.records.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.write(batch)
+
+    def write(self, batch):
+        handler = self.handler
+        lines = []
+        for record in batch:
+            if record.levelno < handler.level:
+                continue
+            try:
+                lines.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+        if not lines:
+            return
+        data = ''.join(lines)
+
+        with handler.lock:
+            try:
+                if handler.stream is None:
+                    handler.stream = handler._open()
+                # Checked once per batch, so a file can run past maxBytes
+                # by at most one batch before it rotates
+                if handler.maxBytes and handler.stream.tell() \
+                        and handler.stream.tell() + len(data) >= handler.maxBytes:
+                    handler.doRollover()
+                handler.stream.write(data)
+                handler.stream.flush()
+            except Exception:
+                handler.handleError(batch[-1])
+
+    def stop(self):
+        """Write out whatever is still queued, then exit."""
+        self._stopped.set()
+        self.join(self.flush_interval * 4)
+
+
+def queued(handler, options):
+    """Wrap a RotatingFileHandler so records are written off the request path."""
+    records = queue.Queue(maxsize=options.get('queue_size', 10000))
+    writer = BatchWriter(
+        records,
+        handler,
+        options.get('batch_size', 256),
+        options.get('flush_interval', 0.5)
+    )
+    writer.start()
+    LOG_QUEUE_DEPTH.set_function(records.qsize)
+    atexit.register(writer.stop)
+
+    queue_handler = BoundedQueueHandler(
+        records,
+        options.get('overflow', DROP),
+        options.get('block_timeout', 1.0),
+        options.get('sample_rate', 1.0)
+    )
+    queue_handler.setLevel(handler.level)
+    return queue_handler
@@ -0,0 +1,92 @@
+import time
+
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from config import config
+
+# Requests and upstream calls include LLM completions, which take far
+# longer than the default buckets reach
+UPSTREAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUESTS = Counter(
+    'gateway_requests_total', 'Requests handled by the gateway',
+    ['route', 'method', 'status']
+)
+LATENCY = Histogram(
+    'gateway_request_duration_seconds', 'Time until the gateway returned response headers',
+    ['route', 'status'], buckets=UPSTREAM_BUCKETS
+)
+IN_FLIGHT = Gauge('gateway_requests_in_flight', 'Requests currently being handled')
+UPSTREAM_LATENCY = Histogram(
+    'gateway_upstream_duration_seconds', 'Time until an upstream returned response headers',
+    ['upstream', 'status'], buckets=UPSTREAM_BUCKETS
+)
+LOG_DROPPED = Counter(
+    'gateway_log_records_dropped_total', 'Log records not written, by reason (queue_full or sampled)',
+    ['reason']
+)
+RATE_LIMIT_ERRORS = Counter(
+    'gateway_rate_limit_errors_total', 'Rate limit checks let through because the shared store was unreachable'
+)
+LOG_QUEUE_DEPTH = Gauge('gateway_log_queue_depth', 'Log records waiting for the writer thread')
+
+
+# Longest first, so the most specific configured route wins
+ROUTES = sorted(config.metrics.get('routes', ['/health', '/metrics', '/api/v2/auth', '/api/v2/bd']),
+                key=len, reverse=True)
+
+
+def route_label(path):
+    """The configured route a path falls under, or 'other'.
+
+    Labels only ever come from config, whatever the status, so arbitrary
+    client paths can't blow up label cardinality.
+    """
+    for route in ROUTES:
+        if path == route or path.startswith(route.rstrip('/') + '/'):
+            return route
+    return 'other'
+
+
+def observe_request(path, method, status, duration):
+    route = route_label(path)
+    REQUESTS.labels(route, method, status).inc()
+    LATENCY.labels(route, status).observe(duration)
+
+
+def observe_upstream(upstream, status, duration):
+    UPSTREAM_LATENCY.labels(upstream, status).observe(duration)
+
+
+def metrics_response():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    """Register request metrics hooks and the /metrics route.
+
+    Call before any other before_request hook is registered, so requests
+    rejected early (preflights, bad tokens, rate limits) are counted too.
+    """
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            observe_request(request.path, request.method, response.status_code, time.perf_counter() - start)
+        return response
+
+    @app.teardown_request
+    def finish_metrics(exc):
+        IN_FLIGHT.dec()
+
+    @app.route('/metrics')
+    def metrics():
+        body, content_type = metrics_response()
+        return Response(body, content_type=content_type)
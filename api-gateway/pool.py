@@ -0,0 +1,128 @@
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import config
+
+
+class PoolStats:
+    """Connection checkout counters for a single upstream."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.hits = 0
+        self.evictions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, reused, waited, evicted):
+        with self._lock:
+            self.checkouts += 1
+            self.hits += reused
+            self.evictions += evicted
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def to_dict(self):
+        with self._lock:
+            checkouts = self.checkouts
+            return {
+                'checkouts': checkouts,
+                'hits': self.hits,
+                'misses': checkouts - self.hits,
+                'hit_rate': self.hits / checkouts if checkouts else 0.0,
+                'evictions': self.evictions,
+                'wait_avg': self.wait_total / checkouts if checkouts else 0.0,
+                'wait_max': self.wait_max,
+            }
+
+
+class _InstrumentedPoolMixin:
+    # Set on the per-upstream subclasses built in UpstreamPool
+    stats = None
+    idle_timeout = None
+
+    def _get_conn(self, timeout=None):
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout)
+        waited = time.perf_counter() - start
+
+        # Evict keep-alive connections that sat idle long enough for the
+        # upstream (or a proxy in between) to have dropped them
+        evicted = False
+        last_used = getattr(conn, '_last_used', None)
+        if (conn.sock is not None and last_used is not None and self.idle_timeout
+                and time.monotonic() - last_used > self.idle_timeout):
+            conn.close()
+            evicted = True
+
+        self.stats.record(conn.sock is not None, waited, evicted)
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._last_used = time.monotonic()
+        super()._put_conn(conn)
+
+
+class UpstreamPool:
+    """Keep-alive ``requests`` session dedicated to one upstream service."""
+
+    def __init__(self, name, base_url, options):
+        self.name = name
+        self.base_url = base_url
+        self.stats = PoolStats()
+        self.timeout = (
+            options.get('connect_timeout', 3.05),
+            options.get('read_timeout', 30),
+        )
+
+        adapter = HTTPAdapter(
+            pool_connections=options.get('pool_connections', 10),
+            pool_maxsize=options.get('pool_maxsize', 50),
+            pool_block=options.get('pool_block', False),
+            max_retries=0,
+        )
+        attrs = {'stats': self.stats, 'idle_timeout': options.get('idle_timeout', 60)}
+        adapter.poolmanager.pool_classes_by_scheme = {
+            'http': type('HTTPUpstreamPool', (_InstrumentedPoolMixin, HTTPConnectionPool), attrs),
+            'https': type('HTTPSUpstreamPool', (_InstrumentedPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+        self.session = requests.Session()
+        # The session is shared by every client: never remember upstream
+        # cookies, and don't pick up proxy settings from the environment
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.session.trust_env = False
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+
+_pools = {
+    url: UpstreamPool(name, url, config.proxy)
+    for name, url in config.services.items()
+}
+_pools_lock = threading.Lock()
+
+
+def get_pool(target_url):
+    pool = _pools.get(target_url)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(target_url)
+            if pool is None:
+                pool = _pools[target_url] = UpstreamPool(target_url, target_url, config.proxy)
+    return pool
+
+
+def pool_stats():
+    return {pool.name: pool.stats.to_dict() for pool in list(_pools.values())}
@@ -0,0 +1,151 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from config import config
+from metrics import RATE_LIMIT_ERRORS
+
+# Refill and take one token atomically. Tokens are returned as a string
+# because Redis truncates Lua numbers to integers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class MemoryStore:
+    """Token buckets held in this process, oldest evicted past max_keys."""
+
+    blocking = False
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class RedisStore:
+    """Token buckets shared by every gateway process through Redis.
+
+    When Redis is unreachable requests are let through rather than failed,
+    and counted in gateway_rate_limit_errors_total.
+    """
+
+    blocking = True
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, burst, now):
+        try:
+            allowed, tokens = self._script(keys=[self.prefix + key], args=[rate, burst, now])
+        except redis.RedisError:
+            RATE_LIMIT_ERRORS.inc()
+            return True, burst
+        return bool(allowed), float(tokens)
+
+
+class RateLimiter:
+    """Per-identity token buckets, one set per configured route prefix.
+
+    Paths are matched against the longest configured prefix; anything else
+    shares the default bucket.
+    """
+
+    def __init__(self, store, default, routes):
+        self.store = store
+        self.default = default
+        self.routes = sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _rule(self, path):
+        for prefix, rule in self.routes:
+            if path.startswith(prefix):
+                return prefix, rule
+        return '*', self.default
+
+    def check(self, identity, path):
+        """Seconds to wait before retrying, or 0 when the request may proceed."""
+        prefix, rule = self._rule(path)
+        if not rule:
+            return 0
+        rate, burst = rule['rate'], rule.get('burst', rule['rate'])
+        allowed, tokens = self.store.take(f'{prefix}:{identity}', rate, burst, time.time())
+        if allowed:
+            return 0
+        return max(1, math.ceil((1 - tokens) / rate))
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests per upstream, rejecting instead of queueing."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.in_flight = {name: 0 for name in limits}
+        self._lock = threading.Lock()
+
+    def acquire(self, name):
+        limit = self.limits.get(name)
+        if not limit:
+            return True
+        with self._lock:
+            if self.in_flight[name] >= limit:
+                return False
+            self.in_flight[name] += 1
+            return True
+
+    def release(self, name):
+        if not self.limits.get(name):
+            return
+        with self._lock:
+            self.in_flight[name] -= 1
+
+
+def build_store(options):
+    if options.get('store', 'memory') == 'redis':
+        return RedisStore(redis.Redis.from_url(
+            options['redis_url'],
+            # A slow or unreachable Redis fails open quickly instead of
+            # holding every request up
+            socket_timeout=options.get('timeout', 0.5),
+            socket_connect_timeout=options.get('timeout', 0.5)
+        ))
+    return MemoryStore(options.get('max_keys', 100000))
+
+
+_options = config.rate_limit
+rate_limiter = RateLimiter(
+    build_store(_options),
+    _options.get('default'),
+    _options.get('routes', {})
+) if _options.get('enabled', False) else None
+concurrency_limiter = ConcurrencyLimiter(_options.get('max_in_flight', {}))
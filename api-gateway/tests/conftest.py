@@ -0,0 +1,7 @@
+import os
+import sys
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GATEWAY_DIR)
+# config.yaml is read from the working directory
+os.chdir(GATEWAY_DIR)
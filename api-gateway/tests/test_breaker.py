@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from flask import Flask, request as flask_request
+from starlette.requests import Request
+
+import asgi
+import utils
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, get_upstream
+
+OPTIONS = {'window': 30, 'min_requests': 4, 'error_rate': 0.5, 'open_seconds': 15, 'half_open_calls': 2}
+
+
+def half_open(breaker):
+    """Trip the breaker and let its open period run out."""
+    for _ in range(breaker.min_requests):
+        breaker.before_call()
+        breaker.record(True, 0.01)
+    assert breaker.state == OPEN
+    breaker._opened_at -= breaker.open_seconds
+
+
+def test_opens_once_enough_calls_fail():
+    breaker = CircuitBreaker('svc', OPTIONS)
+    for failed in (False, True, False):
+        breaker.before_call()
+        breaker.record(failed, 0.01)
+    assert breaker.state == CLOSED
+
+    breaker.before_call()
+    breaker.record(True, 0.01)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_lets_a_few_probes_through_and_closes_on_success():
+    breaker = CircuitBreaker('svc', OPTIONS)
+    half_open(breaker)
+
+    breaker.before_call()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record(False, 0.01)
+    breaker.record(False, 0.01)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_opens_again():
+    breaker = CircuitBreaker('svc', OPTIONS)
+    half_open(breaker)
+
+    breaker.before_call()
+    breaker.record(True, 0.01)
+
+    assert breaker.state == OPEN
+
+
+def test_released_probe_frees_its_slot():
+    breaker = CircuitBreaker('svc', OPTIONS)
+    half_open(breaker)
+    breaker.before_call()
+    breaker.before_call()
+
+    breaker.release()
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_release_gives_back_only_outstanding_probes():
+    breaker = CircuitBreaker('svc', OPTIONS)
+    half_open(breaker)
+    breaker.before_call()
+    breaker.record(False, 0.01)
+
+    breaker.release()
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_release_when_closed_changes_nothing():
+    breaker = CircuitBreaker('svc', OPTIONS)
+    breaker.before_call()
+    breaker.release()
+
+    assert breaker.state == CLOSED
+    assert breaker._probes == 0
+
+
+class CancelledClient:
+    async def request(self, *args, **kwargs):
+        raise asyncio.CancelledError()
+
+
+def starlette_request(path='/api/x'):
+    return Request({
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': [],
+        'server': ('gateway', 80), 'scheme': 'http',
+    })
+
+
+def test_cancelled_async_call_frees_its_probe(monkeypatch):
+    target = 'http://cancelled.invalid'
+    breaker = get_upstream(target).breaker
+    half_open(breaker)
+    monkeypatch.setattr(asgi, '_client', lambda target_url: CancelledClient())
+
+    for _ in range(breaker.half_open_calls + 1):
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(asgi.proxy_request(target, starlette_request()))
+
+    assert breaker.state == HALF_OPEN
+    assert breaker._probes == 0
+
+
+class BrokenPool:
+    def request(self, **kwargs):
+        raise ValueError('not a requests error')
+
+
+def test_unexpected_sync_error_frees_its_probe(monkeypatch):
+    target = 'http://broken.invalid'
+    breaker = get_upstream(target).breaker
+    half_open(breaker)
+    monkeypatch.setattr(utils, 'get_pool', lambda target_url: BrokenPool())
+
+    with Flask(__name__).test_request_context('/api/x'):
+        for _ in range(breaker.half_open_calls + 1):
+            with pytest.raises(ValueError):
+                utils.proxy_request(target, flask_request)
+
+    assert breaker._probes == 0
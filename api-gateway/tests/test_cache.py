@@ -0,0 +1,162 @@
+import asyncio
+import time
+
+import pytest
+from flask import Response
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+import app as gateway
+import asgi
+import cache
+from cache import ResponseCache, cacheable
+
+RULES = {'/api/v2/bd/youtube': {'ttl': 10, 'stale_while_revalidate': 20}}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Stands in for the backend: each GET answers with the next body."""
+    response_cache = ResponseCache(1024 * 1024, 1024, RULES)
+    monkeypatch.setattr(gateway, 'response_cache', response_cache)
+    monkeypatch.setattr(gateway, 'rate_limiter', None)
+    # The Authorization header is the user id
+    monkeypatch.setattr(gateway, 'authenticate', lambda authorization: authorization or '')
+    state = {'calls': [], 'body': b'v1', 'read': 0}
+
+    def body():
+        state['read'] += 1
+        yield state['body']
+
+    def proxy(service):
+        state['calls'].append(gateway.g.user_id)
+        return Response(body(), 200, {'Content-Length': str(len(state['body']))})
+
+    def fetch(target_url, path, query, headers, max_body=None):
+        state['calls'].append(headers.get('X-User-Id'))
+        return 200, [('Content-Length', str(len(state['body'])))], state['body']
+
+    monkeypatch.setattr(gateway, '_proxy', proxy)
+    monkeypatch.setattr(gateway, 'fetch', fetch)
+    return state
+
+
+def get(client, user='alice', **headers):
+    return client.get('/api/v2/bd/youtube/videos', headers=dict(headers, Authorization=user))
+
+
+def test_fresh_entries_are_served_until_the_ttl(upstream, clock):
+    client = gateway.app.test_client()
+
+    assert get(client).headers['X-Cache'] == 'MISS'
+    clock.now += 9
+    response = get(client)
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.data == b'v1'
+    assert len(upstream['calls']) == 1
+
+    # Past ttl and stale_while_revalidate the entry is gone
+    clock.now += 30
+    assert get(client).headers['X-Cache'] == 'MISS'
+    assert len(upstream['calls']) == 2
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(upstream, clock):
+    client = gateway.app.test_client()
+    get(client)
+    upstream['body'] = b'v2'
+    clock.now += 15
+
+    response = get(client)
+    assert response.headers['X-Cache'] == 'STALE'
+    assert response.data == b'v1'
+
+    deadline = time.monotonic() + 5
+    while gateway.response_cache._revalidating or len(upstream['calls']) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    response = get(client)
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.data == b'v2'
+    assert len(upstream['calls']) == 2
+
+
+def test_matching_etag_gets_a_304(upstream, clock):
+    client = gateway.app.test_client()
+    etag = get(client).headers['ETag']
+
+    response = get(client, **{'If-None-Match': f'"other", {etag}'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert get(client, **{'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_users_get_their_own_entries(upstream, clock):
+    client = gateway.app.test_client()
+    get(client, user='alice')
+    upstream['body'] = b'bob'
+
+    assert get(client, user='bob').data == b'bob'
+    assert get(client, user='alice').data == b'v1'
+    assert upstream['calls'] == ['alice', 'bob']
+
+
+def test_oversized_response_streams_through_unread(upstream, clock):
+    upstream['body'] = b'x' * 2048
+
+    with gateway.app.test_request_context('/api/v2/bd/youtube/videos'):
+        gateway.g.user_id = 'alice'
+        response = gateway._cached_proxy('backend', RULES['/api/v2/bd/youtube'])
+        assert upstream['read'] == 0
+        assert 'X-Cache' not in response.headers
+        assert response.get_data() == upstream['body']
+
+    assert gateway.response_cache.size == 0
+
+
+def test_only_known_lengths_within_the_limit_are_cacheable():
+    assert cacheable([('Content-Length', '10')], 10)
+    assert not cacheable([('Content-Length', '11')], 10)
+    assert not cacheable([], 10)
+    assert not cacheable([('Content-Length', 'lots')], 10)
+    assert not cacheable([('Content-Length', '1'), ('Cache-Control', 'private, no-store')], 10)
+    assert not cacheable([('Content-Length', '1'), ('Set-Cookie', 'a=b')], 10)
+
+
+def test_asgi_streams_oversized_responses_without_buffering(monkeypatch):
+    monkeypatch.setattr(asgi, 'response_cache', ResponseCache(1024 * 1024, 1024, RULES))
+    read = []
+
+    async def body():
+        read.append(True)
+        yield b'x' * 2048
+
+    async def proxy(service, request):
+        return StreamingResponse(body(), headers={'content-length': '2048'})
+
+    monkeypatch.setattr(asgi, '_proxy', proxy)
+    request = Request({
+        'type': 'http', 'method': 'GET', 'path': '/api/v2/bd/youtube/videos', 'query_string': b'',
+        'headers': [], 'server': ('gateway', 80), 'scheme': 'http', 'state': {'user_id': 'alice'},
+    })
+
+    response = asyncio.run(asgi._cached_proxy('backend', request, RULES['/api/v2/bd/youtube']))
+
+    assert isinstance(response, StreamingResponse)
+    assert read == []
+    assert asgi.response_cache.size == 0
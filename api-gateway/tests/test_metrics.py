@@ -0,0 +1,33 @@
+from prometheus_client import REGISTRY
+
+from metrics import observe_request, route_label
+
+
+def test_routes_are_labelled_by_configured_prefix():
+    assert route_label('/api/v2/bd/chat-completion/batch') == '/api/v2/bd/chat-completion'
+    assert route_label('/api/v2/bd/youtube/videos') == '/api/v2/bd/youtube'
+    assert route_label('/api/v2/auth/login') == '/api/v2/auth'
+    assert route_label('/health/upstreams') == '/health'
+    # Segments only match whole
+    assert route_label('/api/v2/bdx/anything') == 'other'
+    assert route_label('/wp-admin.php') == 'other'
+
+
+def test_rejected_requests_cannot_add_series():
+    for n in range(20):
+        for status in (401, 403, 404, 429, 503):
+            observe_request(f'/api/v2/bd/random{n}/a/b/c', 'GET', status, 0.01)
+
+    routes = {
+        sample.labels['route']
+        for metric in REGISTRY.collect() if metric.name == 'gateway_requests'
+        for sample in metric.samples
+    }
+    assert not any('random' in route for route in routes)
+
+
+def test_slow_requests_get_their_own_buckets():
+    observe_request('/api/v2/bd/chat-completion/', 'POST', 200, 45)
+
+    labels = {'route': '/api/v2/bd/chat-completion', 'status': '200', 'le': '60.0'}
+    assert REGISTRY.get_sample_value('gateway_request_duration_seconds_bucket', labels) >= 1
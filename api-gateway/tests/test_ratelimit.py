@@ -0,0 +1,283 @@
+import asyncio
+
+import fakeredis
+import pytest
+import redis
+from flask import Response
+from prometheus_client import REGISTRY
+from starlette.requests import ClientDisconnect, Request
+
+import app as gateway
+import asgi
+from cache import ResponseCache
+from ratelimit import ConcurrencyLimiter, MemoryStore, RateLimiter, RedisStore
+
+RULES = {
+    '/api/v2/bd/chat-completion': {'rate': 0.1, 'burst': 2},
+    '/api/v2/bd': {'rate': 1, 'burst': 3},
+}
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryStore()
+    return RedisStore(fakeredis.FakeRedis())
+
+
+def test_bucket_allows_the_burst_then_refills(store):
+    taken = [store.take('user1', 1, 3, 100.0)[0] for _ in range(4)]
+    assert taken == [True, True, True, False]
+
+    assert store.take('user1', 1, 3, 101.0)[0]
+    assert not store.take('user1', 1, 3, 101.0)[0]
+    # Never refills past the burst
+    assert [store.take('user1', 1, 3, 1000.0)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_per_identity(store):
+    assert store.take('user1', 1, 1, 100.0)[0]
+    assert not store.take('user1', 1, 1, 100.0)[0]
+    assert store.take('user2', 1, 1, 100.0)[0]
+
+
+def test_limiter_uses_the_longest_matching_prefix(store):
+    limiter = RateLimiter(store, {'rate': 100, 'burst': 100}, RULES)
+
+    assert [limiter.check('user1', '/api/v2/bd/chat-completion/') for _ in range(2)] == [0, 0]
+    # Out of tokens at 0.1 a second, so about 10 seconds to the next one
+    assert 9 <= limiter.check('user1', '/api/v2/bd/chat-completion/') <= 10
+    # Other routes keep their own buckets
+    assert limiter.check('user1', '/api/v2/bd/youtube/videos') == 0
+    assert limiter.check('user1', '/api/v2/auth/login') == 0
+
+
+def test_limiter_without_a_default_lets_other_routes_through(store):
+    limiter = RateLimiter(store, None, RULES)
+
+    assert all(limiter.check('user1', '/api/v2/auth/login') == 0 for _ in range(10))
+
+
+def test_memory_store_evicts_the_oldest_buckets():
+    store = MemoryStore(max_keys=2)
+    for user in ('user1', 'user2', 'user3'):
+        store.take(user, 1, 1, 100.0)
+
+    # user1's bucket was dropped, so it starts full again
+    assert store.take('user1', 1, 1, 100.0)[0]
+    assert not store.take('user3', 1, 1, 100.0)[0]
+
+
+def test_concurrency_limiter_sheds_past_the_limit():
+    limiter = ConcurrencyLimiter({'backend': 2})
+
+    assert limiter.acquire('backend') and limiter.acquire('backend')
+    assert not limiter.acquire('backend')
+    limiter.release('backend')
+    assert limiter.acquire('backend')
+    # Upstreams without a limit are never shed
+    assert all(limiter.acquire('auth') for _ in range(10))
+
+
+def request(path='/api/v2/bd/chat-completion/', method='GET'):
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': [],
+        'server': ('gateway', 80), 'scheme': 'http', 'client': ('10.0.0.1', 5000),
+    }
+    scope['state'] = {'trace_id': 'trace', 'user_id': ''}
+    return Request(scope)
+
+
+def test_route_answers_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(asgi, 'rate_limiter', RateLimiter(MemoryStore(), None, RULES))
+    monkeypatch.setattr(asgi, 'response_cache', None)
+    proxied = []
+
+    async def proxy(service, request):
+        proxied.append(service)
+        return asgi.PlainTextResponse('ok')
+
+    monkeypatch.setattr(asgi, '_proxy', proxy)
+
+    responses = [asyncio.run(asgi._route('backend', request())) for _ in range(3)]
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert 9 <= int(responses[2].headers['retry-after']) <= 10
+    assert proxied == ['backend', 'backend']
+
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeUpstreamResponse:
+    """Enough of an aiohttp response for the proxy to stream it."""
+
+    def __init__(self, chunks=(b'hello',), status=200):
+        self.status = status
+        self.raw_headers = [(b'content-type', b'text/plain')]
+        self.content = FakeContent(list(chunks))
+        self.released = 0
+
+    def release(self):
+        self.released += 1
+
+
+class FakeClient:
+    def __init__(self, respond):
+        self.respond = respond
+
+    async def request(self, *args, **kwargs):
+        return await self.respond()
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = ConcurrencyLimiter({'backend': 1})
+    monkeypatch.setattr(asgi, 'concurrency_limiter', limiter)
+    return limiter
+
+
+def proxy_to(monkeypatch, respond):
+    monkeypatch.setattr(asgi, '_client', lambda target_url: FakeClient(respond))
+
+
+async def send_response(response, send, receive=None, spec_version='2.4'):
+    async def disconnected():
+        return {'type': 'http.disconnect'}
+
+    scope = {'type': 'http', 'asgi': {'spec_version': spec_version}}
+    await response(scope, receive or disconnected, send)
+
+
+def test_streamed_response_releases_the_slot_when_done(monkeypatch, limiter):
+    upstream = FakeUpstreamResponse([b'hel', b'lo'])
+
+    async def respond():
+        return upstream
+
+    proxy_to(monkeypatch, respond)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        response = await asgi._proxy('backend', request())
+        assert limiter.in_flight['backend'] == 1
+        await send_response(response, send)
+
+    asyncio.run(run())
+
+    assert b''.join(message.get('body', b'') for message in sent) == b'hello'
+    assert limiter.in_flight['backend'] == 0
+    assert upstream.released == 1
+
+
+def test_client_gone_before_the_first_chunk_releases_the_slot(monkeypatch, limiter):
+    upstream = FakeUpstreamResponse()
+
+    async def respond():
+        return upstream
+
+    proxy_to(monkeypatch, respond)
+
+    async def send(message):
+        raise OSError('connection reset')
+
+    async def run():
+        response = await asgi._proxy('backend', request())
+        with pytest.raises(ClientDisconnect):
+            await send_response(response, send)
+
+    asyncio.run(run())
+
+    assert limiter.in_flight['backend'] == 0
+    assert upstream.released == 1
+
+
+def test_cancelled_send_releases_the_slot(monkeypatch, limiter):
+    upstream = FakeUpstreamResponse()
+
+    async def respond():
+        return upstream
+
+    proxy_to(monkeypatch, respond)
+
+    async def send(message):
+        await asyncio.sleep(3600)
+
+    async def run():
+        response = await asgi._proxy('backend', request())
+        task = asyncio.create_task(send_response(response, send))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert limiter.in_flight['backend'] == 0
+    assert upstream.released == 1
+
+
+def test_cancelled_upstream_call_releases_the_slot(monkeypatch, limiter):
+    async def respond():
+        await asyncio.sleep(3600)
+
+    proxy_to(monkeypatch, respond)
+
+    async def run():
+        task = asyncio.create_task(asgi._proxy('backend', request()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert limiter.in_flight['backend'] == 0
+
+
+def test_busy_upstream_is_shed_with_503(monkeypatch, limiter):
+    limiter.acquire('backend')
+
+    response = asyncio.run(asgi._proxy('backend', request()))
+
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+
+class RedisDown(fakeredis.FakeRedis):
+    def evalsha(self, *args, **kwargs):
+        raise redis.ConnectionError('gone')
+
+
+def test_unreachable_redis_lets_requests_through():
+    limiter = RateLimiter(RedisStore(RedisDown()), {'rate': 1, 'burst': 1}, RULES)
+    before = REGISTRY.get_sample_value('gateway_rate_limit_errors_total') or 0
+
+    assert [limiter.check('user1', '/api/v2/bd/youtube') for _ in range(3)] == [0, 0, 0]
+    assert REGISTRY.get_sample_value('gateway_rate_limit_errors_total') == before + 3
+
+
+def test_upstream_reset_while_caching_releases_the_slot(monkeypatch, limiter):
+    def reset():
+        yield b'hel'
+        raise ConnectionResetError('reset by peer')
+
+    monkeypatch.setattr(gateway, 'concurrency_limiter', limiter)
+    monkeypatch.setattr(gateway, 'response_cache', ResponseCache(1024, 1024, {}))
+    monkeypatch.setattr(gateway, 'proxy_request', lambda *args: Response(reset(), headers={'Content-Length': '5'}))
+
+    with gateway.app.test_request_context('/api/v2/bd/youtube/videos'):
+        gateway.g.user_id = 'user1'
+        with pytest.raises(ConnectionResetError):
+            gateway._cached_proxy('backend', {'ttl': 10})
+
+    assert limiter.in_flight['backend'] == 0
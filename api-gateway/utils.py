@@ -1,26 +1,195 @@
+import time
+from logging.handlers import RotatingFileHandler
+
 import requests
+
 from flask import Request, Response
+from pythonjsonlogger import jsonlogger
+
+from config import config
+from pool import get_pool
+from breaker import get_upstream, RETRYABLE_STATUSES
+from metrics import observe_upstream
+from logqueue import queued
+
+# Hop-by-hop headers are never forwarded. In buffered mode requests decodes
+# the body, so the upstream encoding and length no longer apply either.
+HOP_BY_HOP_HEADERS = ['transfer-encoding', 'connection']
+BUFFERED_EXCLUDED_HEADERS = HOP_BY_HOP_HEADERS + ['content-encoding', 'content-length']
+
+
+class StreamedBody:
+    """Iterates over the incoming request body without buffering it.
+
+    requests sends a sized iterable with a Content-Length header and pulls
+    the next chunk only once the previous one has been written upstream, so
+    a slow upstream throttles how fast the client body is read.
+    """
+
+    def __init__(self, stream, length, chunk_size):
+        self.stream = stream
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _request_body(incoming_request: Request, headers: dict, chunk_size: int):
+    length = incoming_request.content_length
+    if length:
+        return StreamedBody(incoming_request.stream, length, chunk_size)
+
+    if incoming_request.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+        return None
+
+    # No length known up front: let requests re-chunk the body
+    headers.pop('Transfer-Encoding', None)
+    return iter(StreamedBody(incoming_request.stream, 0, chunk_size))
+
+
+def _is_event_stream(resp) -> bool:
+    return resp.headers.get('Content-Type', '').startswith('text/event-stream')
+
 
+def _stream_response(resp, chunk_size: int):
+    try:
+        if resp.raw.chunked or not _is_event_stream(resp):
+            # Forward bytes as received, without decoding content-encoding
+            yield from resp.raw.stream(chunk_size, decode_content=False)
+        else:
+            # read() would hold events back until chunk_size bytes arrived
+            while True:
+                chunk = resp.raw.read1(chunk_size, decode_content=False)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        resp.close()
+
+
+def forward_headers(incoming_headers, user_id: str = '') -> dict:
+    # Never trust an identity header sent by the client
+    identity_header = config.jwt.get('identity_header', 'X-User-Id')
+    headers = {k: v for k, v in incoming_headers if k != 'Host' and k.lower() != identity_header.lower()}
+    if user_id:
+        headers[identity_header] = user_id
+    return headers
+
+
+def fetch(target_url: str, path: str, query: str, headers: dict, max_body: int = None):
+    """GET a whole upstream response outside of a request, as (status, headers, body).
+
+    With max_body, a body without a Content-Length or longer than that is
+    left unread and returned as None.
+    """
+    url = f"{target_url}{path}" + (f"?{query}" if query else "")
+    resp = get_pool(target_url).request('GET', url, headers=headers, allow_redirects=False, stream=True)
+    try:
+        length = resp.headers.get('Content-Length', '')
+        if max_body is not None and (not length.isdigit() or int(length) > max_body):
+            body = None
+        else:
+            body = resp.raw.read(decode_content=False)
+    finally:
+        resp.close()
+    response_headers = [(name, value) for (name, value) in resp.raw.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS]
+    return resp.status_code, response_headers, body
+
+
+def proxy_request(target_url: str, incoming_request: Request, user_id: str = '') -> Response:
+    streaming = config.proxy.get('streaming', True)
+    chunk_size = config.proxy.get('chunk_size', 64 * 1024)
 
-def proxy_request(target_url: str, incoming_request: Request) -> Response:
     # Build proxied URL
     path = incoming_request.path
     params = incoming_request.query_string.decode()
     url = f"{target_url}{path}" + (f"?{params}" if params else "")
 
     # Forward headers and body
-    headers = {k: v for k, v in incoming_request.headers if k != 'Host'}
-    resp = requests.request(
-        method=incoming_request.method,
-        url=url,
-        headers=headers,
-        data=incoming_request.get_data(),
-        cookies=incoming_request.cookies,
-        allow_redirects=False,
-        stream=True
-    )
+    headers = forward_headers(incoming_request.headers, user_id)
+    if streaming:
+        data = _request_body(incoming_request, headers, chunk_size)
+    else:
+        data = incoming_request.get_data()
+
+    upstream = get_upstream(target_url)
+    upstream.budget.record_request()
+    replayable = data is None or isinstance(data, bytes)
+    attempt = 0
+    while True:
+        # Fails fast with CircuitOpenError while the upstream is unhealthy
+        upstream.breaker.before_call()
+        start = time.monotonic()
+        try:
+            resp = get_pool(target_url).request(
+                method=incoming_request.method,
+                url=url,
+                headers=headers,
+                data=data,
+                cookies=incoming_request.cookies,
+                allow_redirects=False,
+                stream=True
+            )
+        except requests.RequestException:
+            duration = time.monotonic() - start
+            upstream.breaker.record(True, duration)
+            observe_upstream(upstream.name, 'error', duration)
+            if not upstream.should_retry(incoming_request.method, replayable, attempt):
+                raise
+        except BaseException:
+            # Failed in a way that says nothing about the upstream; don't
+            # keep a half-open probe slot
+            upstream.breaker.release()
+            raise
+        else:
+            duration = time.monotonic() - start
+            upstream.breaker.record(resp.status_code >= 500, duration)
+            observe_upstream(upstream.name, resp.status_code, duration)
+            if resp.status_code not in RETRYABLE_STATUSES or \
+                    not upstream.should_retry(incoming_request.method, replayable, attempt):
+                break
+            resp.close()
 
-    excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+        time.sleep(upstream.backoff(attempt))
+        attempt += 1
+
+    # Server-sent events are never buffered, whatever the proxy mode
+    streaming = streaming or _is_event_stream(resp)
+    excluded_headers = HOP_BY_HOP_HEADERS if streaming else BUFFERED_EXCLUDED_HEADERS
     response_headers = [(name, value) for (name, value) in resp.raw.headers.items() if name.lower() not in excluded_headers]
 
+    if streaming:
+        return Response(_stream_response(resp, chunk_size), resp.status_code, response_headers)
+
     return Response(resp.content, resp.status_code, response_headers)
+
+
+def probe(target_url: str, path: str, timeout: float) -> bool:
+    resp = get_pool(target_url).request('GET', f"{target_url}{path}", timeout=timeout)
+    resp.close()
+    return resp.status_code < 500
+
+
+def build_log_handler():
+    handler = RotatingFileHandler(
+        filename=config.logging['file'],
+        maxBytes=10 * 1024 * 1024,
+        backupCount=5
+    )
+    handler.setLevel(config.logging.get('level', 'INFO'))
+    formatter = jsonlogger.JsonFormatter(
+        fmt='%(levelname)s %(asctime)s %(message)s'
+    )
+    handler.setFormatter(formatter)
+    options = config.logging.get('queue', {})
+    if not options.get('enabled', True):
+        return handler
+    return queued(handler, options)
@@ -1,27 +1,100 @@
 from flask import Flask, render_template
-from dotenv import load_dotenv
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 
-from youtube.routes import youtube_routes
-from generate_posts.routes import generate_posts_routes
+from youtube.routes import get_flow, youtube_routes
+from youtube.uploads import start_resumer
+from youtube.tokens import start_refresher
+from youtube.cache import r
+from generate_posts.routes import generate_posts_routes, get_client
+from publish.routes import publish_routes
+from publish import engine as publish_engine
+from publish.scheduler import start_scheduler
 from config import Config
+import metrics
+from revocation import revocation_check
 
 import os
+import threading
 
 
-if __name__ == '__main__':
-    load_dotenv()
-    app = Flask(__name__)
+_started_in = None
+_start_lock = threading.Lock()
+
+
+def start_background(r):
+    """Start this process's background work, once per process.
+
+    Resumes interrupted uploads and publications and starts the token
+    refresher and the scheduled post dispatcher. Threads don't survive a
+    fork, so a worker forked from a preloaded app starts its own here.
+    """
+    global _started_in
+    # Checked on every request, so skip the lock once started
+    if _started_in == os.getpid():
+        return
+    with _start_lock:
+        if _started_in == os.getpid():
+            return
+        _started_in = os.getpid()
+
+    # Keep uploads and publications going, including ones interrupted by
+    # a restart
+    start_resumer(r)
+    publish_engine.start_resumer(r)
+    # Keep OAuth tokens fresh ahead of the requests that need them
+    start_refresher(r)
+    # Start scheduled posts as they come due
+    start_scheduler(r)
+
+
+def preload():
+    """Build the clients the routes otherwise build on first use.
+
+    Under a preforking server (gunicorn --preload) this runs once in the
+    master, so workers share these pages instead of each loading its own.
+    """
+    import googleapiclient.discovery  # noqa: F401
+    import googleapiclient.http  # noqa: F401
+    import google.auth.transport.requests  # noqa: F401
+
+    get_client()
+    get_flow()
 
-    app.secret_key = os.getenv('SECRET_KEY')
-    app.config.from_object(Config)
+
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+    metrics.init_app(app)
 
     CORS(app)
 
-    JWTManager(app)
-    
+    jwt = JWTManager(app)
+    # Tokens revoked by the auth service
+    revocation_check.init_app(app, jwt)
+
     app.register_blueprint(youtube_routes, url_prefix='/api/v2/bd/youtube')
     app.register_blueprint(generate_posts_routes, url_prefix='/api/v2/bd/chat-completion')
+    app.register_blueprint(publish_routes, url_prefix='/api/v2/bd/publish')
+
+    if app.config['PRELOAD']:
+        preload()
+
+    # Not started here: a preloading server forks after create_app, and
+    # the workers need threads of their own
+    @app.before_request
+    def ensure_background():
+        start_background(r)
 
+    # Probed by the gateway's health checker
+    @app.route('/health')
+    def health():
+        return {'status': 'ok'}
+
+    return app
+
+
+if __name__ == '__main__':
+    app = create_app()
+    start_background(r)
     app.run(port=os.getenv('PORT'), host=os.getenv('HOST'), debug=os.getenv('DEBUG'))
@@ -0,0 +1,95 @@
+"""Benchmark: parsing LLM completions into per-platform posts.
+
+Compares the old fenced-regex parser with the streaming parser on a
+typical completion, a large one and several malformed ones, and measures
+how far into a streamed completion each platform section becomes
+available.
+
+    cd backend && python benchmarks/parse_output.py
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_posts.utils import StreamingJSONParser, parse_json  # noqa: E402
+
+
+def regex_parse_json(content):
+    """The parser this replaced."""
+    json_str = re.search(r'```json\n(.*)\n```', content, re.DOTALL).group(1)
+    return json.loads(json_str)
+
+
+def completion(description_size):
+    description = ("Behind the scenes of our launch, with \"quotes\" and {braces}. " * (description_size // 64 + 1))[:description_size]
+    return json.dumps({
+        "tiktok": {"title": "Launch day", "description": description, "hashtags": ["launch", "eco"]},
+        "youtube": {"title": "Launch day", "description": description, "tags": ["launch"]},
+        "instagram": {"caption": description, "hashtags": ["launch"]},
+        "x": {"tweet": "We launched!", "hashtags": ["launch"]},
+    }, indent=2)
+
+
+def cases():
+    typical = completion(400)
+    large = completion(200_000)
+    return {
+        "typical, fenced": "```json\n" + typical + "\n```",
+        "large, fenced": "```json\n" + large + "\n```",
+        "no fence": typical,
+        "JSON tag and prose": "Here are your posts:\n```JSON\n" + typical + "\n```\nLet me know!",
+        "truncated": "```json\n" + typical[:len(typical) * 2 // 3],
+        "stray brace first": "Sure {here} they are:\n" + typical,
+    }
+
+
+def per_call(fn, content, iterations):
+    try:
+        fn(content)
+    except Exception as e:
+        return None, type(e).__name__
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(content)
+    return (time.perf_counter() - start) / iterations * 1e6, len(fn(content))
+
+
+def streamed(content, delta):
+    """Feed the completion in small deltas, like a streamed response."""
+    parser = StreamingJSONParser()
+    first_section = None
+    start = time.perf_counter()
+    for offset in range(0, len(content), delta):
+        if parser.feed(content[offset:offset + delta]) and first_section is None:
+            first_section = offset + delta
+    return (time.perf_counter() - start) * 1e3, first_section
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--delta', type=int, default=8, help='characters per streamed chunk')
+    args = parser.parse_args()
+
+    print(f"{'case':<22}{'regex us':>12}{'sections':>16}{'parse_json us':>16}{'sections':>10}")
+    for name, content in cases().items():
+        old, old_result = per_call(regex_parse_json, content, args.iterations)
+        new, new_result = per_call(parse_json, content, args.iterations)
+        fmt = lambda t, width: f"{t:{width}.1f}" if t is not None else f"{'-':>{width}}"
+        print(f"{name:<22}{fmt(old, 12)}{old_result:>16}{fmt(new, 16)}{new_result:>10}")
+
+    print()
+    for name in ("typical, fenced", "large, fenced"):
+        content = cases()[name]
+        total_ms, first = streamed(content, args.delta)
+        print(f"{name}: streamed in {args.delta}-char deltas in {total_ms:.1f} ms, "
+              f"first section after {first / len(content):.0%} of the output")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark: the credential reads behind the YouTube routes.
+
+Compares separate GETs with one MGET and with L1 hits, measures how long
+an invalidation takes to reach another process's L1, and the size of
+stored credentials before and after packing. Runs against the Redis in
+the CACHE_* settings; a local Redis or any stand-in speaking the protocol
+will do.
+
+    cd backend && CACHE_HOST=localhost CACHE_PORT=6379 python benchmarks/redis_roundtrips.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube.cache import LocalCache, r  # noqa: E402
+from youtube.utils import _shared_fields, pack_credentials, unpack_credentials, uploads_playlist_key  # noqa: E402
+
+USER_ID = 'benchmark-user'
+
+
+def sample_credentials():
+    # The app's own client id and secret when client_secret.json is there
+    shared = _shared_fields()
+    return json.dumps({
+        "token": "ya29.a0AfB_byC" + "x" * 200,
+        "refresh_token": "1//0g" + "y" * 98,
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "client_id": shared.get("client_id", "1234567890-abcdefghijklmnopqrstuvwxyz012345.apps.googleusercontent.com"),
+        "client_secret": shared.get("client_secret", "GOCSPX-" + "z" * 28),
+        "scopes": ["https://www.googleapis.com/auth/youtube.force-ssl"],
+        "universe_domain": "googleapis.com",
+        "account": "",
+        "expiry": "2025-01-01T12:00:00.123456Z",
+    })
+
+
+def per_call(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def invalidation_delay(l1_ttl, attempts=20):
+    """Seconds until another process's L1 drops a key invalidated here."""
+    writer = LocalCache(r, l1_ttl, 100)
+    reader = LocalCache(r, l1_ttl, 100)
+    reader.get(USER_ID)
+    time.sleep(0.5)  # let the subscriber connect
+    delays = []
+    for _ in range(attempts):
+        reader.get(USER_ID)
+        start = time.perf_counter()
+        writer.invalidate(USER_ID)
+        while USER_ID in reader._entries:
+            time.sleep(0.0002)
+        delays.append(time.perf_counter() - start)
+    return sorted(delays)[len(delays) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    plain = sample_credentials()
+    packed = pack_credentials(plain)
+    assert unpack_credentials(packed)["refresh_token"] == json.loads(plain)["refresh_token"]
+    print(f"stored credentials: {len(plain)} bytes as JSON, {len(packed)} packed")
+    print(f"unpack: {per_call(lambda: unpack_credentials(packed), args.iterations):.1f} us")
+
+    r.set(USER_ID, packed)
+    r.set(uploads_playlist_key(USER_ID), 'UUbenchmark')
+    keys = (USER_ID, uploads_playlist_key(USER_ID))
+    l1 = LocalCache(r, 5, 100)
+
+    print(f"{'two GETs':<20}{per_call(lambda: [r.get(key) for key in keys], args.iterations):8.1f} us")
+    print(f"{'one MGET':<20}{per_call(lambda: r.mget(keys), args.iterations):8.1f} us")
+    print(f"{'L1 hit':<20}{per_call(lambda: l1.get_many(*keys), args.iterations):8.1f} us")
+    print(f"invalidation reaches another L1 in {invalidation_delay(5) * 1000:.1f} ms (median)")
+
+    r.delete(*keys)
+
+
+if __name__ == '__main__':
+    main()
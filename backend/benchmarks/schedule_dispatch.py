@@ -0,0 +1,72 @@
+"""Benchmark: dispatching a backlog of scheduled posts.
+
+Queues --posts members, all due, under a benchmark key and drains them
+with --processes dispatchers running side by side, each with a no-op
+handler, so the figure is the queue's own cost. Every run checks that
+each post was handled exactly once. Runs against the Redis in the
+CACHE_* settings; a local Redis or any stand-in speaking the protocol
+(with Lua) will do.
+
+    cd backend && CACHE_HOST=localhost CACHE_PORT=6379 python benchmarks/schedule_dispatch.py
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from publish.scheduler import Dispatcher  # noqa: E402
+from youtube.cache import r  # noqa: E402
+
+KEY = 'benchmark:scheduled:due'
+
+
+def fill(posts):
+    r.delete(KEY, f"{KEY}:attempts")
+    now = time.time()
+    for start in range(0, posts, 10000):
+        r.zadd(KEY, {f"post-{i}": now - posts + i for i in range(start, min(start + 10000, posts))})
+
+
+def drain(batch_size):
+    handled = []
+    dispatcher = Dispatcher(r, KEY, handled.append, batch_size=batch_size, workers=4)
+    while dispatcher.run_once():
+        pass
+    dispatcher.executor.shutdown()
+    return handled
+
+
+def run(posts, processes, batch_size):
+    fill(posts)
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.map(drain, [batch_size] * processes)
+    elapsed = time.perf_counter() - start
+
+    handled = [member for result in results for member in result]
+    assert len(handled) == posts and len(set(handled)) == posts, "a post was lost or handled twice"
+    assert r.zcard(KEY) == 0
+    # Includes starting the processes
+    return posts / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 500])
+    args = parser.parse_args()
+
+    print(f"{args.posts} posts due")
+    print(f"{'processes':<12}{'batch':>8}{'posts/s':>12}")
+    for processes in args.processes:
+        for batch_size in args.batch_sizes:
+            print(f"{processes:<12}{batch_size:>8}{run(args.posts, processes, batch_size):12.0f}")
+    r.delete(KEY)
+
+
+if __name__ == '__main__':
+    main()
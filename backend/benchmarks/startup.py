@@ -0,0 +1,182 @@
+"""Benchmark: cold start and per-worker memory of the backend.
+
+Cold start runs a fresh interpreter that imports the app, calls
+create_app() and serves its first /health request, and reports the time
+of each step and the resident memory at the end. Workers then emulates a
+preforking server with --workers children, each of which builds the LLM
+client, the OAuth flow and the YouTube client libraries as its first
+requests would. Without preloading each worker imports and creates the
+app itself; with it the parent does, with PRELOAD set, before forking.
+Worker memory is read from /proc, where PSS splits shared pages between
+the processes sharing them, so it shows what each worker really adds.
+
+Results can be written with --output and compared with --baseline, which
+exits non-zero if a figure grew by more than --tolerance, so a change
+that slows startup down or bloats workers shows up.
+
+    cd backend && python benchmarks/startup.py --output startup.json
+    cd backend && python benchmarks/startup.py --baseline startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory(pid='self'):
+    """RSS, PSS and USS of a process in MB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def warm_up():
+    """What a worker builds on its first LLM and YouTube requests."""
+    import googleapiclient.discovery  # noqa: F401
+    import googleapiclient.http  # noqa: F401
+    import google.auth.transport.requests  # noqa: F401
+    from generate_posts.routes import get_client
+    from youtube.routes import get_flow
+
+    get_client()
+    get_flow()
+
+
+def child_cold_start():
+    start = time.perf_counter()
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    app.test_client().get('/health')
+    served = time.perf_counter()
+    print(json.dumps({
+        'import': imported - start,
+        'create_app': created - imported,
+        'first_request': served - created,
+        'rss': memory()['rss'],
+    }))
+
+
+def child_workers(workers):
+    preload = os.environ['PRELOAD'] == '1'
+    if preload:
+        from app import create_app
+
+        create_app()
+    children = []
+    for _ in range(workers):
+        ready, done = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready)
+            if not preload:
+                from app import create_app
+
+                create_app()
+            warm_up()
+            os.write(done, b'1')
+            time.sleep(3600)
+            os._exit(0)
+        os.close(done)
+        children.append((pid, ready))
+
+    for _, ready in children:
+        os.read(ready, 1)
+    stats = [memory(pid) for pid, _ in children]
+    for pid, _ in children:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+    print(json.dumps({key: statistics.mean(s[key] for s in stats) for key in ('rss', 'pss', 'uss')}))
+
+
+def run_child(args, preload):
+    env = dict(os.environ, PRELOAD='1' if preload else '0')
+    # The clients need settings to be built, not working ones
+    env.setdefault('LLMAPI', 'benchmark')
+    env.setdefault('JWT_SECRET_KEY', 'benchmark')
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__)] + args,
+        cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(runs, workers):
+    results = {}
+    for preload in (False, True):
+        label = 'preload' if preload else 'lazy'
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            sample = run_child(['--child', 'cold-start'], preload)
+            sample['total'] = time.perf_counter() - start
+            samples.append(sample)
+        results[f'{label}.cold_start_s'] = statistics.median(s['total'] for s in samples)
+        for step in ('import', 'create_app', 'first_request'):
+            results[f'{label}.{step}_s'] = statistics.median(s[step] for s in samples)
+        results[f'{label}.rss_after_start_mb'] = statistics.median(s['rss'] for s in samples)
+
+        worker = run_child(['--child', 'workers', '--workers', str(workers)], preload)
+        for key in ('rss', 'pss', 'uss'):
+            results[f'{label}.worker_{key}_mb'] = worker[key]
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressed = []
+    for key, value in sorted(results.items()):
+        before = baseline.get(key)
+        change = f'{(value - before) / before:+7.1%}' if before else ''
+        print(f'{key:<32}{value:10.3f}  {change}')
+        if before and value > before * (1 + tolerance):
+            regressed.append(key)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help='write the results here as JSON')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--child', choices=('cold-start', 'workers'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, BACKEND_DIR)
+        if args.child == 'cold-start':
+            child_cold_start()
+        else:
+            child_workers(args.workers)
+        return
+
+    results = measure(args.runs, args.workers)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressed = compare(results, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressed:
+        sys.exit(f"regressed by more than {args.tolerance:.0%}: {', '.join(regressed)}")
+
+
+if __name__ == '__main__':
+    main()
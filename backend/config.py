@@ -1,6 +1,27 @@
 import os
 from dotenv import load_dotenv
 
+# The one place .env is read; everything importing settings imports this first
+load_dotenv()
+
+
+def flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config:
-    load_dotenv()
-    JWT_SECRET_KEY=os.getenv('JWT_SECRET_KEY')
\ No newline at end of file
+    SECRET_KEY=os.getenv('SECRET_KEY')
+    JWT_SECRET_KEY=os.getenv('JWT_SECRET_KEY')
+    # Build the OAuth flow and API clients at startup instead of on first
+    # use, so workers forked from a preloading server share them
+    PRELOAD=flag('PRELOAD')
+    # Revoked tokens and sessions, written by the auth service; the same
+    # Redis as its REVOCATION_REDIS_URL
+    REVOCATION_REDIS_URL=os.getenv('REVOCATION_REDIS_URL', 'redis://localhost:6379/0')
+    REVOCATION_TIMEOUT=float(os.getenv('REVOCATION_TIMEOUT', 0.5))
+    # Seconds a token found not revoked is trusted before asking Redis again
+    REVOCATION_RECHECK=int(os.getenv('REVOCATION_RECHECK', 5))
+    REVOCATION_CACHE_SIZE=int(os.getenv('REVOCATION_CACHE_SIZE', 100000))
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+
+import redis
+
+from metrics import GENERATION_CACHE, GENERATION_SAVED_SECONDS
+
+TTL = int(os.getenv('GENERATION_CACHE_TTL', 24 * 3600))
+MAX_ENTRIES = int(os.getenv('GENERATION_CACHE_MAX_ENTRIES', 10000))
+# Estimated Jaccard similarity a post idea needs to reuse another one's
+# result; 0 leaves only exact matches
+SIMILARITY = float(os.getenv('GENERATION_CACHE_SIMILARITY', 0))
+
+SHINGLE_SIZE = 4
+# 16 bands of 4 rows: ideas around 0.8 similar almost always share a band
+BANDS = 16
+ROWS = 4
+_PRIME = (1 << 61) - 1
+_SEEDS = [
+	(int.from_bytes(hashlib.blake2b(b'a%d' % i, digest_size=8).digest(), 'big') % _PRIME or 1,
+	 int.from_bytes(hashlib.blake2b(b'b%d' % i, digest_size=8).digest(), 'big') % _PRIME)
+	for i in range(BANDS * ROWS)
+]
+
+
+def normalize(prompt):
+	if not isinstance(prompt, str):
+		prompt = json.dumps(prompt, sort_keys=True)
+	prompt = unicodedata.normalize('NFKC', prompt).casefold()
+	return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def signature(text):
+	"""MinHash signature over the text's character shingles."""
+	shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(len(text) - SHINGLE_SIZE + 1, 1))}
+	hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingles]
+	return [min((a * h + b) % _PRIME for h in hashes) for a, b in _SEEDS]
+
+
+def similarity(sig_a, sig_b):
+	return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+class GenerationCache:
+	"""Generated posts in Redis, keyed by normalized prompt, model and system prompt.
+
+	Entries expire after ttl and the least recently used ones are evicted
+	past max_entries. With a similarity threshold, post ideas that are
+	close to a cached one also hit, found through MinHash LSH bands.
+	"""
+
+	def __init__(self, r, model, system_prompt, ttl=TTL, max_entries=MAX_ENTRIES, threshold=SIMILARITY):
+		self.r = r
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.threshold = threshold
+		# Changing the model or the system prompt starts a fresh cache
+		version = hashlib.blake2b(f'{model}\n{system_prompt}'.encode(), digest_size=8).hexdigest()
+		self.prefix = f'gen:{version}'
+		self.lru_key = f'{self.prefix}:lru'
+		# Running average of miss latency, reported as time saved per hit
+		self.miss_seconds = None
+
+	def _entry_key(self, digest):
+		return f'{self.prefix}:entry:{digest}'
+
+	def _band_keys(self, sig):
+		return [
+			f'{self.prefix}:band:{band}:' + hashlib.blake2b(
+				repr(sig[band * ROWS:(band + 1) * ROWS]).encode(), digest_size=8).hexdigest()
+			for band in range(BANDS)
+		]
+
+	def _hit(self, tier, digest, entry):
+		GENERATION_CACHE.labels(tier).inc()
+		if self.miss_seconds is not None:
+			GENERATION_SAVED_SECONDS.inc(self.miss_seconds)
+		self.r.zadd(self.lru_key, {digest: time.time()})
+		return entry['result']
+
+	def get(self, prompt):
+		"""The cached result for a post idea, or None."""
+		try:
+			return self._get(prompt)
+		except redis.RedisError:
+			# Losing the cache only costs a generation
+			GENERATION_CACHE.labels('miss').inc()
+			return None
+
+	def put(self, prompt, result, seconds):
+		self.miss_seconds = seconds if self.miss_seconds is None else 0.9 * self.miss_seconds + 0.1 * seconds
+		try:
+			self._put(prompt, result)
+		except redis.RedisError:
+			pass
+
+	def _get(self, prompt):
+		text = normalize(prompt)
+		digest = hashlib.sha256(text.encode()).hexdigest()
+		entry = self.r.get(self._entry_key(digest))
+		if entry:
+			return self._hit('exact', digest, json.loads(entry))
+
+		if self.threshold:
+			sig = signature(text)
+			band_keys = self._band_keys(sig)
+			candidates = set()
+			for key in band_keys:
+				candidates.update(m.decode() if isinstance(m, bytes) else m for m in self.r.smembers(key))
+			best, best_score = None, self.threshold
+			for candidate in candidates:
+				entry = self.r.get(self._entry_key(candidate))
+				if not entry:
+					# Expired or evicted; bands are cleaned up lazily
+					for key in band_keys:
+						self.r.srem(key, candidate)
+					continue
+				entry = json.loads(entry)
+				if 'signature' not in entry:
+					continue
+				score = similarity(sig, entry['signature'])
+				if score >= best_score:
+					best, best_score = (candidate, entry), score
+			if best:
+				return self._hit('similar', *best)
+
+		GENERATION_CACHE.labels('miss').inc()
+		return None
+
+	def _put(self, prompt, result):
+		text = normalize(prompt)
+		digest = hashlib.sha256(text.encode()).hexdigest()
+		entry = {'result': result}
+		pipe = self.r.pipeline(transaction=False)
+		if self.threshold:
+			entry['signature'] = sig = signature(text)
+			for key in self._band_keys(sig):
+				pipe.sadd(key, digest)
+				pipe.expire(key, self.ttl)
+		pipe.set(self._entry_key(digest), json.dumps(entry), ex=self.ttl)
+		pipe.zadd(self.lru_key, {digest: time.time()})
+		pipe.zcard(self.lru_key)
+		size = pipe.execute()[-1]
+
+		if size > self.max_entries:
+			evicted = self.r.zpopmin(self.lru_key, size - self.max_entries)
+			self.r.delete(*[self._entry_key(d.decode() if isinstance(d, bytes) else d) for d, _ in evicted])
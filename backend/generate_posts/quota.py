@@ -0,0 +1,50 @@
+import math
+import time
+
+import redis
+
+# Refill, then take cost tokens if there are that many, atomically. Tokens
+# come back as a string because Redis truncates Lua numbers to integers.
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+	tokens = tokens - cost
+	allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class ItemQuota:
+	"""Per-user token bucket charged one token per item of a request.
+
+	The gateway charges a whole batch one token, so batches are metered
+	here by their size instead. When Redis is unreachable requests are let
+	through, as the gateway's limiter does.
+	"""
+
+	def __init__(self, r, rate, burst, prefix='quota:batch:'):
+		self.rate = rate
+		self.burst = burst
+		self.prefix = prefix
+		self._take = r.register_script(TAKE_SCRIPT)
+
+	def take(self, user_id, items):
+		"""Seconds to wait before retrying, or 0 when the items may go ahead."""
+		try:
+			allowed, tokens = self._take(keys=[self.prefix + user_id], args=[self.rate, self.burst, time.time(), items])
+		except redis.RedisError:
+			return 0
+		if allowed:
+			return 0
+		return max(1, math.ceil((items - float(tokens)) / self.rate))
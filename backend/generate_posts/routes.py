@@ -1,42 +1,35 @@
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from flask import Flask, jsonify, request
-from dotenv import load_dotenv
 from flask_cors import CORS
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+import functools
+import json
 import os
+import time
 
-from .utils import parse_json
+from .cache import GenerationCache
+from .quota import ItemQuota
+from .utils import StreamingJSONParser, parse_json
+from youtube.cache import r
+from metrics import upstream_timer
 
 generate_posts_routes = Blueprint("generate_posts_routes", __name__)
 
-load_dotenv()
 
-client = OpenAI(
-	api_key=os.getenv('LLMAPI'),
-	base_url=os.getenv('BASE_URL')
-)
-
-@generate_posts_routes.route("/", methods=['POST'])
-def deepseek_posts_creation():
-
-	# user_id = get_jwt_identity()
+@functools.lru_cache(maxsize=None)
+def get_client():
+	"""The LLM client, built on first use; importing openai alone takes longer than the rest of the app."""
+	from openai import OpenAI
 
-	data = request.json.get('post', None)
+	return OpenAI(
+		api_key=os.getenv('LLMAPI'),
+		base_url=os.getenv('BASE_URL')
+	)
 
-	if data == None:
-		return jsonify(
-				{
-					"msg": "error generating posts"
-				}
-			), 400
+MODEL = "deepseek-v3"
 
-	
-	chat_completion = client.chat.completions.create(
-    messages=[
-	        {
-	            "role": "system",
-	            "content": '''
+SYSTEM_PROMPT = '''
 	                "You are an AI assistant that generates engaging and platform-specific social media content. "
 	                "Given a user's input post idea or context, respond with a JSON object containing suggested "
 	                "titles, descriptions, hashtags, and optional call-to-actions tailored for each platform: "
@@ -64,17 +57,222 @@ def deepseek_posts_creation():
 	                "  }\n"
 	                "}"
 	            '''
-	        },
-	        {
-	            "role": "user",
-	            "content": data
-	        }
-	    ],
-	    model="deepseek-v3",
-	    stream=False
-	)
+
+def chat_messages(data):
+	return [
+		{
+			"role": "system",
+			"content": SYSTEM_PROMPT
+		},
+		{
+			"role": "user",
+			"content": data
+		}
+	]
+
+
+def sse_event(event, data):
+	return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+generation_cache = GenerationCache(r, MODEL, SYSTEM_PROMPT)
+
+# Shared by all batches, so together they never exceed this many LLM calls
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 50))
+BATCH_ITEM_TIMEOUT = float(os.getenv('BATCH_ITEM_TIMEOUT', 60))
+# Items a user may generate through /batch: BATCH_ITEM_BURST at once, then
+# BATCH_ITEM_RATE a second, the gateway's rate for single generations
+batch_quota = ItemQuota(
+	r,
+	float(os.getenv('BATCH_ITEM_RATE', 0.1)),
+	int(os.getenv('BATCH_ITEM_BURST', BATCH_MAX_ITEMS))
+)
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='llm-batch')
+
+
+def generate_post(data, llm=None):
+	"""Per-platform posts for one idea, from the cache or the LLM."""
+	cached = generation_cache.get(data)
+	if cached is not None:
+		return cached
+	llm = llm or get_client()
+
+	start = time.perf_counter()
+	with upstream_timer('llm', 'chat.completions'):
+		chat_completion = llm.chat.completions.create(
+			messages=chat_messages(data),
+			model=MODEL,
+			stream=False
+		)
 
 	content = chat_completion.choices[0].message.content
 	social_data = parse_json(content)
+	generation_cache.put(data, social_data, time.perf_counter() - start)
+	return social_data
+
+
+@generate_posts_routes.route("/", methods=['POST'])
+def deepseek_posts_creation():
+
+	# user_id = get_jwt_identity()
+
+	data = request.json.get('post', None)
+
+	if data == None:
+		return jsonify(
+				{
+					"msg": "error generating posts"
+				}
+			), 400
+
+	
+	social_data = generate_post(data)
 
 	return jsonify(social_data), 200
+
+
+@generate_posts_routes.route("/stream", methods=['POST'])
+def deepseek_posts_stream():
+	"""Stream the completion as server-sent events.
+
+	Sends a token event for each piece of content as it arrives and a
+	section event as each platform's posts complete, then a result event
+	with the parsed per-platform JSON, or an error event.
+	"""
+
+	data = request.json.get('post', None)
+
+	if data == None:
+		return jsonify(
+				{
+					"msg": "error generating posts"
+				}
+			), 400
+
+	cached = generation_cache.get(data)
+
+	def generate():
+		if cached is not None:
+			yield sse_event("result", cached)
+			return
+
+		parser = StreamingJSONParser()
+		start = time.perf_counter()
+		try:
+			with upstream_timer('llm', 'chat.completions.stream'):
+				with get_client().chat.completions.create(
+					messages=chat_messages(data),
+					model=MODEL,
+					stream=True
+				) as stream:
+					for chunk in stream:
+						delta = chunk.choices[0].delta.content if chunk.choices else None
+						if delta:
+							yield sse_event("token", {"content": delta})
+							for platform, section in parser.feed(delta):
+								yield sse_event("section", {"platform": platform, "content": section})
+
+			social_data = parser.result()
+			generation_cache.put(data, social_data, time.perf_counter() - start)
+			yield sse_event("result", social_data)
+		except Exception:
+			yield sse_event("error", {"msg": "error generating posts"})
+
+	return Response(
+		generate(),
+		mimetype="text/event-stream",
+		# Stop any proxy in front of us from buffering the events
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+	)
+
+
+@generate_posts_routes.route("/batch", methods=['POST'])
+@jwt_required()
+def deepseek_posts_batch():
+	"""Generate posts for a list of ideas concurrently.
+
+	Returns one entry per idea, in order, with either a result or an
+	error. With ?stream=1 each entry is sent as an item event as soon as
+	it finishes, followed by a done event. Each idea counts against the
+	user's batch_quota.
+	"""
+
+	posts = request.json.get('posts', None)
+
+	if not isinstance(posts, list) or not posts:
+		return jsonify(
+				{
+					"msg": "posts must be a non-empty list"
+				}
+			), 400
+	if len(posts) > BATCH_MAX_ITEMS:
+		return jsonify(
+				{
+					"msg": f"at most {BATCH_MAX_ITEMS} posts per batch"
+				}
+			), 400
+
+	retry_after = batch_quota.take(get_jwt_identity(), len(posts))
+	if retry_after:
+		return jsonify(
+				{
+					"msg": "Too many posts, try again later"
+				}
+			), 429, {"Retry-After": str(retry_after)}
+
+	# Each call gives up after the item timeout instead of retrying
+	from openai import APITimeoutError
+
+	llm = get_client().with_options(timeout=BATCH_ITEM_TIMEOUT, max_retries=0)
+	futures = {batch_executor.submit(generate_post, post, llm): index for index, post in enumerate(posts)}
+	# Items wait for a free worker too, which the call's own timeout
+	# doesn't count
+	deadline = time.monotonic() + BATCH_ITEM_TIMEOUT
+
+	def outcome(future):
+		item = {"index": futures[future]}
+		try:
+			item["result"] = future.result()
+		except APITimeoutError:
+			item["error"] = "timed out"
+		except Exception:
+			item["error"] = "error generating posts"
+		return item
+
+	def outcomes():
+		"""Items as they finish; those not finished by the deadline time out."""
+		finished = set()
+		try:
+			for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+				finished.add(future)
+				yield outcome(future)
+		except TimeoutError:
+			for future, index in futures.items():
+				if future not in finished:
+					# Frees the worker if it never started; one already
+					# running stops at its own timeout
+					future.cancel()
+					yield {"index": index, "error": "timed out"}
+
+	if request.args.get('stream') not in ('1', 'true'):
+		results = sorted(outcomes(), key=lambda item: item["index"])
+		return jsonify({"results": results}), 200
+
+	def generate():
+		failed = 0
+		try:
+			for item in outcomes():
+				failed += "error" in item
+				yield sse_event("item", item)
+			yield sse_event("done", {"count": len(futures), "failed": failed})
+		finally:
+			# The client went away; don't spend LLM calls on it
+			for future in futures:
+				future.cancel()
+
+	return Response(
+		generate(),
+		mimetype="text/event-stream",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+	)
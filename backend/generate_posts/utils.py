@@ -1,9 +1,193 @@
 import json
 import re
 
+# Field types per platform section, following the format in SYSTEM_PROMPT
+SECTION_SCHEMA = {
+	"tiktok": ({"title": str, "description": str, "hashtags": [str]}, ("title",)),
+	"youtube": ({"title": str, "description": str, "tags": [str]}, ("title",)),
+	"instagram": ({"caption": str, "hashtags": [str]}, ("caption",)),
+	"x": ({"tweet": str, "hashtags": [str]}, ("tweet",)),
+}
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+# Inside a section only strings and brackets change the parser's state
+_NESTED_SPECIAL = re.compile(r'["{}\[\]]')
+_decoder = json.JSONDecoder()
+
+
+def compile_section(fields, required):
+	"""Build a validator for one platform section.
+
+	Required fields must be present; any known field present must have the
+	right type. Extra fields, like an optional call to action, are allowed.
+	"""
+	checks = []
+	for name, kind in fields.items():
+		if isinstance(kind, list):
+			checks.append((name, lambda value, item=kind[0]: isinstance(value, list) and all(isinstance(x, item) for x in value)))
+		else:
+			checks.append((name, lambda value, kind=kind: isinstance(value, kind)))
+
+	def validate(section):
+		if not isinstance(section, dict):
+			return False
+		if any(name not in section for name in required):
+			return False
+		return all(check(section[name]) for name, check in checks if name in section)
+
+	return validate
+
+
+SECTION_VALIDATORS = {platform: compile_section(*schema) for platform, schema in SECTION_SCHEMA.items()}
+
+
+class StreamingJSONParser:
+	"""Pulls the top-level JSON object out of LLM output as it streams in.
+
+	Text around the object, code fences of any kind included, is skipped.
+	Each top-level member is decoded as soon as its value closes, so
+	platform sections are usable before the completion ends. Sections that
+	fail validation are left out.
+	"""
+
+	def __init__(self, validators=SECTION_VALIDATORS):
+		self.validators = validators
+		self.sections = {}
+		self.done = False
+		self._reset()
+
+	def _reset(self):
+		self._depth = 0
+		self._in_string = False
+		self._escape = False
+		self._key = None
+		self._key_parts = None
+		self._value_parts = None
+
+	def _member(self, raw):
+		"""Decode a finished member; False if the object turned out malformed."""
+		try:
+			value = json.loads(raw)
+		except ValueError:
+			return False
+		validate = self.validators.get(self._key)
+		if validate is None or validate(value):
+			self.sections[self._key] = value
+			self._completed.append((self._key, value))
+		return True
+
+	def feed(self, text):
+		"""Consume the next piece of output; returns the (key, value) members it completed."""
+		self._completed = []
+		key_start = 0 if self._key_parts is not None else None
+		value_start = 0 if self._value_parts is not None else None
+		i, n = 0, len(text)
+
+		while i < n and not self.done:
+			if self._in_string:
+				if self._escape:
+					self._escape = False
+					i += 1
+					continue
+				match = _STRING_SPECIAL.search(text, i)
+				if match is None:
+					break
+				i = match.start()
+				if text[i] == '\\':
+					self._escape = True
+					i += 1
+					continue
+				self._in_string = False
+				if key_start is not None:
+					self._key_parts.append(text[key_start:i + 1])
+					try:
+						self._key = json.loads(''.join(self._key_parts))
+					except ValueError:
+						self._key = None
+					self._key_parts, key_start = None, None
+				i += 1
+				continue
+
+			if self._depth == 0:
+				# Outside the object only its opening brace matters
+				i = text.find('{', i)
+				if i == -1:
+					break
+				self._depth = 1
+				i += 1
+				continue
+			if self._depth > 1:
+				match = _NESTED_SPECIAL.search(text, i)
+				if match is None:
+					break
+				i = match.start()
+
+			c = text[i]
+			if self._depth == 1 and self._value_parts is None and c not in ' \t\r\n",:}':
+				# Not a key where one belongs: a stray brace in the prose.
+				# Start over from this character.
+				self._reset()
+				continue
+			elif c == '"':
+				self._in_string = True
+				if self._depth == 1 and self._value_parts is None:
+					self._key_parts, key_start = [], i
+			elif c in '{[':
+				self._depth += 1
+			elif self._depth > 1 and c in '}]':
+				self._depth -= 1
+			elif self._depth == 1 and c == ':' and self._value_parts is None:
+				self._value_parts, value_start = [], i + 1
+			elif self._depth == 1 and c in ',}':
+				if self._value_parts is not None:
+					self._value_parts.append(text[value_start:i])
+					raw = ''.join(self._value_parts)
+					self._value_parts, value_start = None, None
+					if not self._member(raw):
+						# Look for another object further on
+						self._reset()
+						i += 1
+						continue
+				if c == '}':
+					self.done = True
+			i += 1
+
+		if key_start is not None:
+			self._key_parts.append(text[key_start:])
+		if value_start is not None:
+			self._value_parts.append(text[value_start:])
+		return self._completed
+
+	def result(self):
+		if not self.sections:
+			raise ValueError("no JSON object found in completion")
+		return dict(self.sections)
+
+
+def _validated(data, validators=SECTION_VALIDATORS):
+	return {
+		key: value for key, value in data.items()
+		if key not in validators or validators[key](value)
+	}
+
+
 def parse_json(content):
-	json_str = re.search(r'```json\n(.*)\n```', content, re.DOTALL).group(1)
+	"""Per-platform sections from a complete completion.
 
-	social_data = json.loads(json_str)
+	Well-formed output is decoded in one pass from its first brace; the
+	streaming parser only runs when that fails.
+	"""
+	start = content.find('{')
+	if start != -1:
+		try:
+			data, _ = _decoder.raw_decode(content, start)
+		except ValueError:
+			data = None
+		if isinstance(data, dict):
+			sections = _validated(data)
+			if sections:
+				return sections
 
-	return social_data
+	parser = StreamingJSONParser()
+	parser.feed(content)
+	return parser.result()
@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# LLM completions and video uploads run far past the default buckets
+UPSTREAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+REQUESTS = Counter(
+    'backend_requests_total', 'Requests handled by the backend',
+    ['endpoint', 'method', 'status']
+)
+LATENCY = Histogram(
+    'backend_request_duration_seconds', 'Time spent handling a request',
+    ['endpoint', 'status'], buckets=UPSTREAM_BUCKETS
+)
+IN_FLIGHT = Gauge('backend_requests_in_flight', 'Requests currently being handled')
+UPSTREAM_LATENCY = Histogram(
+    'backend_upstream_duration_seconds', 'Time spent in calls to Redis, YouTube and the LLM API',
+    ['upstream', 'operation'], buckets=UPSTREAM_BUCKETS
+)
+GENERATION_CACHE = Counter(
+    'backend_generation_cache_total', 'Post generation cache lookups by result (exact, similar or miss)',
+    ['result']
+)
+GENERATION_SAVED_SECONDS = Counter(
+    'backend_generation_cache_saved_seconds_total', 'LLM time avoided by cache hits, at the average miss latency'
+)
+TOKEN_REFRESHES = Counter(
+    'backend_token_refreshes_total', 'Background OAuth token refreshes by result (ok, retry or failed)',
+    ['result']
+)
+SCHEDULED_POSTS = Counter(
+    'backend_scheduled_posts_total', 'Scheduled posts by outcome (dispatched or failed)',
+    ['result']
+)
+
+
+@contextmanager
+def upstream_timer(upstream, operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        UPSTREAM_LATENCY.labels(upstream, operation).observe(time.perf_counter() - start)
+
+
+def init_app(app):
+    """Register request metrics hooks and the /metrics route."""
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # The endpoint name keeps label cardinality bounded
+            endpoint = request.endpoint or 'not_found'
+            REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+            LATENCY.labels(endpoint, response.status_code).observe(time.perf_counter() - start)
+        return response
+
+    @app.teardown_request
+    def finish_metrics(exc):
+        IN_FLIGHT.dec()
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,92 @@
+import importlib
+import os
+
+from youtube.cache import l1
+from youtube.uploads import CHUNK_SIZE, resume_from, send_chunks
+from youtube.utils import new_client
+
+
+class Adapter:
+    """Publishes one platform's section of a generated post.
+
+    platform names the section of the post the adapter takes, as produced
+    by the chat completion (tiktok, youtube, instagram or x). publish gets
+    that section, the shared media and the target being run, and returns a
+    dict describing what was published; it raises to fail the target.
+    """
+
+    platform = None
+
+    def linked(self, r, user_id):
+        """Whether the user connected an account this adapter can post to."""
+        raise NotImplementedError
+
+    def publish(self, r, user_id, section, media, target):
+        raise NotImplementedError
+
+
+class YouTubeAdapter(Adapter):
+    """Uploads the video with the post's title, description and tags.
+
+    YouTube takes no idempotency key, so the upload session is saved as the
+    target's checkpoint; a retried target resumes it instead of inserting
+    a second video.
+    """
+
+    platform = 'youtube'
+
+    def linked(self, r, user_id):
+        return bool(l1.get(user_id))
+
+    def publish(self, r, user_id, section, media, target):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        stored_credentials = r.get(user_id)
+        if not stored_credentials:
+            raise RuntimeError("User not linked")
+
+        snippet = {"title": section["title"], "description": section.get("description", "")}
+        if section.get("tags"):
+            snippet["tags"] = section["tags"]
+        insert_request = new_client(stored_credentials).videos().insert(
+            part="snippet,status",
+            body={
+                "snippet": snippet,
+                "status": {
+                    "privacyStatus": target.options.get("privacy_status") or "private"
+                }
+            },
+            media_body=MediaIoBaseUpload(media.open(), media.mime_type, chunksize=CHUNK_SIZE, resumable=True)
+        )
+        if target.checkpoint.get("upload_uri"):
+            resume_from(insert_request, target.checkpoint["upload_uri"])
+
+        def saved(request):
+            target.save({
+                "upload_uri": request.resumable_uri or "",
+                "bytes_sent": request.resumable_progress,
+            })
+
+        response = send_chunks(insert_request, saved)
+        return {"id": response.get("id", ""), "url": f"https://www.youtube.com/watch?v={response.get('id', '')}"}
+
+
+ADAPTERS = {}
+
+
+def register(adapter):
+    """Make an adapter available for its platform, replacing any before it."""
+    ADAPTERS[adapter.platform] = adapter
+    return adapter
+
+
+def load_adapters(spec):
+    """Register adapters named as module:Class, comma separated."""
+    for path in filter(None, (part.strip() for part in spec.split(','))):
+        module, _, name = path.partition(':')
+        register(getattr(importlib.import_module(module), name)())
+
+
+register(YouTubeAdapter())
+# Other platforms, or local fakes for testing, plug in from here
+load_adapters(os.getenv('PUBLISH_ADAPTERS', ''))
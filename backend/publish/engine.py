@@ -0,0 +1,352 @@
+import io
+import json
+import mmap
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+from .adapters import ADAPTERS
+
+# Targets published at once across all publications
+WORKERS = int(os.getenv('PUBLISH_WORKERS', 4))
+# Publications stay visible to the status endpoint this long
+JOB_TTL = 7 * 24 * 3600
+# Renewed whenever a target saves progress
+LOCK_TTL = 300
+# How often unfinished publications are looked at, so targets held by a
+# run that died are picked up again once their lock runs out
+RESUME_INTERVAL = float(os.getenv('PUBLISH_RESUME_INTERVAL', 60))
+
+QUEUED = 'queued'
+PUBLISHING = 'publishing'
+DONE = 'done'
+FAILED = 'failed'
+# Targets that are never attempted
+NOT_LINKED = 'not_linked'
+UNSUPPORTED = 'unsupported'
+NO_CONTENT = 'no_content'
+ACTIVE = (QUEUED, PUBLISHING)
+
+PENDING_KEY = 'publications:pending'
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='publish')
+
+# Publications this process is running targets of
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def publication_key(publication_id):
+    return f"publication:{publication_id}"
+
+
+def targets_key(publication_id):
+    return f"publication:{publication_id}:targets"
+
+
+def idempotency_key(user_id, key):
+    return f"publish:idempotency:{user_id}:{key}"
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class _MediaStream(io.RawIOBase):
+    """A read-only, seekable view of shared media; reads copy only what they return."""
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._data)}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def readinto(self, buffer):
+        chunk = self._data[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+
+class SharedMedia:
+    """A publication's media file, mapped into memory once for every target.
+
+    Each open() is an independent stream over the same pages, so targets
+    publishing in parallel don't read the file again. The mapping is
+    released, and on_done called, when the last target lets go of it.
+    """
+
+    def __init__(self, path, mime_type, users, on_done):
+        self.path = path
+        self.mime_type = mime_type
+        self._users = users
+        self._on_done = on_done
+        self._lock = threading.Lock()
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+
+    def open(self):
+        return io.BufferedReader(_MediaStream(self._data))
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._users:
+                return
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+        self._on_done()
+
+
+class Target:
+    """One platform of a publication, as handed to its adapter.
+
+    checkpoint is whatever the adapter saved on an earlier attempt;
+    save(checkpoint) stores new progress.
+    """
+
+    def __init__(self, r, publication_id, platform, status, options):
+        self.r = r
+        self.publication_id = publication_id
+        self.platform = platform
+        self.options = options
+        self.checkpoint = status.get("checkpoint", {})
+        # Stable across retries, for platforms that deduplicate requests
+        self.idempotency_key = f"{publication_id}:{platform}"
+
+    def save(self, checkpoint):
+        self.checkpoint = checkpoint
+        _set_target(self.r, self.publication_id, self.platform, state=PUBLISHING, checkpoint=checkpoint)
+        self.r.expire(_lock_key(self.publication_id, self.platform), LOCK_TTL)
+
+
+def _lock_key(publication_id, platform):
+    return f"{publication_key(publication_id)}:{platform}:lock"
+
+
+def _set_target(r, publication_id, platform, **fields):
+    key = targets_key(publication_id)
+    status = json.loads(r.hget(key, platform) or '{}')
+    status.update(fields, updated_at=time.time())
+    r.hset(key, platform, json.dumps(status))
+
+
+def get_publication(r, publication_id):
+    publication = {_text(k): _text(v) for k, v in r.hgetall(publication_key(publication_id)).items()}
+    if not publication:
+        return None
+    publication["targets"] = {
+        _text(platform): json.loads(status)
+        for platform, status in r.hgetall(targets_key(publication_id)).items()
+    }
+    return publication
+
+
+def _initial_state(r, user_id, post, platform):
+    adapter = ADAPTERS.get(platform)
+    if adapter is None:
+        return UNSUPPORTED
+    if not post.get(platform):
+        return NO_CONTENT
+    if not adapter.linked(r, user_id):
+        return NOT_LINKED
+    return QUEUED
+
+
+def new_publication_id():
+    return uuid.uuid4().hex
+
+
+def existing_publication(r, user_id, key):
+    """The publication an idempotency key was first used for, if any."""
+    return _text(r.get(idempotency_key(user_id, key)))
+
+
+def create_publication(r, publication_id, user_id, post, media_path, mime_type, platforms, options, key=None):
+    """Record a publication and start its targets.
+
+    Returns (publication_id, created). With an idempotency key that was
+    already used, nothing new is started and the earlier id comes back.
+    The key is written together with the publication, so whoever finds
+    it finds the publication too.
+    """
+    targets = {
+        platform: json.dumps({"state": _initial_state(r, user_id, post, platform), "updated_at": time.time()})
+        for platform in platforms
+    }
+    with r.pipeline() as pipe:
+        while True:
+            try:
+                if key:
+                    pipe.watch(idempotency_key(user_id, key))
+                    existing = _text(pipe.get(idempotency_key(user_id, key)))
+                    if existing:
+                        return existing, False
+                    pipe.multi()
+                    pipe.set(idempotency_key(user_id, key), publication_id, ex=JOB_TTL)
+                pipe.hset(publication_key(publication_id), mapping={
+                    'user_id': user_id,
+                    'post': json.dumps(post),
+                    'media_path': media_path,
+                    'mime_type': mime_type,
+                    'options': json.dumps(options),
+                    'created_at': time.time(),
+                })
+                pipe.hset(targets_key(publication_id), mapping=targets)
+                pipe.sadd(PENDING_KEY, publication_id)
+                pipe.execute()
+                break
+            except redis.WatchError:
+                # Another request took the key; the next pass returns its id
+                continue
+    start(r, publication_id)
+    return publication_id, True
+
+
+def _publish_target(r, publication_id, publication, platform, media):
+    lock_key = _lock_key(publication_id, platform)
+    try:
+        # Held by a run elsewhere; the resumer comes back to the target
+        # until that run finishes it or its lock runs out
+        if not r.set(lock_key, 1, nx=True, ex=LOCK_TTL):
+            return
+        try:
+            status = publication["targets"][platform]
+            target = Target(r, publication_id, platform, status, json.loads(publication["options"]))
+            _set_target(r, publication_id, platform, state=PUBLISHING)
+            post = json.loads(publication["post"])
+            result = ADAPTERS[platform].publish(r, publication["user_id"], post[platform], media, target)
+            _set_target(r, publication_id, platform, state=DONE, result=result)
+        except Exception as e:
+            # Whether the adapter or the setup around it failed, so the
+            # target doesn't stay publishing; if Redis is what failed, the
+            # target is left active and the resumer tries it again
+            _set_target(r, publication_id, platform, state=FAILED, error=str(e))
+        finally:
+            r.delete(lock_key)
+    finally:
+        media.release()
+
+
+def _finish(r, publication_id, media_path):
+    """Clean up once no target of the publication is left to run."""
+    targets = get_publication(r, publication_id)["targets"]
+    if any(status["state"] in ACTIVE for status in targets.values()):
+        return
+    for key in (publication_key(publication_id), targets_key(publication_id)):
+        r.expire(key, JOB_TTL)
+    r.srem(PENDING_KEY, publication_id)
+    try:
+        os.remove(media_path)
+    except OSError:
+        pass
+
+
+def start(r, publication_id):
+    """Publish every target still queued, or interrupted, in parallel.
+
+    Does nothing if this process is already running the publication.
+    """
+    with _in_flight_lock:
+        if publication_id in _in_flight:
+            return
+        _in_flight.add(publication_id)
+    started = False
+    try:
+        started = _start(r, publication_id)
+    finally:
+        if not started:
+            _done(publication_id)
+
+
+def _done(publication_id):
+    with _in_flight_lock:
+        _in_flight.discard(publication_id)
+
+
+def _start(r, publication_id):
+    """Submit the publication's active targets; False if none were."""
+    publication = get_publication(r, publication_id)
+    if publication is None:
+        r.srem(PENDING_KEY, publication_id)
+        return False
+    platforms = [
+        platform for platform, status in publication["targets"].items()
+        if status["state"] in ACTIVE and platform in ADAPTERS
+    ]
+    media_path = publication["media_path"]
+    if not platforms:
+        _finish(r, publication_id, media_path)
+        return False
+
+    def done():
+        try:
+            _finish(r, publication_id, media_path)
+        finally:
+            _done(publication_id)
+
+    try:
+        media = SharedMedia(media_path, publication["mime_type"], len(platforms), done)
+    except OSError as e:
+        for platform in platforms:
+            _set_target(r, publication_id, platform, state=FAILED, error=f"Media unavailable: {e}")
+        _finish(r, publication_id, media_path)
+        return False
+    for platform in platforms:
+        executor.submit(_publish_target, r, publication_id, publication, platform, media)
+    return True
+
+
+def resume_pending(r):
+    """Restart unfinished publications, including ones a previous run of this service left."""
+    for publication_id in r.smembers(PENDING_KEY):
+        executor.submit(start, r, _text(publication_id))
+
+
+def _run(r):
+    while True:
+        try:
+            resume_pending(r)
+        except redis.RedisError:
+            pass
+        time.sleep(RESUME_INTERVAL)
+
+
+def start_resumer(r):
+    """Keep restarting unfinished publications until every target is settled."""
+    threading.Thread(target=_run, args=(r,), name='publish-resumer', daemon=True).start()
+
+
+def publication_status(publication_id, publication):
+    targets = {
+        platform: {field: value for field, value in status.items() if field != "checkpoint"}
+        for platform, status in publication["targets"].items()
+    }
+    attempted = [status["state"] for status in targets.values() if status["state"] in ACTIVE + (DONE, FAILED)]
+    if any(state in ACTIVE for state in attempted):
+        state = PUBLISHING
+    elif attempted and all(state == DONE for state in attempted):
+        state = DONE
+    elif any(state == DONE for state in attempted):
+        state = 'partial'
+    else:
+        state = FAILED
+    return {"publication_id": publication_id, "state": state, "targets": targets}
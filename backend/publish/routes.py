@@ -0,0 +1,167 @@
+import json
+import mimetypes
+import os
+import time
+from datetime import datetime, timezone
+
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from werkzeug.formparser import parse_form_data
+
+from youtube.cache import r
+from youtube.uploads import stream_factory
+from .engine import create_publication, existing_publication, get_publication, new_publication_id, publication_status
+from .scheduler import (
+    cancel_scheduled, get_scheduled, list_scheduled, new_scheduled_id, schedule_post, scheduled_status
+)
+
+publish_routes = Blueprint('publish_routes', __name__)
+
+
+def _read_upload(upload_id):
+    """Stream the multipart body to disk and read the publishing fields.
+
+    Returns (file_path, post, platforms, mime_type, options, form), or
+    None, with nothing left on disk, when the media or post is missing.
+    """
+    saved = {}
+    _, form, files = parse_form_data(request.environ, stream_factory=stream_factory(upload_id, saved))
+    mime_type = None
+    for file in files.values():
+        mime_type = mime_type or file.mimetype
+        file.close()
+
+    file_path = saved.get("path")
+    try:
+        post = json.loads(form.get("post") or "")
+    except ValueError:
+        post = None
+    if not file_path or not isinstance(post, dict):
+        if file_path:
+            os.remove(file_path)
+        return None
+
+    platforms = [platform for platform in form.get("platforms", "").split(",") if platform] or list(post)
+    mime_type = mime_type or mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    options = {"privacy_status": form.get("privacyStatus")}
+    return file_path, post, platforms, mime_type, options, form
+
+
+def _publish_at(value):
+    """Epoch seconds from a number or an ISO 8601 time; None if it is neither."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+@publish_routes.route("/", methods=["POST"])
+@jwt_required()
+def publish():
+    """Publish a generated post and its media to the user's platforms at once.
+
+    Multipart form: media, the file; post, the generated post JSON; and
+    optionally platforms, a comma separated subset of the post's sections,
+    and privacyStatus for YouTube. Retrying with the same Idempotency-Key
+    header returns the first publication instead of starting another.
+    """
+    user_id = get_jwt_identity()
+    key = request.headers.get("Idempotency-Key")
+    if key:
+        publication_id = existing_publication(r, user_id, key)
+        publication = get_publication(r, publication_id) if publication_id else None
+        if publication:
+            return jsonify(publication_status(publication_id, publication))
+
+    publication_id = new_publication_id()
+    upload = _read_upload(publication_id)
+    if upload is None:
+        return jsonify({"error": "Missing media or generated post"}), 400
+    file_path, post, platforms, mime_type, options, _ = upload
+
+    publication_id, created = create_publication(
+        r, publication_id, user_id, post, file_path, mime_type, platforms, options, key
+    )
+    if not created:
+        # Another request with this key got there first
+        os.remove(file_path)
+    return jsonify(publication_status(publication_id, get_publication(r, publication_id))), 202 if created else 200
+
+
+@publish_routes.route("/scheduled", methods=["POST"])
+@jwt_required()
+def schedule():
+    """Publish a generated post later.
+
+    Takes the same form as publishing now, plus publishAt, in epoch
+    seconds or ISO 8601 (UTC unless an offset is given).
+    """
+    user_id = get_jwt_identity()
+    scheduled_id = new_scheduled_id()
+    upload = _read_upload(scheduled_id)
+    if upload is None:
+        return jsonify({"error": "Missing media or generated post"}), 400
+    file_path, post, platforms, mime_type, options, form = upload
+
+    publish_at = _publish_at(form.get("publishAt"))
+    if publish_at is None or publish_at < time.time():
+        os.remove(file_path)
+        return jsonify({"error": "publishAt must be a time in the future"}), 400
+
+    schedule_post(r, scheduled_id, user_id, post, file_path, mime_type, platforms, options, publish_at)
+    return jsonify(scheduled_status(scheduled_id, get_scheduled(r, scheduled_id))), 201
+
+
+@publish_routes.route("/scheduled", methods=["GET"])
+@jwt_required()
+def scheduled_posts():
+    return jsonify({
+        "scheduled": [
+            scheduled_status(scheduled_id, scheduled)
+            for scheduled_id, scheduled in list_scheduled(r, get_jwt_identity())
+        ]
+    })
+
+
+def _own_scheduled(scheduled_id):
+    scheduled = get_scheduled(r, scheduled_id)
+    if not scheduled or scheduled.get("user_id") != get_jwt_identity():
+        return None
+    return scheduled
+
+
+@publish_routes.route("/scheduled/<scheduled_id>", methods=["GET"])
+@jwt_required()
+def scheduled_post(scheduled_id):
+    scheduled = _own_scheduled(scheduled_id)
+    if scheduled is None:
+        return jsonify({"error": "Scheduled post not found"}), 404
+    return jsonify(scheduled_status(scheduled_id, scheduled))
+
+
+@publish_routes.route("/scheduled/<scheduled_id>", methods=["DELETE"])
+@jwt_required()
+def cancel_scheduled_post(scheduled_id):
+    scheduled = _own_scheduled(scheduled_id)
+    if scheduled is None:
+        return jsonify({"error": "Scheduled post not found"}), 404
+    if not cancel_scheduled(r, scheduled_id, scheduled):
+        return jsonify({"error": "Post is no longer scheduled"}), 409
+    return jsonify(scheduled_status(scheduled_id, get_scheduled(r, scheduled_id)))
+
+
+@publish_routes.route("/<publication_id>", methods=["GET"])
+@jwt_required()
+def publish_status(publication_id):
+    """Report the overall state and each platform's progress."""
+    publication = get_publication(r, publication_id)
+    if not publication or publication.get("user_id") != get_jwt_identity():
+        return jsonify({"error": "Publication not found"}), 404
+    return jsonify(publication_status(publication_id, publication))
@@ -0,0 +1,314 @@
+"""Scheduled posts: publications started at a chosen time.
+
+Due times live in one sorted set. Dispatchers in any number of processes
+claim due posts in batches by moving them a lease into the future; a
+claimed post finishes by releasing its lease, which either removes it or
+moves it to its next retry. A dispatcher that dies mid-batch loses
+nothing, as its posts come due again when their leases run out, and the
+publication's idempotency key keeps a post from being published twice.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+from metrics import SCHEDULED_POSTS
+from .engine import JOB_TTL, create_publication, idempotency_key, new_publication_id
+
+DUE_KEY = 'scheduled:due'
+# Posts claimed per round trip, and how long a claim holds them
+BATCH_SIZE = int(os.getenv('SCHEDULE_BATCH_SIZE', 100))
+LEASE = float(os.getenv('SCHEDULE_LEASE', 60))
+WORKERS = int(os.getenv('SCHEDULE_WORKERS', 4))
+# How often an idle dispatcher looks for posts that came due
+POLL_INTERVAL = float(os.getenv('SCHEDULE_POLL', 1))
+# Failed dispatches of a post before it is given up on
+MAX_ATTEMPTS = 5
+
+SCHEDULED = 'scheduled'
+# Claimed by a dispatcher; past the point where it can be cancelled
+DISPATCHING = 'dispatching'
+DISPATCHED = 'dispatched'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Take up to ARGV[2] members due by ARGV[1] and hold them until ARGV[3].
+# The lease's deadline doubles as its token: only the claim that set a
+# score may release it.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+return due
+"""
+
+# ARGV holds (member, lease, next due or '') triples. A member still held
+# by that lease is removed, along with its count of attempts in KEYS[2], or
+# rescheduled when a next due time is given; members whose lease ran out
+# and were claimed again are left alone.
+RELEASE_SCRIPT = """
+local released = 0
+for i = 1, #ARGV, 3 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        if ARGV[i + 2] == '' then
+            redis.call('ZREM', KEYS[1], ARGV[i])
+            redis.call('HDEL', KEYS[2], ARGV[i])
+        else
+            redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+        end
+        released = released + 1
+    end
+end
+return released
+"""
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def backoff(attempts):
+    """Seconds before retry number attempts, with jitter so failures spread out."""
+    return min(30 * 2 ** (attempts - 1), 1800) * random.uniform(0.8, 1.2)
+
+
+class Dispatcher:
+    """Runs handler(member) for each member of a sorted set once its score is due.
+
+    A handler that raises is retried with backoff, up to max_attempts;
+    then on_give_up(member, error) is called and the member dropped.
+    """
+
+    def __init__(self, r, key, handler, on_give_up=None, batch_size=BATCH_SIZE, lease=LEASE,
+                 workers=WORKERS, max_attempts=MAX_ATTEMPTS):
+        self.r = r
+        self.key = key
+        self.attempts_key = f"{key}:attempts"
+        self.handler = handler
+        self.on_give_up = on_give_up
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='schedule')
+        self._claim = r.register_script(CLAIM_SCRIPT)
+        self._release = r.register_script(RELEASE_SCRIPT)
+
+    def claim(self, now=None):
+        """Take a batch of due members; returns them with the lease they are held under."""
+        now = time.time() if now is None else now
+        # Milliseconds, so the lease survives the trip through Redis unchanged
+        lease = round(now + self.lease, 3)
+        due = self._claim(keys=[self.key], args=[now, self.batch_size, lease])
+        return [_text(member) for member in due], lease
+
+    def _run(self, member):
+        try:
+            self.handler(member)
+        except Exception as e:
+            return e
+        return None
+
+    def run_once(self):
+        """Claim one batch and run it; returns how many members were claimed."""
+        members, lease = self.claim()
+        if not members:
+            return 0
+
+        errors = list(self.executor.map(self._run, members))
+        failed = [member for member, error in zip(members, errors) if error is not None]
+        attempts = {}
+        if failed:
+            pipe = self.r.pipeline(transaction=False)
+            for member in failed:
+                pipe.hincrby(self.attempts_key, member, 1)
+            attempts = dict(zip(failed, pipe.execute()))
+
+        args = []
+        given_up = []
+        now = time.time()
+        for member, error in zip(members, errors):
+            if error is None or attempts[member] >= self.max_attempts:
+                args += [member, lease, '']
+                if error is not None:
+                    given_up.append((member, error))
+            else:
+                args += [member, lease, now + backoff(attempts[member])]
+        self._release(keys=[self.key, self.attempts_key], args=args)
+
+        if self.on_give_up:
+            for member, error in given_up:
+                self.on_give_up(member, error)
+        return len(members)
+
+    def run(self):
+        while True:
+            try:
+                # A full batch suggests more are due already
+                if self.run_once() >= self.batch_size:
+                    continue
+            except redis.RedisError:
+                pass
+            time.sleep(POLL_INTERVAL)
+
+
+def scheduled_key(scheduled_id):
+    return f"scheduled:{scheduled_id}"
+
+
+def user_scheduled_key(user_id):
+    return f"scheduled:user:{user_id}"
+
+
+def get_scheduled(r, scheduled_id):
+    scheduled = {_text(k): _text(v) for k, v in r.hgetall(scheduled_key(scheduled_id)).items()}
+    return scheduled or None
+
+
+def new_scheduled_id():
+    return uuid.uuid4().hex
+
+
+def schedule_post(r, scheduled_id, user_id, post, media_path, mime_type, platforms, options, publish_at):
+    """Store a post and its media to be published at publish_at (epoch seconds)."""
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(scheduled_key(scheduled_id), mapping={
+        'user_id': user_id,
+        'post': json.dumps(post),
+        'media_path': media_path,
+        'mime_type': mime_type,
+        'platforms': json.dumps(platforms),
+        'options': json.dumps(options),
+        'publish_at': publish_at,
+        'state': SCHEDULED,
+        'created_at': time.time(),
+    })
+    pipe.zadd(user_scheduled_key(user_id), {scheduled_id: publish_at})
+    pipe.zadd(DUE_KEY, {scheduled_id: publish_at})
+    pipe.execute()
+
+
+def cancel_scheduled(r, scheduled_id, scheduled):
+    """Drop a post that hasn't been dispatched yet. Returns whether it was cancelled."""
+    key = scheduled_key(scheduled_id)
+    try:
+        with r.pipeline() as pipe:
+            # Lose to a dispatcher that gets there first
+            pipe.watch(key)
+            if _text(pipe.hget(key, 'state')) != SCHEDULED:
+                return False
+            pipe.multi()
+            pipe.zrem(DUE_KEY, scheduled_id)
+            pipe.zrem(user_scheduled_key(scheduled['user_id']), scheduled_id)
+            pipe.hset(key, 'state', CANCELLED)
+            pipe.expire(key, JOB_TTL)
+            pipe.execute()
+    except redis.WatchError:
+        return False
+    try:
+        os.remove(scheduled['media_path'])
+    except OSError:
+        pass
+    return True
+
+
+def _start_dispatch(r, scheduled_id):
+    """Move a post from scheduled to dispatching, so it can no longer be cancelled.
+
+    Returns the post, or None if it was cancelled or already dispatched.
+    A post left dispatching by an earlier attempt is returned as it is.
+    """
+    key = scheduled_key(scheduled_id)
+    # A cancel that gets in first fails the WATCH; the WatchError fails this
+    # attempt and the retry finds the post cancelled
+    with r.pipeline() as pipe:
+        pipe.watch(key)
+        scheduled = {_text(k): _text(v) for k, v in pipe.hgetall(key).items()}
+        if not scheduled or scheduled['state'] not in (SCHEDULED, DISPATCHING):
+            return None
+        pipe.multi()
+        pipe.hset(key, 'state', DISPATCHING)
+        pipe.execute()
+    return scheduled
+
+
+def dispatch(r, scheduled_id):
+    """Start the publication of a post that came due."""
+    scheduled = _start_dispatch(r, scheduled_id)
+    if scheduled is None:
+        return
+    # Keyed by the scheduled post, so a dispatch repeated after a lost
+    # lease finds the publication the first one started
+    publication_id, _ = create_publication(
+        r, new_publication_id(), scheduled['user_id'], json.loads(scheduled['post']),
+        scheduled['media_path'], scheduled['mime_type'], json.loads(scheduled['platforms']),
+        json.loads(scheduled['options']), key=scheduled_key(scheduled_id)
+    )
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(scheduled_key(scheduled_id), mapping={'state': DISPATCHED, 'publication_id': publication_id})
+    pipe.expire(scheduled_key(scheduled_id), JOB_TTL)
+    pipe.execute()
+    SCHEDULED_POSTS.labels('dispatched').inc()
+
+
+def _give_up(r, scheduled_id, error):
+    scheduled = {_text(k): _text(v) for k, v in r.hgetall(scheduled_key(scheduled_id)).items()}
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(scheduled_key(scheduled_id), mapping={'state': FAILED, 'error': str(error)})
+    pipe.expire(scheduled_key(scheduled_id), JOB_TTL)
+    pipe.execute()
+    SCHEDULED_POSTS.labels('failed').inc()
+    # A publication started with the media removes it once done
+    started = scheduled and r.exists(idempotency_key(scheduled['user_id'], scheduled_key(scheduled_id)))
+    if scheduled.get('media_path') and not started:
+        try:
+            os.remove(scheduled['media_path'])
+        except OSError:
+            pass
+
+
+def list_scheduled(r, user_id):
+    """The user's scheduled posts by publish time, dropping ones that expired."""
+    scheduled_ids = [_text(scheduled_id) for scheduled_id in r.zrange(user_scheduled_key(user_id), 0, -1)]
+    pipe = r.pipeline(transaction=False)
+    for scheduled_id in scheduled_ids:
+        pipe.hgetall(scheduled_key(scheduled_id))
+    found = []
+    for scheduled_id, scheduled in zip(scheduled_ids, pipe.execute()):
+        if scheduled:
+            found.append((scheduled_id, {_text(k): _text(v) for k, v in scheduled.items()}))
+    expired = set(scheduled_ids) - {scheduled_id for scheduled_id, _ in found}
+    if expired:
+        r.zrem(user_scheduled_key(user_id), *expired)
+    return found
+
+
+def scheduled_status(scheduled_id, scheduled):
+    status = {
+        "scheduled_id": scheduled_id,
+        "state": scheduled['state'],
+        "publish_at": float(scheduled['publish_at']),
+        "platforms": json.loads(scheduled['platforms']),
+    }
+    for field in ('publication_id', 'error'):
+        if scheduled.get(field):
+            status[field] = scheduled[field]
+    return status
+
+
+def start_scheduler(r):
+    """Dispatch scheduled posts from a background thread of this process."""
+    dispatcher = Dispatcher(
+        r, DUE_KEY,
+        lambda scheduled_id: dispatch(r, scheduled_id),
+        on_give_up=lambda scheduled_id, error: _give_up(r, scheduled_id, error),
+    )
+    threading.Thread(target=dispatcher.run, name='schedule-dispatcher', daemon=True).start()
+    return dispatcher
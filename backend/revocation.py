@@ -0,0 +1,31 @@
+import redis
+from jwt_revocation import RevocationCache
+
+
+class RevocationCheck:
+    """Rejects tokens the auth service revoked, by jti or by session id.
+
+    The auth service writes the list; this only reads it, from the same
+    REVOCATION_REDIS_URL, through jwt_revocation's cache.
+    """
+
+    def __init__(self):
+        self.checks = None
+
+    def init_app(self, app, jwt):
+        r = redis.Redis.from_url(
+            app.config['REVOCATION_REDIS_URL'],
+            socket_timeout=app.config['REVOCATION_TIMEOUT'],
+            socket_connect_timeout=app.config['REVOCATION_TIMEOUT']
+        )
+        self.checks = RevocationCache(r, app.config['REVOCATION_RECHECK'], app.config['REVOCATION_CACHE_SIZE'])
+        jwt.token_in_blocklist_loader(self._in_blocklist)
+
+    def _in_blocklist(self, jwt_header, jwt_payload):
+        return self.is_revoked(jwt_payload)
+
+    def is_revoked(self, claims):
+        return self.checks.is_revoked(claims)
+
+
+revocation_check = RevocationCheck()
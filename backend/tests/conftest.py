@@ -0,0 +1,13 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def r():
+    """A Redis stand-in, empty for each test; Lua scripts run on it too."""
+    return fakeredis.FakeRedis()
@@ -0,0 +1,155 @@
+import json
+import time
+
+import fakeredis
+import pytest
+import redis
+from prometheus_client import REGISTRY
+
+from youtube import utils
+from youtube.cache import LocalCache, TimedRedis
+from youtube.utils import CREDENTIALS_PREFIX, pack_credentials, unpack_credentials
+
+
+class CountingRedis(fakeredis.FakeRedis):
+    """Counts the MGETs that reach Redis."""
+
+    mgets = 0
+
+    def mget(self, keys, *args):
+        self.mgets += 1
+        return super().mget(keys, *args)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def timed(operation):
+    labels = {'upstream': 'redis', 'operation': operation}
+    return REGISTRY.get_sample_value('backend_upstream_duration_seconds_count', labels) or 0
+
+
+def test_commands_and_pipelines_are_timed():
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeRedisConnection, server=fakeredis.FakeServer())
+    r = TimedRedis(connection_pool=pool)
+    sets, pipelines = timed('set'), timed('pipeline')
+
+    r.set('a', 1)
+    with r.pipeline(transaction=False) as pipe:
+        pipe.set('b', 2)
+        pipe.get('a')
+        assert pipe.execute() == [True, b'1']
+
+    # The pipeline is one round trip, timed once rather than per queued command
+    assert timed('pipeline') == pipelines + 1
+    assert timed('set') == sets + 1
+
+
+def test_misses_are_fetched_with_one_mget():
+    r = CountingRedis()
+    r.set('a', 1)
+    r.set('b', 2)
+    cache = LocalCache(r, 60, 100)
+
+    assert cache.get_many('a', 'b', 'c') == [b'1', b'2', None]
+    assert r.mgets == 1
+    assert cache.get_many('b', 'a') == [b'2', b'1']
+    assert cache.get('c') is None
+    assert r.mgets == 1
+
+
+def test_entries_expire_after_the_ttl():
+    r = CountingRedis()
+    r.set('a', 1)
+    cache = LocalCache(r, 0.05, 100)
+    cache.get('a')
+
+    r.set('a', 2)
+    time.sleep(0.1)
+
+    assert cache.get('a') == b'2'
+    assert r.mgets == 2
+
+
+def test_least_recently_read_entries_are_evicted():
+    r = CountingRedis()
+    cache = LocalCache(r, 60, 2)
+    cache.get_many('a', 'b')
+    cache.get('a')
+    cache.get('c')
+
+    cache.get('a')
+    assert r.mgets == 2
+    cache.get('b')
+    assert r.mgets == 3
+
+
+def test_zero_ttl_reads_through():
+    r = CountingRedis()
+    cache = LocalCache(r, 0, 100)
+
+    cache.get('a')
+    cache.get('a')
+    cache.invalidate('a')
+
+    assert r.mgets == 2
+    assert cache._subscriber is None
+
+
+def test_invalidate_reaches_other_processes():
+    server = fakeredis.FakeServer()
+    writer = LocalCache(fakeredis.FakeRedis(server=server), 60, 100)
+    reader = LocalCache(fakeredis.FakeRedis(server=server), 60, 100)
+    writer.r.set('user1', 'old')
+    assert reader.get('user1') == b'old'
+    wait_for(lambda: writer.r.pubsub_numsub(LocalCache.INVALIDATION_CHANNEL)[0][1] > 0)
+
+    writer.r.set('user1', 'new')
+    # Served from the reader's copy until the writer says otherwise
+    assert reader.get('user1') == b'old'
+    writer.invalidate('user1', 'user1:uploads_playlist')
+
+    wait_for(lambda: 'user1' not in reader._entries)
+    assert reader.get('user1') == b'new'
+
+
+@pytest.fixture
+def client_secrets(tmp_path, monkeypatch):
+    path = tmp_path / 'client_secret.json'
+    path.write_text(json.dumps({"web": {
+        "client_id": "client", "client_secret": "secret", "token_uri": "https://oauth2.example/token",
+    }}))
+    monkeypatch.setattr(utils, 'CLIENT_SECRETS_FILE', str(path))
+    utils._shared_fields.cache_clear()
+    yield
+    utils._shared_fields.cache_clear()
+
+
+def test_credentials_are_stored_compactly(client_secrets):
+    info = {
+        "token": "token", "refresh_token": "refresh", "token_uri": "https://oauth2.example/token",
+        "client_id": "client", "client_secret": "secret", "scopes": utils.SCOPES,
+        "universe_domain": "googleapis.com", "account": "", "expiry": "2026-01-01T00:00:00.123456Z",
+    }
+
+    packed = pack_credentials(json.dumps(info))
+
+    assert packed == CREDENTIALS_PREFIX + '{"t":"token","r":"refresh","e":1767225600}'
+    assert unpack_credentials(packed.encode()) == dict(info, expiry="2026-01-01T00:00:00Z")
+
+
+def test_fields_that_differ_from_the_app_are_kept(client_secrets):
+    info = {"token": "token", "client_id": "other", "quota_project_id": "project"}
+
+    assert unpack_credentials(pack_credentials(json.dumps(info)))["client_id"] == "other"
+    assert unpack_credentials(pack_credentials(json.dumps(info)))["quota_project_id"] == "project"
+
+
+def test_credentials_stored_as_plain_json_still_load():
+    info = {"token": "token", "refresh_token": "refresh"}
+
+    assert unpack_credentials(json.dumps(info).encode()) == info
@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+from generate_posts import routes
+from generate_posts.cache import GenerationCache
+from generate_posts.quota import ItemQuota
+
+POSTS = {
+	"tiktok": {"title": "t", "description": "d", "hashtags": ["#a"]},
+	"youtube": {"title": "t", "description": "d", "tags": ["a"]},
+	"instagram": {"caption": "c", "hashtags": ["#a"]},
+	"x": {"tweet": "t", "hashtags": ["#a"]},
+}
+
+
+class StubLLM(BaseHTTPRequestHandler):
+	"""An OpenAI-compatible chat completions endpoint.
+
+	Answers every idea with POSTS, after sleeping as many seconds as an
+	idea of the form "sleep <seconds>" asks; an idea containing "fail"
+	gets a 500.
+	"""
+
+	calls = []
+
+	def log_message(self, *args):
+		pass
+
+	def do_POST(self):
+		body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		idea = body["messages"][-1]["content"]
+		self.calls.append(idea)
+		if idea.startswith("sleep "):
+			time.sleep(float(idea.split()[1]))
+		if "fail" in idea:
+			self._send(500, {"error": {"message": "boom"}})
+			return
+		content = json.dumps(POSTS)
+		if body.get("stream"):
+			self._stream(content)
+			return
+		self._send(200, {
+			"id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": body["model"],
+			"choices": [{
+				"index": 0, "finish_reason": "stop",
+				"message": {"role": "assistant", "content": content},
+			}],
+		})
+
+	def _send(self, status, payload):
+		data = json.dumps(payload).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def _stream(self, content):
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/event-stream')
+		self.end_headers()
+		for start in range(0, len(content), 20):
+			chunk = {
+				"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+				"choices": [{"index": 0, "delta": {"content": content[start:start + 20]}, "finish_reason": None}],
+			}
+			self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+		self.wfile.write(b"data: [DONE]\n\n")
+
+
+class StubServer(ThreadingHTTPServer):
+
+	def handle_error(self, request, client_address):
+		# Callers that timed out hang up before the answer is written
+		pass
+
+
+@pytest.fixture
+def llm(monkeypatch):
+	"""Points the LLM client at a local stub for the test."""
+	server = StubServer(('127.0.0.1', 0), StubLLM)
+	threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+	StubLLM.calls = []
+	monkeypatch.setenv('BASE_URL', f'http://127.0.0.1:{server.server_port}/v1')
+	monkeypatch.setenv('LLMAPI', 'test')
+	routes.get_client.cache_clear()
+	yield StubLLM.calls
+	routes.get_client.cache_clear()
+	server.shutdown()
+	server.server_close()
+
+
+@pytest.fixture
+def client(r, llm, monkeypatch):
+	monkeypatch.setattr(routes, 'generation_cache', GenerationCache(r, routes.MODEL, routes.SYSTEM_PROMPT))
+	monkeypatch.setattr(routes, 'batch_quota', ItemQuota(r, 0.1, 50))
+	app = Flask(__name__)
+	app.config['JWT_SECRET_KEY'] = 'a-test-secret-long-enough-for-hs256'
+	JWTManager(app)
+	app.register_blueprint(routes.generate_posts_routes, url_prefix='/posts')
+	with app.app_context():
+		token = create_access_token(identity='user1')
+	client = app.test_client()
+	client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+	return client
+
+
+def events(response):
+	"""(event, data) pairs of a server-sent event stream."""
+	parsed = []
+	for block in response.get_data(as_text=True).strip().split("\n\n"):
+		event, data = block.split("\n")
+		parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+	return parsed
+
+
+def test_generates_posts_through_the_llm(client, llm):
+	response = client.post('/posts/', json={"post": "a new video"})
+
+	assert response.status_code == 200
+	assert response.get_json() == POSTS
+	assert llm == ["a new video"]
+
+
+def test_repeated_idea_is_served_from_the_cache(client, llm):
+	client.post('/posts/', json={"post": "a new video"})
+	response = client.post('/posts/', json={"post": "a new video"})
+
+	assert response.get_json() == POSTS
+	assert len(llm) == 1
+
+
+def test_stream_sends_tokens_sections_and_the_result(client):
+	response = client.post('/posts/stream', json={"post": "a new video"})
+
+	sent = events(response)
+	assert sent[0][0] == "token"
+	assert {data["platform"] for event, data in sent if event == "section"} == set(POSTS)
+	assert sent[-1] == ("result", POSTS)
+
+
+def test_batch_returns_each_result_or_error_in_order(client):
+	response = client.post('/posts/batch', json={"posts": ["first", "please fail", "third"]})
+
+	results = response.get_json()["results"]
+	assert [item["index"] for item in results] == [0, 1, 2]
+	assert results[0]["result"] == POSTS and results[2]["result"] == POSTS
+	assert results[1]["error"] == "error generating posts"
+
+
+def test_batch_runs_items_concurrently(client):
+	start = time.monotonic()
+	response = client.post('/posts/batch', json={"posts": [f"sleep 0.5 #{n}" for n in range(4)]})
+
+	assert all("result" in item for item in response.get_json()["results"])
+	assert time.monotonic() - start < 1.5
+
+
+def test_batch_item_over_the_timeout_times_out(client, monkeypatch):
+	monkeypatch.setattr(routes, 'BATCH_ITEM_TIMEOUT', 0.5)
+
+	response = client.post('/posts/batch', json={"posts": ["sleep 2", "quick"]})
+
+	results = response.get_json()["results"]
+	assert results[0]["error"] == "timed out"
+	assert results[1]["result"] == POSTS
+
+
+def test_batch_timeout_counts_time_queued_for_a_worker(client, monkeypatch):
+	# One worker, busy with the first item for longer than the timeout,
+	# so the second never starts in time
+	monkeypatch.setattr(routes, 'BATCH_ITEM_TIMEOUT', 0.5)
+	executor = routes.ThreadPoolExecutor(max_workers=1)
+	monkeypatch.setattr(routes, 'batch_executor', executor)
+
+	start = time.monotonic()
+	response = client.post('/posts/batch', json={"posts": ["sleep 0.4 first", "sleep 0.4 second"]})
+	elapsed = time.monotonic() - start
+	executor.shutdown()
+
+	results = response.get_json()["results"]
+	assert results[0]["result"] == POSTS
+	assert results[1]["error"] == "timed out"
+	assert elapsed < 0.8
+
+
+def test_batch_stream_sends_items_then_done(client):
+	response = client.post('/posts/batch?stream=1', json={"posts": ["first", "please fail"]})
+
+	sent = events(response)
+	assert sorted(data["index"] for event, data in sent if event == "item") == [0, 1]
+	assert sent[-1] == ("done", {"count": 2, "failed": 1})
+
+
+def test_batch_needs_a_token(client):
+	del client.environ_base['HTTP_AUTHORIZATION']
+
+	assert client.post('/posts/batch', json={"posts": ["first"]}).status_code == 401
+
+
+def test_batch_items_count_against_the_users_quota(client, r, llm, monkeypatch):
+	monkeypatch.setattr(routes, 'batch_quota', ItemQuota(r, 0.1, 5))
+
+	assert client.post('/posts/batch', json={"posts": ["a", "b", "c"]}).status_code == 200
+	response = client.post('/posts/batch', json={"posts": ["d", "e", "f"]})
+
+	assert response.status_code == 429
+	# One token short at 0.1 a second
+	assert 9 <= int(response.headers['Retry-After']) <= 10
+	assert client.post('/posts/batch', json={"posts": ["d", "e"]}).status_code == 200
+	assert len(llm) == 5
+
+
+def test_batch_rejects_bad_input(client, monkeypatch):
+	monkeypatch.setattr(routes, 'BATCH_MAX_ITEMS', 2)
+
+	assert client.post('/posts/batch', json={"posts": []}).status_code == 400
+	assert client.post('/posts/batch', json={"posts": "one"}).status_code == 400
+	assert client.post('/posts/batch', json={"posts": ["a", "b", "c"]}).status_code == 400
@@ -0,0 +1,232 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from publish import engine
+from publish.adapters import ADAPTERS, Adapter, load_adapters, register
+from publish.engine import (
+    DONE, FAILED, NO_CONTENT, PENDING_KEY, PUBLISHING, QUEUED, UNSUPPORTED,
+    create_publication, existing_publication, get_publication, publication_status, resume_pending
+)
+
+
+class FakeAdapter(Adapter):
+    """Posts nowhere; records what it was given."""
+
+    platform = 'x'
+
+    def __init__(self):
+        self.published = []
+
+    def linked(self, r, user_id):
+        return True
+
+    def publish(self, r, user_id, section, media, target):
+        self.published.append((section, media.open().read()))
+        target.save({"step": "uploaded"})
+        return {"id": f"{self.platform}-1"}
+
+
+class FailingAdapter(FakeAdapter):
+    platform = 'tiktok'
+
+    def publish(self, r, user_id, section, media, target):
+        raise RuntimeError('rejected')
+
+
+@pytest.fixture(autouse=True)
+def platforms():
+    """Fake adapters in place of the real ones, restored afterwards."""
+    saved = dict(ADAPTERS)
+    ADAPTERS.clear()
+    yield
+    ADAPTERS.clear()
+    ADAPTERS.update(saved)
+
+
+@pytest.fixture
+def drain(monkeypatch):
+    """One publishing worker; calling the result waits for what it has queued."""
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(engine, 'executor', executor)
+    yield lambda: executor.submit(lambda: None).result()
+    executor.shutdown()
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'video')
+    return path
+
+
+POST = {"x": {"text": "hi"}, "tiktok": {"caption": "hi"}}
+
+
+def publish(r, media, platforms=('x', 'tiktok'), options=None, key=None, publication_id='pub1'):
+    return create_publication(
+        r, publication_id, 'user1', POST, str(media), 'video/mp4', list(platforms),
+        {"privacy_status": None} if options is None else options, key
+    )
+
+
+def test_register_makes_an_adapter_publish(r, media, drain):
+    fake = register(FakeAdapter())
+    publish(r, media, platforms=['x'])
+    drain()
+
+    publication = get_publication(r, 'pub1')
+    assert fake.published == [({"text": "hi"}, b'video')]
+    assert publication["targets"]["x"]["state"] == DONE
+    assert publication["targets"]["x"]["result"] == {"id": "x-1"}
+    assert publication["targets"]["x"]["checkpoint"] == {"step": "uploaded"}
+    assert publication_status('pub1', publication)["state"] == DONE
+    assert not r.sismember(PENDING_KEY, 'pub1')
+    assert not media.exists()
+
+
+def test_load_adapters_registers_adapters_by_name():
+    load_adapters('tests.test_publish:FakeAdapter, tests.test_publish:FailingAdapter')
+
+    assert isinstance(ADAPTERS['x'], FakeAdapter)
+    assert isinstance(ADAPTERS['tiktok'], FailingAdapter)
+
+
+def test_a_failing_target_leaves_the_others_published(r, media, drain):
+    register(FakeAdapter())
+    register(FailingAdapter())
+    publish(r, media, platforms=['x', 'tiktok', 'instagram', 'youtube'])
+    drain()
+
+    status = publication_status('pub1', get_publication(r, 'pub1'))
+    assert status["state"] == 'partial'
+    assert status["targets"]["x"]["state"] == DONE
+    assert status["targets"]["tiktok"] == {**status["targets"]["tiktok"], "state": FAILED, "error": "rejected"}
+    assert status["targets"]["instagram"]["state"] == UNSUPPORTED
+    assert status["targets"]["youtube"]["state"] == UNSUPPORTED
+    assert "checkpoint" not in status["targets"]["x"]
+
+
+def test_target_without_content_is_skipped(r, media, drain):
+    register(FakeAdapter())
+    create_publication(r, 'pub1', 'user1', {"x": {}}, str(media), 'video/mp4', ['x'], {}, None)
+    drain()
+
+    assert get_publication(r, 'pub1')["targets"]["x"]["state"] == NO_CONTENT
+    assert not r.sismember(PENDING_KEY, 'pub1')
+
+
+def test_error_before_the_adapter_runs_fails_the_target(r, media, drain):
+    fake = register(FakeAdapter())
+    publish(r, media, platforms=['x'])
+    drain()
+    # Same publication again, as a resumed run with broken options would see it
+    r.hset(engine.publication_key('pub1'), 'options', '{not json')
+    engine._set_target(r, 'pub1', 'x', state=QUEUED)
+    media.write_bytes(b'video')
+    r.sadd(PENDING_KEY, 'pub1')
+    resume_pending(r)
+    drain()
+    drain()
+
+    target = get_publication(r, 'pub1')["targets"]["x"]
+    assert target["state"] == FAILED and target["error"]
+    assert len(fake.published) == 1
+    assert not r.sismember(PENDING_KEY, 'pub1')
+
+
+def test_held_target_is_published_once_its_lock_runs_out(r, media, drain):
+    fake = register(FakeAdapter())
+    # Another run died holding the target
+    r.set(engine._lock_key('pub1', 'x'), 1, ex=300)
+    publish(r, media, platforms=['x'])
+    drain()
+
+    assert fake.published == []
+    assert r.sismember(PENDING_KEY, 'pub1')
+    assert engine.publication_status('pub1', get_publication(r, 'pub1'))["state"] == PUBLISHING
+
+    r.delete(engine._lock_key('pub1', 'x'))
+    resume_pending(r)
+    drain()
+    drain()
+
+    assert len(fake.published) == 1
+    assert get_publication(r, 'pub1')["targets"]["x"]["state"] == DONE
+    assert not r.sismember(PENDING_KEY, 'pub1')
+
+
+def test_publication_running_here_is_not_started_twice(r, media, drain):
+    started = threading.Event()
+    release = threading.Event()
+
+    class SlowAdapter(FakeAdapter):
+        def publish(self, r, user_id, section, media, target):
+            started.set()
+            release.wait(5)
+            return super().publish(r, user_id, section, media, target)
+
+    slow = register(SlowAdapter())
+    publish(r, media, platforms=['x'])
+    started.wait(5)
+    engine.start(r, 'pub1')
+    release.set()
+    drain()
+
+    assert len(slow.published) == 1
+    assert 'pub1' not in engine._in_flight
+
+
+def test_idempotency_key_returns_the_first_publication(r, media, drain):
+    fake = register(FakeAdapter())
+
+    first = publish(r, media, platforms=['x'], key='k1', publication_id='pub1')
+    second = publish(r, media, platforms=['x'], key='k1', publication_id='pub2')
+    drain()
+
+    assert first == ('pub1', True)
+    assert second == ('pub1', False)
+    assert get_publication(r, 'pub2') is None
+    assert len(fake.published) == 1
+
+
+def test_idempotency_key_is_never_seen_without_its_publication(r, media, monkeypatch):
+    register(FakeAdapter())
+    # Keep the publications from running, so only their creation is raced
+    monkeypatch.setattr(engine, 'start', lambda r, publication_id: None)
+    seen = []
+    stop = threading.Event()
+
+    def watch():
+        while not stop.is_set():
+            publication_id = existing_publication(r, 'user1', 'k1')
+            if publication_id:
+                seen.append(get_publication(r, publication_id) is not None)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(
+            lambda n: publish(r, media, platforms=['x'], key='k1', publication_id=f'pub{n}'), range(32)
+        ))
+    stop.set()
+    watcher.join()
+
+    assert len({publication_id for publication_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+    assert all(seen)
+
+
+def test_shared_media_is_released_by_the_last_target(media):
+    done = []
+    shared = engine.SharedMedia(str(media), 'video/mp4', 2, lambda: done.append(True))
+
+    first, second = shared.open(), shared.open()
+    assert first.read(2) == b'vi'
+    assert second.read() == b'video'
+    shared.release()
+    assert done == []
+    shared.release()
+    assert done == [True]
+
@@ -0,0 +1,45 @@
+import uuid
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required
+from jwt_revocation import revoked_key
+
+import revocation
+from revocation import RevocationCheck
+
+
+@pytest.fixture
+def app(r, monkeypatch):
+    monkeypatch.setattr(revocation.redis.Redis, 'from_url', lambda url, **kwargs: r)
+    app = Flask(__name__)
+    app.config.update(
+        JWT_SECRET_KEY='test-secret-at-least-32-bytes-long', REVOCATION_REDIS_URL='redis://auth-redis/0', REVOCATION_TIMEOUT=0.5,
+        REVOCATION_RECHECK=0, REVOCATION_CACHE_SIZE=100,
+    )
+    RevocationCheck().init_app(app, JWTManager(app))
+
+    @app.route('/private')
+    @jwt_required()
+    def private():
+        return {'ok': True}
+
+    return app
+
+
+def token(app, sid):
+    with app.app_context():
+        return create_access_token('user1', additional_claims={'sid': sid})
+
+
+def test_token_of_a_revoked_session_is_rejected(app, r):
+    client = app.test_client()
+    sid = uuid.uuid4().hex
+    headers = {'Authorization': f'Bearer {token(app, sid)}'}
+    assert client.get('/private', headers=headers).status_code == 200
+
+    # As the auth service records a logout
+    r.set(revoked_key(sid), 1)
+
+    assert client.get('/private', headers=headers).status_code == 401
+    assert client.get('/private', headers={'Authorization': f'Bearer {token(app, "other")}'}).status_code == 200
@@ -0,0 +1,266 @@
+import threading
+import time
+
+import pytest
+
+from publish import scheduler
+from publish.scheduler import (
+    CANCELLED, DISPATCHED, DISPATCHING, DUE_KEY, FAILED, Dispatcher,
+    cancel_scheduled, dispatch, get_scheduled, schedule_post, scheduled_key
+)
+from publish.engine import idempotency_key
+
+KEY = 'test:due'
+
+
+def due(r, *members, at=None):
+    at = time.time() - 1 if at is None else at
+    r.zadd(KEY, {member: at for member in members})
+
+
+def test_claim_takes_due_members_in_batches_and_leases_them(r):
+    due(r, 'a', 'b', 'c')
+    r.zadd(KEY, {'later': time.time() + 3600})
+    dispatcher = Dispatcher(r, KEY, lambda member: None, batch_size=2, lease=60)
+
+    first, lease = dispatcher.claim()
+    second, _ = dispatcher.claim()
+
+    assert len(first) == 2 and len(second) == 1
+    assert set(first + second) == {'a', 'b', 'c'}
+    assert r.zscore(KEY, first[0]) == pytest.approx(lease)
+    assert dispatcher.claim()[0] == []
+
+
+def test_run_once_removes_handled_members(r):
+    handled = []
+    due(r, 'a', 'b')
+    dispatcher = Dispatcher(r, KEY, handled.append)
+
+    assert dispatcher.run_once() == 2
+    assert sorted(handled) == ['a', 'b']
+    assert r.zcard(KEY) == 0
+
+
+def test_expired_lease_is_claimed_again(r):
+    due(r, 'a')
+    dead = Dispatcher(r, KEY, None, lease=60)
+    members, _ = dead.claim()
+    assert members == ['a']
+    assert Dispatcher(r, KEY, None).claim()[0] == []
+
+    # Past the lease, another dispatcher takes over
+    members, _ = Dispatcher(r, KEY, None, lease=60).claim(now=time.time() + 61)
+    assert members == ['a']
+
+
+def test_stale_lease_does_not_release_a_reclaimed_member(r):
+    due(r, 'a')
+    first = Dispatcher(r, KEY, None, lease=60)
+    _, stale = first.claim()
+    _, current = Dispatcher(r, KEY, None, lease=120).claim(now=time.time() + 61)
+
+    first._release(keys=[KEY, f'{KEY}:attempts'], args=['a', stale, ''])
+
+    assert r.zscore(KEY, 'a') == pytest.approx(current)
+
+
+def test_failure_is_retried_with_backoff(r, monkeypatch):
+    monkeypatch.setattr(scheduler, 'backoff', lambda attempts: 30 * attempts)
+
+    def fail(member):
+        raise RuntimeError('down')
+
+    due(r, 'a')
+    dispatcher = Dispatcher(r, KEY, fail)
+    before = time.time()
+    dispatcher.run_once()
+
+    assert int(r.hget(f'{KEY}:attempts', 'a')) == 1
+    assert r.zscore(KEY, 'a') == pytest.approx(before + 30, abs=1)
+    assert dispatcher.run_once() == 0
+
+
+def test_backoff_grows_and_is_capped():
+    assert 24 <= scheduler.backoff(1) <= 36
+    assert 48 <= scheduler.backoff(2) <= 72
+    assert scheduler.backoff(20) <= 1800 * 1.2
+
+
+def test_gives_up_after_max_attempts(r, monkeypatch):
+    monkeypatch.setattr(scheduler, 'backoff', lambda attempts: -10)
+    calls = []
+    given_up = []
+
+    def fail(member):
+        calls.append(member)
+        raise RuntimeError('down')
+
+    due(r, 'a')
+    dispatcher = Dispatcher(r, KEY, fail, on_give_up=lambda m, e: given_up.append((m, str(e))), max_attempts=3)
+    while dispatcher.run_once():
+        pass
+
+    assert len(calls) == 3
+    assert given_up == [('a', 'down')]
+    assert r.zcard(KEY) == 0
+    assert not r.hexists(f'{KEY}:attempts', 'a')
+
+
+def test_success_after_failure_clears_attempts(r, monkeypatch):
+    monkeypatch.setattr(scheduler, 'backoff', lambda attempts: -10)
+    outcomes = [RuntimeError('down'), None]
+
+    def flaky(member):
+        error = outcomes.pop(0)
+        if error:
+            raise error
+
+    due(r, 'a')
+    dispatcher = Dispatcher(r, KEY, flaky)
+    dispatcher.run_once()
+    dispatcher.run_once()
+
+    assert r.zcard(KEY) == 0
+    assert not r.hexists(f'{KEY}:attempts', 'a')
+
+
+def test_parallel_dispatchers_handle_each_member_once(r):
+    members = [f'post-{i}' for i in range(500)]
+    due(r, *members)
+    handled = []
+    lock = threading.Lock()
+
+    def handle(member):
+        with lock:
+            handled.append(member)
+
+    def drain():
+        dispatcher = Dispatcher(r, KEY, handle, batch_size=20, workers=2)
+        while dispatcher.run_once():
+            pass
+
+    threads = [threading.Thread(target=drain) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(handled) == sorted(members)
+
+
+@pytest.fixture
+def scheduled(r, tmp_path):
+    media = tmp_path / 'video.mp4'
+    media.write_bytes(b'video')
+    schedule_post(
+        r, 'post1', 'user1', {'youtube': {'title': 't'}}, str(media), 'video/mp4',
+        ['youtube'], {'privacy_status': None}, time.time() - 1
+    )
+    return media
+
+
+@pytest.fixture
+def publications(monkeypatch):
+    """Records create_publication calls; each idempotency key gets one id."""
+    calls = []
+    ids = {}
+
+    def create(r, publication_id, user_id, post, media_path, mime_type, platforms, options, key=None):
+        calls.append(key)
+        ids.setdefault(key, publication_id)
+        return ids[key], ids[key] == publication_id
+
+    monkeypatch.setattr(scheduler, 'create_publication', create)
+    return calls
+
+
+def test_dispatch_starts_the_publication(r, scheduled, publications):
+    dispatch(r, 'post1')
+
+    post = get_scheduled(r, 'post1')
+    assert post['state'] == DISPATCHED
+    assert post['publication_id']
+    assert publications == ['scheduled:post1']
+
+
+def test_repeated_dispatch_does_not_publish_twice(r, scheduled, publications):
+    dispatch(r, 'post1')
+    dispatch(r, 'post1')
+
+    assert publications == ['scheduled:post1']
+
+
+def test_dispatch_retried_after_a_failure_reuses_the_publication(r, scheduled, publications, monkeypatch):
+    create = scheduler.create_publication
+    ids = []
+
+    def fail_after_creating(*args, **kwargs):
+        ids.append(create(*args, **kwargs)[0])
+        raise RuntimeError('lost the connection')
+
+    monkeypatch.setattr(scheduler, 'create_publication', fail_after_creating)
+    with pytest.raises(RuntimeError):
+        dispatch(r, 'post1')
+    assert get_scheduled(r, 'post1')['state'] == DISPATCHING
+
+    monkeypatch.setattr(scheduler, 'create_publication', create)
+    dispatch(r, 'post1')
+
+    assert get_scheduled(r, 'post1')['publication_id'] == ids[0]
+
+
+def test_cancel_drops_the_post_and_its_media(r, scheduled, publications):
+    assert cancel_scheduled(r, 'post1', get_scheduled(r, 'post1'))
+
+    assert get_scheduled(r, 'post1')['state'] == CANCELLED
+    assert not scheduled.exists()
+    assert r.zscore(DUE_KEY, 'post1') is None
+    dispatch(r, 'post1')
+    assert publications == []
+
+
+def test_cancel_during_dispatch_loses(r, scheduled, monkeypatch):
+    results = []
+
+    def create(r, publication_id, user_id, post, media_path, mime_type, platforms, options, key=None):
+        # A DELETE arriving while the publication starts
+        results.append(cancel_scheduled(r, 'post1', get_scheduled(r, 'post1')))
+        return publication_id, True
+
+    monkeypatch.setattr(scheduler, 'create_publication', create)
+    dispatch(r, 'post1')
+
+    assert results == [False]
+    assert scheduled.exists()
+    assert get_scheduled(r, 'post1')['state'] == DISPATCHED
+
+
+def test_cancel_before_dispatch_claims_wins(r, scheduled, publications, monkeypatch):
+    start_dispatch = scheduler._start_dispatch
+
+    def cancelled_first(r, scheduled_id):
+        cancel_scheduled(r, scheduled_id, get_scheduled(r, scheduled_id))
+        return start_dispatch(r, scheduled_id)
+
+    monkeypatch.setattr(scheduler, '_start_dispatch', cancelled_first)
+    dispatch(r, 'post1')
+
+    assert publications == []
+    assert get_scheduled(r, 'post1')['state'] == CANCELLED
+
+
+def test_give_up_marks_the_post_failed(r, scheduled):
+    scheduler._give_up(r, 'post1', RuntimeError('down'))
+
+    post = get_scheduled(r, 'post1')
+    assert post['state'] == FAILED and post['error'] == 'down'
+    assert not scheduled.exists()
+
+
+def test_give_up_keeps_media_a_publication_was_started_with(r, scheduled):
+    r.set(idempotency_key('user1', scheduled_key('post1')), 'publication1')
+
+    scheduler._give_up(r, 'post1', RuntimeError('down'))
+
+    assert scheduled.exists()
@@ -0,0 +1,162 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import redis
+from google.auth.exceptions import RefreshError, TransportError
+from google.oauth2.credentials import Credentials
+
+from youtube import tokens
+from youtube.tokens import MAX_FAILURES, SCHEDULE_KEY, refresh_token
+from youtube.utils import pack_credentials, token_error_key, unpack_credentials
+
+LOCK_KEY = 'oauth:refresh:user1:lock'
+
+
+def link(r, **fields):
+    info = {
+        "token": "old-token",
+        "refresh_token": "refresh",
+        "client_id": "client",
+        "client_secret": "secret",
+        "token_uri": "https://oauth2.example/token",
+        "expiry": "2026-01-01T00:00:00Z",
+    }
+    info.update(fields)
+    r.set('user1', json.dumps(info))
+    r.zadd(SCHEDULE_KEY, {'user1': time.time() - 1})
+
+
+def stored_error(r):
+    return json.loads(r.get(token_error_key('user1')))
+
+
+@pytest.fixture
+def refresh(monkeypatch):
+    """Makes Credentials.refresh do what the test sets, instead of calling Google."""
+    outcome = {}
+
+    def fake_refresh(self, request):
+        if 'error' in outcome:
+            raise outcome['error']
+        self.token = 'new-token'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, 'refresh', fake_refresh)
+    return outcome
+
+
+def test_refresh_stores_the_new_token_and_reschedules(r, refresh):
+    link(r)
+    r.set(token_error_key('user1'), json.dumps({"error": "earlier", "failures": 1}))
+
+    refresh_token(r, 'user1')
+
+    assert unpack_credentials(r.get('user1'))["token"] == 'new-token'
+    assert not r.exists(token_error_key('user1'))
+    assert r.zscore(SCHEDULE_KEY, 'user1') > time.time() + 3600 - tokens.REFRESH_AHEAD - tokens.REFRESH_JITTER - 5
+    assert not r.exists(LOCK_KEY)
+
+
+def test_relinked_credentials_are_not_overwritten(r, refresh, monkeypatch):
+    link(r)
+    relinked = pack_credentials(json.dumps({"token": "relinked", "refresh_token": "other"}))
+
+    def relink_during_refresh(self, request):
+        r.set('user1', relinked)
+        self.token = 'new-token'
+
+    monkeypatch.setattr(Credentials, 'refresh', relink_during_refresh)
+    refresh_token(r, 'user1')
+
+    assert r.get('user1') == relinked.encode()
+
+
+def test_revoked_grant_needs_relinking(r, refresh):
+    link(r)
+    refresh['error'] = RefreshError('invalid_grant: Token has been revoked')
+
+    refresh_token(r, 'user1')
+
+    error = stored_error(r)
+    assert error["error"] == 'invalid_grant: Token has been revoked'
+    assert error["retrying"] is False
+    assert r.zscore(SCHEDULE_KEY, 'user1') is None
+
+
+def test_network_errors_back_off_then_give_up(r, refresh):
+    link(r)
+    refresh['error'] = TransportError('connection reset')
+
+    refresh_token(r, 'user1')
+    error = stored_error(r)
+    assert error["failures"] == 1 and error["retrying"] is True
+    assert r.zscore(SCHEDULE_KEY, 'user1') == pytest.approx(time.time() + 120, abs=2)
+
+    for _ in range(MAX_FAILURES - 1):
+        refresh_token(r, 'user1')
+    error = stored_error(r)
+    assert error["failures"] == MAX_FAILURES and error["retrying"] is False
+    assert r.zscore(SCHEDULE_KEY, 'user1') is None
+
+
+def test_unreadable_credentials_back_off_instead_of_retrying_every_poll(r, refresh):
+    r.set('user1', 'not json')
+    r.zadd(SCHEDULE_KEY, {'user1': time.time() - 1})
+
+    refresh_token(r, 'user1')
+
+    assert stored_error(r)["retrying"] is True
+    assert r.zscore(SCHEDULE_KEY, 'user1') > time.time() + 60
+    assert not r.exists(LOCK_KEY)
+
+
+def test_unreadable_stored_error_counts_as_the_first_failure(r, refresh):
+    link(r)
+    r.set(token_error_key('user1'), '{broken')
+    refresh['error'] = TransportError('connection reset')
+
+    refresh_token(r, 'user1')
+
+    assert stored_error(r)["failures"] == 1
+
+
+def test_redis_error_while_recording_leaves_the_user_due(r, refresh, monkeypatch):
+    link(r)
+    refresh['error'] = TransportError('connection reset')
+
+    def redis_down(*args, **kwargs):
+        raise redis.ConnectionError('gone')
+
+    monkeypatch.setattr(tokens, '_record_failure', redis_down)
+    refresh_token(r, 'user1')
+
+    assert r.zscore(SCHEDULE_KEY, 'user1') < time.time()
+    assert not r.exists(LOCK_KEY)
+
+
+def test_missing_refresh_token_needs_relinking(r, refresh):
+    link(r, refresh_token=None)
+
+    refresh_token(r, 'user1')
+
+    assert stored_error(r)["retrying"] is False
+    assert r.zscore(SCHEDULE_KEY, 'user1') is None
+
+
+def test_unlinked_user_is_unscheduled(r, refresh):
+    r.zadd(SCHEDULE_KEY, {'user1': time.time() - 1})
+
+    refresh_token(r, 'user1')
+
+    assert r.zscore(SCHEDULE_KEY, 'user1') is None
+
+
+def test_refresh_held_elsewhere_is_skipped(r, refresh):
+    link(r)
+    r.set(LOCK_KEY, 1)
+
+    refresh_token(r, 'user1')
+
+    assert unpack_credentials(r.get('user1'))["token"] == 'old-token'
@@ -0,0 +1,231 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import redis
+
+from youtube import uploads
+from youtube.uploads import (
+    DONE, FAILED, PENDING_KEY, QUEUED, UPLOADING, LockLost, create_job, get_job, lock_key,
+    resume_from, resume_pending, run_job, send_chunks
+)
+from youtube.videos import index_meta_key
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Stands in for the YouTube upload; records the jobs it was asked for."""
+    calls = []
+
+    def upload(r, job_id, job, owner):
+        calls.append(job_id)
+        return {'id': 'video1'}
+
+    monkeypatch.setattr(uploads, '_upload', upload)
+    return calls
+
+
+@pytest.fixture
+def drain(monkeypatch):
+    """One upload worker; calling the result waits for what it has queued."""
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(uploads, 'executor', executor)
+    yield lambda: executor.submit(lambda: None).result()
+    executor.shutdown()
+
+
+@pytest.fixture
+def job(r, tmp_path, monkeypatch):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'video')
+    # Queue it without starting it
+    with monkeypatch.context() as m:
+        m.setattr(uploads, 'submit', lambda r, job_id: None)
+        create_job(r, 'job1', 'user1', str(video), 'title', 'description', 'private')
+    return video
+
+
+def test_run_job_uploads_and_finishes(r, job, runs):
+    run_job(r, 'job1')
+
+    finished = get_job(r, 'job1')
+    assert finished['state'] == DONE
+    assert finished['video_id'] == 'video1'
+    assert not r.sismember(PENDING_KEY, 'job1')
+    assert not r.exists(lock_key('job1'))
+    assert not job.exists()
+
+
+def test_failed_upload_marks_the_job_failed(r, job, monkeypatch):
+    def upload(r, job_id, job, owner):
+        raise RuntimeError('quota exceeded')
+
+    monkeypatch.setattr(uploads, '_upload', upload)
+    run_job(r, 'job1')
+
+    failed = get_job(r, 'job1')
+    assert failed['state'] == FAILED and failed['error'] == 'quota exceeded'
+    assert not r.sismember(PENDING_KEY, 'job1')
+
+
+@pytest.mark.parametrize('error', [OSError('connection reset'), redis.ConnectionError('gone')])
+def test_retryable_failure_leaves_the_job_for_the_resumer(r, job, monkeypatch, error):
+    def upload(r, job_id, job, owner):
+        raise error
+
+    monkeypatch.setattr(uploads, '_upload', upload)
+    run_job(r, 'job1')
+
+    pending = get_job(r, 'job1')
+    assert pending['state'] == QUEUED and pending['error'] == str(error)
+    assert r.sismember(PENDING_KEY, 'job1')
+    assert job.exists()
+    assert not r.exists(lock_key('job1'))
+
+
+def test_finished_upload_refreshes_the_video_index(r, job, runs):
+    r.hset(index_meta_key('user1'), mapping={'refreshed_at': 1, 'expires_at': 2})
+
+    run_job(r, 'job1')
+
+    assert r.hkeys(index_meta_key('user1')) == [b'expires_at']
+
+
+def test_held_job_is_left_pending(r, job, runs):
+    r.set(lock_key('job1'), 'other', ex=300)
+
+    run_job(r, 'job1')
+
+    assert runs == []
+    assert get_job(r, 'job1')['state'] == QUEUED
+    assert r.sismember(PENDING_KEY, 'job1')
+
+
+def test_job_left_by_a_dead_worker_resumes_once_its_lock_expires(r, job, runs, drain):
+    # A worker died mid-upload; its lock outlives it
+    uploads._update(r, 'job1', state=UPLOADING)
+    r.set(lock_key('job1'), 'dead', ex=300)
+    resume_pending(r)
+    drain()
+    assert runs == []
+
+    r.delete(lock_key('job1'))
+    resume_pending(r)
+    drain()
+
+    assert runs == ['job1']
+    assert get_job(r, 'job1')['state'] == DONE
+
+
+def test_run_does_not_release_a_lock_it_no_longer_holds(r, job, monkeypatch):
+    def upload(r, job_id, job, owner):
+        # Our lock ran out and another run took the job
+        r.set(lock_key(job_id), 'later', ex=300)
+        return {'id': 'video1'}
+
+    monkeypatch.setattr(uploads, '_upload', upload)
+    run_job(r, 'job1')
+
+    assert r.get(lock_key('job1')) == b'later'
+
+
+def test_run_stops_once_another_run_takes_its_lock(r, job, monkeypatch):
+    def upload(r, job_id, job, owner):
+        uploads._renew(r, job_id, owner)
+        r.set(lock_key(job_id), 'later', ex=60)
+        # The next chunk's renewal finds the lock gone
+        uploads._renew(r, job_id, owner)
+
+    monkeypatch.setattr(uploads, '_upload', upload)
+    run_job(r, 'job1')
+
+    assert r.get(lock_key('job1')) == b'later'
+    assert r.ttl(lock_key('job1')) <= 60
+    assert get_job(r, 'job1')['state'] == QUEUED
+    assert job.exists()
+
+
+def test_renew_extends_only_its_own_lock(r):
+    r.set(lock_key('job1'), 'mine', ex=10)
+    uploads._renew(r, 'job1', 'mine')
+    assert r.ttl(lock_key('job1')) > 10
+
+    with pytest.raises(LockLost):
+        uploads._renew(r, 'job1', 'other')
+
+
+def test_submit_queues_a_job_once_per_process(r, drain, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def run(r, job_id):
+        calls.append(job_id)
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setattr(uploads, 'run_job', run)
+    uploads.submit(r, 'job1')
+    started.wait(5)
+    uploads.submit(r, 'job1')
+    release.set()
+    drain()
+
+    assert calls == ['job1']
+    assert 'job1' not in uploads._in_flight
+
+
+class FakeInsert:
+    """A resumable insert whose chunks fail or succeed as listed."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.resumable_uri = 'https://upload.example/session'
+        self.resumable_progress = 0
+
+    def next_chunk(self, num_retries=0):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        self.resumable_progress += 1
+        return None, outcome
+
+
+def test_send_chunks_retries_failed_chunks(monkeypatch):
+    monkeypatch.setattr(uploads.time, 'sleep', lambda seconds: None)
+    insert = FakeInsert([None, OSError('reset'), None, {'id': 'video1'}])
+    saved = []
+
+    assert send_chunks(insert, lambda request: saved.append(request.resumable_progress)) == {'id': 'video1'}
+    assert saved == [1, 2, 3]
+
+
+def test_send_chunks_gives_up_after_max_failures(monkeypatch):
+    monkeypatch.setattr(uploads.time, 'sleep', lambda seconds: None)
+    insert = FakeInsert([OSError('reset')] * uploads.MAX_FAILURES)
+
+    with pytest.raises(OSError):
+        send_chunks(insert, lambda request: None)
+
+
+def test_send_chunks_does_not_retry_client_errors():
+    insert = FakeInsert([ValueError('bad request'), {'id': 'video1'}])
+
+    with pytest.raises(ValueError):
+        send_chunks(insert, lambda request: None)
+
+
+def test_resume_from_points_a_real_insert_at_the_session(tmp_path):
+    from googleapiclient.http import HttpRequest, MediaFileUpload
+
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'video')
+    media = MediaFileUpload(str(video), resumable=True)
+    request = HttpRequest(None, None, 'https://upload.example/insert', resumable=media)
+    # Fails if googleapiclient drops the private flag resume_from relies on
+    assert request._in_error_state is False
+
+    resume_from(request, 'https://upload.example/session')
+
+    assert request.resumable_uri == 'https://upload.example/session'
+    assert request._in_error_state is True
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+from youtube import videos
+from youtube.videos import INDEX_MAX_AGE, InvalidPageToken, list_videos, video_index_keys
+
+
+def upload(n):
+    return {"id": f"item{n}", "snippet": {"title": f"video {n}", "publishedAt": f"2024-01-01T00:00:{n:02d}Z"}}
+
+
+class FakeYouTube:
+    """A channel's uploads playlist, newest first, served page by page."""
+
+    def __init__(self, count, page_size=3):
+        self.uploads = [upload(n) for n in reversed(range(count))]
+        self.page_size = page_size
+        self.calls = 0
+
+    def playlistItems(self):
+        return self
+
+    def list(self, pageToken=None, **kwargs):
+        start = int(pageToken or 0)
+        page = self.uploads[start:start + self.page_size]
+        response = {"items": page, "pageInfo": {"totalResults": len(self.uploads)}}
+        if start + self.page_size < len(self.uploads):
+            response["nextPageToken"] = str(start + self.page_size)
+        return FakeRequest(self, response)
+
+    def add(self, n):
+        self.uploads.insert(0, upload(n))
+
+
+class FakeRequest:
+    def __init__(self, youtube, response):
+        self.youtube = youtube
+        self.response = response
+
+    def execute(self):
+        self.youtube.calls += 1
+        return self.response
+
+
+def ids(page):
+    return [item["id"] for item in page["items"]]
+
+
+def test_pages_are_served_newest_first_and_backfilled_on_demand(r):
+    youtube = FakeYouTube(8)
+
+    first = list_videos(r, 'user1', youtube, 'uploads', max_results=3)
+    assert ids(first) == ['item7', 'item6', 'item5']
+    assert youtube.calls == 1
+
+    second = list_videos(r, 'user1', youtube, 'uploads', page_token=first["nextPageToken"], max_results=4)
+    assert ids(second) == ['item4', 'item3', 'item2', 'item1']
+    assert youtube.calls == 3
+    assert second["pageInfo"]["totalResults"] == 8
+
+
+def test_new_uploads_are_picked_up_on_refresh(r, monkeypatch):
+    youtube = FakeYouTube(4)
+    list_videos(r, 'user1', youtube, 'uploads', max_results=2)
+    youtube.add(4)
+
+    monkeypatch.setattr(videos, 'INDEX_REFRESH', -1)
+    page = list_videos(r, 'user1', youtube, 'uploads', max_results=2)
+
+    assert ids(page) == ['item4', 'item3']
+
+
+def test_unknown_page_token_is_rejected(r):
+    with pytest.raises(InvalidPageToken):
+        list_videos(r, 'user1', FakeYouTube(2), 'uploads', page_token='nope')
+
+
+def test_fields_limit_the_snippet(r):
+    page = list_videos(r, 'user1', FakeYouTube(1), 'uploads', fields=['title'])
+
+    assert page["items"] == [{"id": "item0", "snippet": {"title": "video 0"}}]
+
+
+def test_index_keys_recreated_by_a_write_still_expire(r, monkeypatch):
+    youtube = FakeYouTube(5)
+    list_videos(r, 'user1', youtube, 'uploads', max_results=3)
+    items_key, order_key, meta_key = video_index_keys('user1')
+    # Evicted on their own, as a volatile-* maxmemory policy may do
+    r.delete(items_key, order_key)
+
+    youtube.add(5)
+    monkeypatch.setattr(videos, 'INDEX_REFRESH', -1)
+    list_videos(r, 'user1', youtube, 'uploads', max_results=1)
+    assert r.exists(items_key) and r.exists(order_key)
+
+    ttls = [r.ttl(key) for key in (items_key, order_key, meta_key)]
+    assert all(0 < ttl <= INDEX_MAX_AGE for ttl in ttls)
+
+
+def test_backfilled_pages_expire_with_the_index(r):
+    youtube = FakeYouTube(6)
+    first = list_videos(r, 'user1', youtube, 'uploads', max_results=3)
+    items_key, order_key, _ = video_index_keys('user1')
+    r.persist(items_key)
+    r.persist(order_key)
+
+    list_videos(r, 'user1', youtube, 'uploads', page_token=first["nextPageToken"], max_results=3)
+
+    assert r.zcard(order_key) == 6
+    assert 0 < r.ttl(items_key) <= INDEX_MAX_AGE
+    assert 0 < r.ttl(order_key) <= INDEX_MAX_AGE
+
+
+def test_writes_keep_the_index_deadline(r, monkeypatch):
+    youtube = FakeYouTube(2)
+    list_videos(r, 'user1', youtube, 'uploads')
+    _, _, meta_key = video_index_keys('user1')
+    expires_at = float(r.hget(meta_key, 'expires_at'))
+    assert expires_at == pytest.approx(time.time() + INDEX_MAX_AGE, abs=5)
+
+    youtube.add(2)
+    monkeypatch.setattr(videos, 'INDEX_REFRESH', -1)
+    monkeypatch.setattr(videos.time, 'time', lambda: expires_at - 60)
+    list_videos(r, 'user1', youtube, 'uploads')
+    monkeypatch.undo()
+
+    assert float(r.hget(meta_key, 'expires_at')) == expires_at
+    assert r.ttl(meta_key) <= INDEX_MAX_AGE
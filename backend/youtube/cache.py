@@ -1,17 +1,154 @@
-"""Basic connection example.
+"""Redis for the backend: one tuned connection pool, pipelines and an optional L1.
+
+Every command and pipeline is timed in the upstream metrics. With
+CACHE_L1_TTL set, hot keys such as stored credentials are also kept in
+process for that many seconds; writers call l1.invalidate, which drops
+the keys here and tells the other processes over pub/sub.
 """
 
+import os
+import threading
+import time
+from collections import OrderedDict
+
 import redis
+from redis.client import Pipeline
+
+from config import flag
+from metrics import upstream_timer
+
+
+class TimedPipeline(Pipeline):
+    """A pipeline is one round trip, timed as a single 'pipeline' operation."""
+
+    def execute(self, raise_on_error=True):
+        with upstream_timer('redis', 'pipeline'):
+            return super().execute(raise_on_error)
 
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
+class TimedRedis(redis.Redis):
+    """Records the duration of every command in the upstream metrics."""
 
-r = redis.Redis(
-    host=os.getenv('CACHE_HOST'),
-    port=os.getenv('CACHE_PORT'),
-    decode_responses=os.getenv('CACHE_DECODE_RESPONSES'),
+    def execute_command(self, *args, **options):
+        with upstream_timer('redis', str(args[0]).lower()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+pool = redis.BlockingConnectionPool(
+    host=os.getenv('CACHE_HOST') or 'localhost',
+    port=int(os.getenv('CACHE_PORT') or 6379),
     username=os.getenv('CACHE_USERNAME'),
     password=os.getenv('CACHE_PASSWORD'),
+    decode_responses=flag('CACHE_DECODE_RESPONSES'),
+    # Request threads and upload workers share these; past the limit a
+    # caller waits up to CACHE_POOL_TIMEOUT for one to free up
+    max_connections=int(os.getenv('CACHE_MAX_CONNECTIONS', 50)),
+    timeout=float(os.getenv('CACHE_POOL_TIMEOUT', 5)),
+    socket_timeout=float(os.getenv('CACHE_SOCKET_TIMEOUT', 2)),
+    socket_connect_timeout=float(os.getenv('CACHE_CONNECT_TIMEOUT', 2)),
+    socket_keepalive=True,
+    # Idle connections are pinged before reuse, so a restarted Redis
+    # doesn't fail the first request on each of them
+    health_check_interval=int(os.getenv('CACHE_HEALTH_CHECK_INTERVAL', 30)),
+)
+
+r = TimedRedis(connection_pool=pool)
+
+
+class LocalCache:
+    """Short-lived in-process copies of Redis values.
+
+    Reads go through get_many, which fetches misses with one MGET. Entries
+    live for ttl seconds at most; l1.invalidate drops keys here at once and
+    in other processes as soon as they get the message on
+    INVALIDATION_CHANNEL. A subscriber that loses its connection empties
+    its cache, since it may have missed messages. A ttl of 0 turns the
+    cache off and every read goes to Redis.
+    """
+
+    INVALIDATION_CHANNEL = 'cache:invalidate'
+
+    def __init__(self, r, ttl, max_size):
+        self.r = r
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._subscriber = None
+
+    def _subscribe(self):
+        with self._lock:
+            if self._subscriber is not None:
+                return
+            self._subscriber = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+            self._subscriber.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.INVALIDATION_CHANNEL)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        data = message['data']
+                        self._drop((data.decode('utf-8') if isinstance(data, bytes) else data).split('\n'))
+            except redis.RedisError:
+                self.clear()
+                time.sleep(1)
+
+    def _drop(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_many(self, *keys):
+        """Values for keys, in order, None for missing ones."""
+        if not self.ttl:
+            return self.r.mget(keys)
+        self._subscribe()
+
+        now = time.monotonic()
+        values = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    values[key] = entry[0]
+
+        missing = [key for key in keys if key not in values]
+        if missing:
+            fetched = dict(zip(missing, self.r.mget(missing)))
+            values.update(fetched)
+            with self._lock:
+                for key, value in fetched.items():
+                    self._entries[key] = (value, now + self.ttl)
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return [values[key] for key in keys]
+
+    def get(self, key):
+        return self.get_many(key)[0]
+
+    def invalidate(self, *keys):
+        """Call after writing keys, so no process keeps serving the old values."""
+        if not self.ttl or not keys:
+            return
+        self._drop(keys)
+        self.r.publish(self.INVALIDATION_CHANNEL, '\n'.join(keys))
+
+
+l1 = LocalCache(
+    r,
+    float(os.getenv('CACHE_L1_TTL', 0)),
+    int(os.getenv('CACHE_L1_SIZE', 10000)),
 )
@@ -1,35 +1,36 @@
 from flask import redirect, url_for, session, request, Blueprint, jsonify
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import functools
 import os
-from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
 
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from werkzeug.formparser import parse_form_data
 import secrets
-import json
 
-from .cache import r
+from .cache import l1, r
+from .utils import (
+    CLIENT_SECRETS_FILE, SCOPES, channel_keys, clients, forget_user, pack_credentials,
+    token_error_key, uploads_playlist_id, uploads_playlist_key
+)
+from .tokens import schedule, token_status
+from .uploads import QUEUED, create_job, get_job, job_status, new_job_id, stream_factory
+from .videos import DEFAULT_RESULTS, MAX_RESULTS, InvalidPageToken, list_videos
+from metrics import upstream_timer
 
 youtube_routes = Blueprint('youtube_routes', __name__)
 
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"  # For local testing only
 
-# Load client secrets file
-CLIENT_SECRETS_FILE = "client_secret.json"
-
-# Define OAuth scopes
-SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
 
-load_dotenv()
+@functools.lru_cache(maxsize=None)
+def get_flow():
+    """The OAuth flow, built on first use; it pulls in the google-auth stack."""
+    from google_auth_oauthlib.flow import Flow
 
-# Initialize Flow
-flow = Flow.from_client_secrets_file(
-    CLIENT_SECRETS_FILE,
-    scopes=SCOPES,
-    redirect_uri="http://localhost:8080/api/v2/bd/youtube/callback"  # Make sure this matches in your client_secret.json
-)
+    return Flow.from_client_secrets_file(
+        CLIENT_SECRETS_FILE,
+        scopes=SCOPES,
+        redirect_uri="http://localhost:8080/api/v2/bd/youtube/callback"  # Make sure this matches in your client_secret.json
+    )
 
 @youtube_routes.route("/auth", methods=["GET"])
 @jwt_required()
@@ -37,7 +38,7 @@ def auth():
     user_id = get_jwt_identity()
 
     # check if the user ia already linked: 
-    if r.get(user_id):
+    if l1.get(user_id):
         # return redirect("http://localhost:5173?status=already_linked")
         return jsonify({"status": "already_linked"})
     
@@ -46,7 +47,7 @@ def auth():
     # Store state and user_id in Redis
     r.set(state, user_id, ex=300)  # Expire after 5 minutes
 
-    authorization_url, _ = flow.authorization_url(
+    authorization_url, _ = get_flow().authorization_url(
         access_type="offline", include_granted_scopes="true", state=state, prompt="consent"
     )
     return jsonify({"auth_url": authorization_url})
@@ -58,7 +59,8 @@ def callback():
     if not state:
         return jsonify({"error": "Missing state parameter"}), 400
 
-    user_id = r.get(state)
+    # States are single use
+    user_id = r.getdel(state)
     if not user_id:
         return jsonify({"error": "Invalid or expired state token"}), 400
 
@@ -67,11 +69,18 @@ def callback():
         user_id = user_id.decode("utf-8")
 
     try:
-        flow.fetch_token(authorization_response=request.url)
-        credentials = flow.credentials
-
-        # Save credentials in Redis
-        r.set(user_id, credentials.to_json())
+        with upstream_timer('youtube', 'oauth.fetch_token'):
+            get_flow().fetch_token(authorization_response=request.url)
+        credentials = get_flow().credentials
+
+        # Save credentials in Redis; a relinked account may be a different channel
+        stored_credentials = pack_credentials(credentials.to_json())
+        pipe = r.pipeline(transaction=False)
+        pipe.set(user_id, stored_credentials)
+        pipe.delete(*channel_keys(user_id))
+        pipe.execute()
+        l1.invalidate(user_id, *channel_keys(user_id))
+        schedule(r, user_id, stored_credentials)
 
         # Save credentials in session (optional)
         session["credentials"] = {
@@ -97,7 +106,7 @@ def logout():
     session.clear()
     # remove credentials from cache
     user_id = get_jwt_identity()
-    r.delete(user_id)
+    forget_user(r, user_id)
     return jsonify({"msg": "Logged out successfully!"})
 
 
@@ -105,43 +114,54 @@ def logout():
 @jwt_required()
 def status():
     user_id = get_jwt_identity()
-    if r.get(user_id):
-        return jsonify({"linked": True})
+    stored_credentials, token_error = l1.get_many(user_id, token_error_key(user_id))
+    if stored_credentials:
+        # Refresh failures show up here rather than on the next upload
+        return jsonify({"linked": True, "token": token_status(token_error)})
     return jsonify({"linked": False})
 
 
 @youtube_routes.route("/videos", methods=["GET"])
 @jwt_required()
 def get_videos():
-    """Retrieve the user's uploaded videos."""
+    """Retrieve a page of the user's uploaded videos, newest first.
+
+    Query parameters: pageToken from the previous page, maxResults (up to
+    50) and fields, a comma separated list of snippet fields to return.
+    """
     user_id = get_jwt_identity()
-    stored_credentials = r.get(user_id)
+    stored_credentials, playlist_id = l1.get_many(user_id, uploads_playlist_key(user_id))
 
     if not stored_credentials:
         return jsonify({"error": "User not linked"}), 400
-    
+
     try:
-        stored_credentials = json.loads(stored_credentials)  # Convert JSON string to dict
-        credentials = Credentials.from_authorized_user_info(stored_credentials)
+        max_results = min(max(int(request.args.get("maxResults", DEFAULT_RESULTS)), 1), MAX_RESULTS)
+    except ValueError:
+        return jsonify({"error": "maxResults must be a number"}), 400
+    fields = [field for field in request.args.get("fields", "").split(",") if field]
+
+    try:
+        client = clients.get(user_id, stored_credentials)
     except Exception as e:
         return jsonify({"error": "Invalid credentials format", "details": str(e)}), 500
-
-    youtube = build("youtube", "v3", credentials=credentials)
-
-    # Get the user's channel details
-    channel_request = youtube.channels().list(part="contentDetails", mine=True)
-    channel_response = channel_request.execute()
-    uploads_playlist_id = channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
-
-    # Get videos from the user's uploads playlist
-    playlist_request = youtube.playlistItems().list(
-        part="snippet",
-        playlistId=uploads_playlist_id,
-        maxResults=10
-    )
-    playlist_response = playlist_request.execute()
-
-    # print(playlist_response)
+    if not client.scheduled:
+        # Accounts linked before the refresher ran get enrolled here
+        schedule(r, user_id, stored_credentials, replace=False)
+        client.scheduled = True
+
+    with client.lock:
+        youtube = client.youtube
+        playlist_id = uploads_playlist_id(r, user_id, youtube, playlist_id)
+        try:
+            playlist_response = list_videos(
+                r, user_id, youtube, playlist_id,
+                page_token=request.args.get("pageToken"),
+                max_results=max_results,
+                fields=fields
+            )
+        except InvalidPageToken:
+            return jsonify({"error": "Invalid pageToken"}), 400
 
     return jsonify(playlist_response)
 
@@ -149,66 +169,41 @@ def get_videos():
 @youtube_routes.route("/upload", methods=["POST"])
 @jwt_required()
 def upload_video():
-    """Upload a video to the user's YouTube channel."""
+    """Accept a video for upload to the user's YouTube channel.
+
+    The file is written straight to disk and uploaded by a background
+    worker; poll /upload/<job_id> for progress.
+    """
     user_id = get_jwt_identity()
-    stored_credentials = r.get(user_id)
 
-    if not stored_credentials:
+    if not l1.get(user_id):
         return jsonify({"error": "User not linked"}), 400
 
-    try:
-        stored_credentials = json.loads(stored_credentials)  # Convert JSON string to dict
-        credentials = Credentials.from_authorized_user_info(stored_credentials)
-    except Exception as e:
-        return jsonify({"error": "Invalid credentials format", "details": str(e)}), 500
-
-    youtube = build("youtube", "v3", credentials=credentials)
-
-    # Get the user's channel details
-    channel_request = youtube.channels().list(part="contentDetails", mine=True)
-    channel_response = channel_request.execute()
-    uploads_playlist_id = channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+    job_id = new_job_id()
+    saved = {}
+    _, form, files = parse_form_data(request.environ, stream_factory=stream_factory(job_id, saved))
+    for file in files.values():
+        file.close()
 
-    # print(uploads_playlist_id)
-
-    # print(request.json)
-    video = request.files["file"]
-
-    file_path = os.path.join('/tmp', video.filename)
-    video.save(file_path)
-
-    # Upload video
-    # request_data = request.get_json()
-    # video_title = request_data.get("title")
-    # video_description = request_data.get("description")
-    # privacy_status = request_data.get("privacyStatus")
-    # # video_path = request_data.get("file")
-    video_title = request.form.get("title")
-    video_description = request.form.get("description")
-    privacy_status = request.form.get("privacyStatus")
-
-    print(video_title, "\n", video_description, "\n", privacy_status)
-    print(file_path)
+    file_path = saved.get("path")
+    video_title = form.get("title")
+    video_description = form.get("description")
+    privacy_status = form.get("privacyStatus")
 
     if not video_title or not video_description or not file_path or not privacy_status:
+        if file_path:
+            os.remove(file_path)
         return jsonify({"error": "Missing required fields"}), 400
 
-    request_body = {
-        "snippet": {
-            "title": video_title,
-            "description": video_description
-        },
-        "status": {
-            "privacyStatus": privacy_status
-        }
-    }
+    create_job(r, job_id, user_id, file_path, video_title, video_description, privacy_status)
+    return jsonify({"job_id": job_id, "state": QUEUED}), 202
 
-    media_file = MediaFileUpload(file_path)
-    insert_request = youtube.videos().insert(
-        part="snippet,status",
-        body=request_body,
-        media_body=media_file
-    )
-    response = insert_request.execute()
 
-    return jsonify(response)
+@youtube_routes.route("/upload/<job_id>", methods=["GET"])
+@jwt_required()
+def upload_status(job_id):
+    """Report the state and progress of an upload job."""
+    job = get_job(r, job_id)
+    if not job or job.get("user_id") != get_jwt_identity():
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(job_status(job_id, job))
@@ -0,0 +1,193 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+import redis
+
+from metrics import TOKEN_REFRESHES, upstream_timer
+from .cache import l1
+from .utils import clients, pack_credentials, token_error_key, unpack_credentials
+
+# Access tokens are refreshed this many seconds before they expire, minus
+# up to REFRESH_JITTER more so users linked together don't refresh together
+REFRESH_AHEAD = int(os.getenv('TOKEN_REFRESH_AHEAD', 300))
+REFRESH_JITTER = int(os.getenv('TOKEN_REFRESH_JITTER', 120))
+REFRESH_WORKERS = int(os.getenv('TOKEN_REFRESH_WORKERS', 4))
+# How often the scheduler looks for tokens that are due
+POLL_INTERVAL = float(os.getenv('TOKEN_REFRESH_POLL', 15))
+# Failed refreshes in a row before a user has to link their account again
+MAX_FAILURES = 5
+LOCK_TTL = 60
+
+SCHEDULE_KEY = 'oauth:refresh_due'
+
+executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='token-refresh')
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _due(expires_at):
+    return expires_at - REFRESH_AHEAD - random.uniform(0, REFRESH_JITTER)
+
+
+def _expires_at(info):
+    expiry = info.get("expiry")
+    if not expiry:
+        return None
+    from google.oauth2.credentials import Credentials
+
+    return Credentials.from_authorized_user_info(info).expiry.replace(tzinfo=timezone.utc).timestamp()
+
+
+def schedule(r, user_id, stored_credentials, replace=True):
+    """Queue the user's token for a refresh ahead of its expiry.
+
+    With replace=False an existing schedule is left alone, which lets read
+    paths enrol users linked before the scheduler existed.
+    """
+    expires_at = _expires_at(unpack_credentials(stored_credentials))
+    if expires_at is None:
+        return
+    r.zadd(SCHEDULE_KEY, {user_id: _due(expires_at)}, nx=not replace)
+
+
+def unschedule(r, user_id):
+    r.zrem(SCHEDULE_KEY, user_id)
+
+
+def token_status(stored_error):
+    """The token part of /status, from the stored refresh error if any."""
+    if not stored_error:
+        return {"state": "ok"}
+    return dict(json.loads(stored_error), state="error")
+
+
+def _record_failure(r, user_id, error, failures, retry_in=None):
+    pipe = r.pipeline(transaction=False)
+    pipe.set(token_error_key(user_id), json.dumps({
+        "error": error,
+        "failures": failures,
+        "failed_at": time.time(),
+        "retrying": retry_in is not None,
+    }))
+    if retry_in is None:
+        pipe.zrem(SCHEDULE_KEY, user_id)
+    else:
+        pipe.zadd(SCHEDULE_KEY, {user_id: time.time() + retry_in})
+    pipe.execute()
+    l1.invalidate(token_error_key(user_id))
+
+
+def _retry_later(r, user_id, error):
+    """Record a failure that may pass, retrying with backoff until MAX_FAILURES in a row."""
+    try:
+        failures = json.loads(r.get(token_error_key(user_id)))["failures"] + 1
+    except (TypeError, ValueError, KeyError):
+        failures = 1
+    if failures >= MAX_FAILURES:
+        _record_failure(r, user_id, str(error), failures)
+        TOKEN_REFRESHES.labels('failed').inc()
+    else:
+        _record_failure(r, user_id, str(error), failures, retry_in=min(60 * 2 ** failures, 900))
+        TOKEN_REFRESHES.labels('retry').inc()
+
+
+def refresh_token(r, user_id):
+    """Refresh one user's access token and store it, unless they relinked or unlinked meanwhile."""
+    lock_key = f"oauth:refresh:{user_id}:lock"
+    if not r.set(lock_key, 1, nx=True, ex=LOCK_TTL):
+        return
+    try:
+        _refresh(r, user_id)
+    except Exception as e:
+        # Unreadable stored credentials, a Redis error and the like: back
+        # off as for a network error instead of retrying on every poll
+        try:
+            _retry_later(r, user_id, e)
+        except redis.RedisError:
+            # Still due, so tried again once Redis answers
+            pass
+    finally:
+        r.delete(lock_key)
+
+
+def _refresh(r, user_id):
+    from google.auth.exceptions import RefreshError, TransportError
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    stored_credentials = r.get(user_id)
+    if not stored_credentials:
+        unschedule(r, user_id)
+        return
+
+    info = unpack_credentials(stored_credentials)
+    if not info.get("refresh_token"):
+        _record_failure(r, user_id, "No refresh token stored; link the account again", 1)
+        TOKEN_REFRESHES.labels('failed').inc()
+        return
+
+    credentials = Credentials.from_authorized_user_info(info)
+    try:
+        with upstream_timer('youtube', 'oauth.refresh'):
+            credentials.refresh(Request())
+    except RefreshError as e:
+        # Revoked or expired grant: only relinking fixes it
+        _record_failure(r, user_id, e.args[0] if e.args else str(e), 1)
+        TOKEN_REFRESHES.labels('failed').inc()
+        return
+    except (TransportError, OSError) as e:
+        _retry_later(r, user_id, e)
+        return
+
+    refreshed = pack_credentials(credentials.to_json())
+    try:
+        with r.pipeline() as pipe:
+            # Only replace the credentials the refresh started from
+            pipe.watch(user_id)
+            if pipe.get(user_id) != stored_credentials:
+                return
+            pipe.multi()
+            pipe.set(user_id, refreshed)
+            pipe.delete(token_error_key(user_id))
+            pipe.zadd(SCHEDULE_KEY, {user_id: _due(_expires_at(unpack_credentials(refreshed)))})
+            pipe.execute()
+    except redis.WatchError:
+        return
+    l1.invalidate(user_id, token_error_key(user_id))
+    clients.invalidate(user_id)
+    TOKEN_REFRESHES.labels('ok').inc()
+
+
+def _run(r):
+    in_flight = set()
+    lock = threading.Lock()
+
+    def done(user_id):
+        with lock:
+            in_flight.discard(user_id)
+
+    while True:
+        try:
+            due = [_text(user_id) for user_id in r.zrangebyscore(SCHEDULE_KEY, '-inf', time.time())]
+        except redis.RedisError:
+            due = []
+        for user_id in due:
+            with lock:
+                if user_id in in_flight:
+                    continue
+                in_flight.add(user_id)
+            future = executor.submit(refresh_token, r, user_id)
+            future.add_done_callback(lambda _, user_id=user_id: done(user_id))
+        time.sleep(POLL_INTERVAL)
+
+
+def start_refresher(r):
+    """Refresh OAuth tokens in the background so requests find them valid."""
+    threading.Thread(target=_run, args=(r,), name='token-scheduler', daemon=True).start()
@@ -0,0 +1,315 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from werkzeug.utils import secure_filename
+
+from metrics import upstream_timer
+from .utils import new_client
+from .videos import refresh_soon
+
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', '/tmp/uploads')
+# YouTube needs chunks in multiples of 256 KiB
+CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+WORKERS = int(os.getenv('UPLOAD_WORKERS', 2))
+# Failed chunks in a row before a job is given up on
+MAX_FAILURES = 5
+# Finished jobs stay visible to the status endpoint this long
+JOB_TTL = 7 * 24 * 3600
+# Renewed after every chunk, so a job held by a dead worker frees up
+LOCK_TTL = 300
+# How often pending jobs are looked at, so one whose worker died is picked
+# up again once its lock runs out
+RESUME_INTERVAL = float(os.getenv('UPLOAD_RESUME_INTERVAL', 60))
+
+QUEUED = 'queued'
+UPLOADING = 'uploading'
+DONE = 'done'
+FAILED = 'failed'
+
+PENDING_KEY = 'uploads:pending'
+
+
+class LockLost(Exception):
+    """Another run took the job's lock while this one was uploading."""
+
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='youtube-upload')
+
+# Jobs queued or running in this process
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def job_key(job_id):
+    return f"upload:{job_id}"
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def stream_factory(job_id, saved):
+    """Werkzeug stream factory writing the uploaded video straight to disk.
+
+    Only the first file in the form is kept; saved['path'] records where
+    it went.
+    """
+    def factory(total_content_length, content_type, filename, content_length=None):
+        if 'path' in saved:
+            return tempfile.TemporaryFile()
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        _, ext = os.path.splitext(secure_filename(filename or ''))
+        saved['path'] = os.path.join(UPLOAD_DIR, job_id + ext)
+        return open(saved['path'], 'wb+')
+
+    return factory
+
+
+def create_job(r, job_id, user_id, file_path, title, description, privacy_status):
+    r.hset(job_key(job_id), mapping={
+        'user_id': user_id,
+        'state': QUEUED,
+        'file_path': file_path,
+        'title': title,
+        'description': description,
+        'privacy_status': privacy_status,
+        'bytes_sent': 0,
+        'total_bytes': os.path.getsize(file_path),
+        'updated_at': time.time(),
+    })
+    r.sadd(PENDING_KEY, job_id)
+    submit(r, job_id)
+
+
+def submit(r, job_id):
+    """Queue a job on this process's workers unless it is already queued here."""
+    with _in_flight_lock:
+        if job_id in _in_flight:
+            return
+        _in_flight.add(job_id)
+    future = executor.submit(run_job, r, job_id)
+    future.add_done_callback(lambda _: _done(job_id))
+
+
+def _done(job_id):
+    with _in_flight_lock:
+        _in_flight.discard(job_id)
+
+
+def get_job(r, job_id):
+    return {_text(k): _text(v) for k, v in r.hgetall(job_key(job_id)).items()}
+
+
+def _update(r, job_id, **fields):
+    fields['updated_at'] = time.time()
+    r.hset(job_key(job_id), mapping=fields)
+
+
+def _finish(r, job_id, job, **fields):
+    _update(r, job_id, **fields)
+    r.expire(job_key(job_id), JOB_TTL)
+    r.srem(PENDING_KEY, job_id)
+    try:
+        os.remove(job['file_path'])
+    except OSError:
+        pass
+
+
+def _retryable(error):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500
+    return isinstance(error, (OSError, socket.timeout, httplib2.HttpLib2Error))
+
+
+def lock_key(job_id):
+    return job_key(job_id) + ':lock'
+
+
+def _release(r, job_id, owner):
+    """Drop the job's lock if it is still the one this run took."""
+    with r.pipeline() as pipe:
+        try:
+            pipe.watch(lock_key(job_id))
+            if _text(pipe.get(lock_key(job_id))) != owner:
+                return
+            pipe.multi()
+            pipe.delete(lock_key(job_id))
+            pipe.execute()
+        except redis.WatchError:
+            pass
+
+
+def _renew(r, job_id, owner):
+    """Extend the job's lock, or raise LockLost if it is no longer this run's."""
+    with r.pipeline() as pipe:
+        try:
+            pipe.watch(lock_key(job_id))
+            if _text(pipe.get(lock_key(job_id))) != owner:
+                raise LockLost(job_id)
+            pipe.multi()
+            pipe.expire(lock_key(job_id), LOCK_TTL)
+            pipe.execute()
+        except redis.WatchError:
+            raise LockLost(job_id)
+
+
+def _upload(r, job_id, job, owner):
+    from googleapiclient.http import MediaFileUpload
+
+    stored_credentials = r.get(job['user_id'])
+    if not stored_credentials:
+        raise RuntimeError("User not linked")
+
+    media_file = MediaFileUpload(job['file_path'], chunksize=CHUNK_SIZE, resumable=True)
+    insert_request = new_client(stored_credentials).videos().insert(
+        part="snippet,status",
+        body={
+            "snippet": {
+                "title": job['title'],
+                "description": job['description']
+            },
+            "status": {
+                "privacyStatus": job['privacy_status']
+            }
+        },
+        media_body=media_file
+    )
+    if job.get('upload_uri'):
+        resume_from(insert_request, job['upload_uri'])
+
+    def saved(request):
+        _update(
+            r, job_id,
+            state=UPLOADING,
+            upload_uri=request.resumable_uri or '',
+            bytes_sent=request.resumable_progress
+        )
+        _renew(r, job_id, owner)
+
+    return send_chunks(insert_request, saved)
+
+
+def resume_from(insert_request, upload_uri):
+    """Point a resumable insert at an upload session a previous run started."""
+    # In the error state next_chunk first asks YouTube how many bytes it
+    # already has. _in_error_state is private to googleapiclient's
+    # HttpRequest, which has no public way to resume a session; check it
+    # still exists when moving off the version pinned in requirements.txt
+    insert_request.resumable_uri = upload_uri
+    insert_request._in_error_state = True
+
+
+def send_chunks(insert_request, saved):
+    """Upload the rest of a resumable insert; saved(insert_request) runs after each chunk.
+
+    Failed chunks are retried with backoff, up to MAX_FAILURES in a row.
+    """
+    failures = 0
+    response = None
+    while response is None:
+        try:
+            with upstream_timer('youtube', 'videos.insert.chunk'):
+                _, response = insert_request.next_chunk(num_retries=3)
+        except Exception as e:
+            failures += 1
+            if not _retryable(e) or failures >= MAX_FAILURES:
+                raise
+            time.sleep(min(2 ** failures, 60))
+            continue
+        failures = 0
+        saved(insert_request)
+    return response
+
+
+def run_job(r, job_id):
+    """Upload a queued video to YouTube, resuming where a previous run stopped.
+
+    Returns without doing anything while another run holds the job; the
+    resumer tries again later, so a lock left by a dead worker only
+    delays the job until it expires. Only errors retrying can't fix fail
+    the job; after others, like YouTube or Redis being down for longer
+    than send_chunks retries, it stays pending with its file for the
+    resumer.
+    """
+    # Each run takes the lock under its own token, so a run whose lock
+    # expired can't release the one a later run took
+    owner = uuid.uuid4().hex
+    if not r.set(lock_key(job_id), owner, nx=True, ex=LOCK_TTL):
+        return
+    try:
+        job = get_job(r, job_id)
+        if job.get('state') not in (QUEUED, UPLOADING):
+            return
+        try:
+            response = _upload(r, job_id, job, owner)
+        except LockLost:
+            return
+        except Exception as e:
+            if isinstance(e, redis.RedisError) or _retryable(e):
+                _keep_pending(r, job_id, e)
+                return
+            _finish(r, job_id, job, state=FAILED, error=str(e))
+            return
+        _finish(r, job_id, job, state=DONE, video_id=response.get('id', ''), bytes_sent=job['total_bytes'], error='')
+        # Make the next /videos call pick up the new upload
+        refresh_soon(r, job['user_id'])
+    finally:
+        _release(r, job_id, owner)
+
+
+def _keep_pending(r, job_id, error):
+    """Note why the job stopped; it stays pending for the resumer to retry."""
+    try:
+        _update(r, job_id, error=str(error))
+    except redis.RedisError:
+        pass
+
+
+def resume_pending(r):
+    """Requeue unfinished jobs, including ones a previous run of this service left."""
+    for job_id in r.smembers(PENDING_KEY):
+        submit(r, _text(job_id))
+
+
+def _run(r):
+    while True:
+        try:
+            resume_pending(r)
+        except redis.RedisError:
+            pass
+        time.sleep(RESUME_INTERVAL)
+
+
+def start_resumer(r):
+    """Keep requeueing pending jobs until they finish."""
+    threading.Thread(target=_run, args=(r,), name='upload-resumer', daemon=True).start()
+
+
+def job_status(job_id, job):
+    total = int(job.get('total_bytes', 0))
+    sent = int(job.get('bytes_sent', 0))
+    status = {
+        "job_id": job_id,
+        "state": job['state'],
+        "bytes_sent": sent,
+        "total_bytes": total,
+        "progress": round(sent / total * 100, 1) if total else 0,
+    }
+    if job.get('video_id'):
+        status["video_id"] = job['video_id']
+    if job.get('error'):
+        status["error"] = job['error']
+    return status
@@ -0,0 +1,172 @@
+import calendar
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from metrics import upstream_timer
+from .cache import l1
+from .videos import video_index_keys
+
+# Load client secrets file
+CLIENT_SECRETS_FILE = "client_secret.json"
+
+# Define OAuth scopes
+SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
+
+# Stored credentials leave out whatever every user shares, like the app's
+# client id and secret, and use short names for the rest
+CREDENTIALS_PREFIX = "c1:"
+_SHORT_NAMES = {"token": "t", "refresh_token": "r", "expiry": "e"}
+_EXPIRY_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_fields():
+    shared = {"scopes": SCOPES, "universe_domain": "googleapis.com", "account": ""}
+    try:
+        with open(CLIENT_SECRETS_FILE) as f:
+            client_config = next(iter(json.load(f).values()))
+    except (OSError, ValueError, StopIteration):
+        return shared
+    for field in ("client_id", "client_secret", "token_uri"):
+        if field in client_config:
+            shared[field] = client_config[field]
+    return shared
+
+
+def pack_credentials(credentials_json):
+    """Compact form of Credentials.to_json() for storing in Redis."""
+    info = json.loads(credentials_json)
+    shared = _shared_fields()
+    packed = {}
+    for field, value in info.items():
+        if value is None or shared.get(field, object()) == value:
+            continue
+        if field == "expiry":
+            value = calendar.timegm(datetime.strptime(value.rstrip("Z").split(".")[0], "%Y-%m-%dT%H:%M:%S").timetuple())
+        packed[_SHORT_NAMES.get(field, field)] = value
+    return CREDENTIALS_PREFIX + json.dumps(packed, separators=(",", ":"))
+
+
+def unpack_credentials(stored_credentials):
+    """Authorized user info from stored credentials, packed or plain JSON."""
+    if isinstance(stored_credentials, bytes):
+        stored_credentials = stored_credentials.decode("utf-8")
+    if not stored_credentials.startswith(CREDENTIALS_PREFIX):
+        return json.loads(stored_credentials)
+
+    long_names = {short: field for field, short in _SHORT_NAMES.items()}
+    info = dict(_shared_fields())
+    for key, value in json.loads(stored_credentials[len(CREDENTIALS_PREFIX):]).items():
+        info[long_names.get(key, key)] = value
+    if "expiry" in info:
+        info["expiry"] = time.strftime(_EXPIRY_FORMAT, time.gmtime(info["expiry"]))
+    return info
+
+
+def new_client(stored_credentials):
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
+    credentials = Credentials.from_authorized_user_info(unpack_credentials(stored_credentials))
+    return build("youtube", "v3", credentials=credentials)
+
+
+class ClientEntry:
+
+    def __init__(self, stored_credentials, youtube, ttl):
+        self.stored_credentials = stored_credentials
+        self.youtube = youtube
+        self.expires_at = time.monotonic() + ttl
+        # httplib2 connections aren't thread safe, so one request at a
+        # time uses a given client
+        self.lock = threading.Lock()
+        # Whether the token refresher knows about these credentials
+        self.scheduled = False
+
+
+class ClientCache:
+    """Per-user YouTube API clients, kept for ttl seconds in an LRU.
+
+    An entry is only reused while the credentials stored in Redis are the
+    ones it was built from, so relinking or logging out on another worker
+    never serves a stale client.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, stored_credentials):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.stored_credentials == stored_credentials \
+                    and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                return entry
+
+        # Raises on malformed credentials; the caller reports it
+        entry = ClientEntry(stored_credentials, new_client(stored_credentials), self.ttl)
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+clients = ClientCache(
+    int(os.getenv('YOUTUBE_CLIENT_CACHE_SIZE', 256)),
+    int(os.getenv('YOUTUBE_CLIENT_CACHE_TTL', 3600)),
+)
+
+
+def uploads_playlist_key(user_id):
+    return f"{user_id}:uploads_playlist"
+
+
+def uploads_playlist_id(r, user_id, youtube, playlist_id=None):
+    """The channel's uploads playlist, looked up once and then kept in Redis.
+
+    Callers that already fetched the key pass its value as playlist_id.
+    """
+    key = uploads_playlist_key(user_id)
+    if playlist_id is None:
+        playlist_id = r.get(key)
+    if playlist_id:
+        return playlist_id.decode("utf-8") if isinstance(playlist_id, bytes) else playlist_id
+
+    channel_request = youtube.channels().list(part="contentDetails", mine=True)
+    with upstream_timer('youtube', 'channels.list'):
+        channel_response = channel_request.execute()
+    playlist_id = channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+    r.set(key, playlist_id)
+    l1.invalidate(key)
+    return playlist_id
+
+
+def token_error_key(user_id):
+    """Why the background refresh of the user's token last failed, if it did."""
+    return f"{user_id}:token_error"
+
+
+def channel_keys(user_id):
+    """Redis keys holding data about the user's linked channel."""
+    return [uploads_playlist_key(user_id), token_error_key(user_id)] + video_index_keys(user_id)
+
+
+def forget_user(r, user_id):
+    """Drop everything cached for a user who unlinked their account."""
+    clients.invalidate(user_id)
+    r.delete(user_id, *channel_keys(user_id))
+    l1.invalidate(user_id, *channel_keys(user_id))
@@ -0,0 +1,156 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from metrics import upstream_timer
+
+# Most the playlistItems API returns per call; the index always fetches
+# full pages to make the most of each quota unit
+YOUTUBE_PAGE_SIZE = 50
+MAX_RESULTS = 50
+DEFAULT_RESULTS = 10
+
+# Seconds before the newest uploads are checked again
+INDEX_REFRESH = int(os.getenv('VIDEO_INDEX_REFRESH', 60))
+# The whole index is rebuilt this often, which drops deleted videos
+INDEX_MAX_AGE = int(os.getenv('VIDEO_INDEX_MAX_AGE', 24 * 3600))
+
+
+class InvalidPageToken(Exception):
+    pass
+
+
+def video_index_keys(user_id):
+    """Playlist items by id, their order by publishedAt, and index state."""
+    return [f"{user_id}:videos", f"{user_id}:videos:order", f"{user_id}:videos:meta"]
+
+
+def index_meta_key(user_id):
+    return video_index_keys(user_id)[2]
+
+
+def refresh_soon(r, user_id):
+    """Make the next list_videos call check for new uploads."""
+    r.hdel(index_meta_key(user_id), "refreshed_at")
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _published_at(item):
+    published = item["snippet"]["publishedAt"]
+    return datetime.fromisoformat(published.replace("Z", "+00:00")).timestamp()
+
+
+def _fetch_page(youtube, playlist_id, page_token=None):
+    playlist_request = youtube.playlistItems().list(
+        part="snippet",
+        playlistId=playlist_id,
+        maxResults=YOUTUBE_PAGE_SIZE,
+        pageToken=page_token,
+        fields="nextPageToken,pageInfo/totalResults,items(id,snippet)"
+    )
+    with upstream_timer('youtube', 'playlistItems.list'):
+        return playlist_request.execute()
+
+
+def _expires_at(meta):
+    """When the index in meta is dropped for a rebuild, INDEX_MAX_AGE after it was started."""
+    return float(meta.get("expires_at") or time.time() + INDEX_MAX_AGE)
+
+
+def _store(r, user_id, items, meta, expires_at):
+    items_key, order_key, meta_key = video_index_keys(user_id)
+    pipe = r.pipeline(transaction=False)
+    if items:
+        pipe.hset(items_key, mapping={item["id"]: json.dumps(item) for item in items})
+        pipe.zadd(order_key, {item["id"]: _published_at(item) for item in items})
+    pipe.hset(meta_key, mapping=dict(meta, expires_at=expires_at))
+    # On every write, since a key can be created after the index was
+    # started; the same deadline each time, so the index still gets rebuilt
+    for key in video_index_keys(user_id):
+        pipe.expireat(key, int(expires_at))
+    pipe.execute()
+
+
+def _refresh(r, user_id, youtube, playlist_id, meta):
+    """Fetch uploads newer than the newest indexed one.
+
+    The uploads playlist lists newest first, so paging stops at the first
+    item that is already known. A new index only takes the first page;
+    older pages are filled in as clients paginate to them.
+    """
+    newest = meta.get("newest")
+    expires_at = _expires_at(meta)
+    fresh = {"refreshed_at": time.time()}
+    page_token = None
+    while True:
+        response = _fetch_page(youtube, playlist_id, page_token)
+        items = response.get("items", [])
+        new_items = [item for item in items if not newest or item["snippet"]["publishedAt"] > newest]
+        if new_items and "newest" not in fresh:
+            fresh["newest"] = new_items[0]["snippet"]["publishedAt"]
+        if "totalResults" in response.get("pageInfo", {}):
+            fresh["total"] = response["pageInfo"]["totalResults"]
+
+        page_token = response.get("nextPageToken")
+        if not newest:
+            fresh["tail"] = page_token or ""
+            _store(r, user_id, new_items, fresh, expires_at)
+            return
+        _store(r, user_id, new_items, fresh, expires_at)
+        if len(new_items) < len(items) or not page_token:
+            return
+
+
+def _backfill(r, user_id, youtube, playlist_id, tail, expires_at):
+    """Index the next page of older uploads; returns the new tail token."""
+    response = _fetch_page(youtube, playlist_id, tail)
+    tail = response.get("nextPageToken") or ""
+    _store(r, user_id, response.get("items", []), {"tail": tail}, expires_at)
+    return tail
+
+
+def _project(item, fields):
+    if not fields:
+        return item
+    snippet = item["snippet"]
+    return {"id": item["id"], "snippet": {field: snippet[field] for field in fields if field in snippet}}
+
+
+def list_videos(r, user_id, youtube, playlist_id, page_token=None, max_results=DEFAULT_RESULTS, fields=None):
+    """One page of the user's uploads, newest first, served from the index.
+
+    page_token is the id of the last item on the previous page, so pages
+    stay stable when new uploads are added in between. fields limits the
+    snippet to the named keys.
+    """
+    items_key, order_key, meta_key = video_index_keys(user_id)
+    meta = {_text(k): _text(v) for k, v in r.hgetall(meta_key).items()}
+    if not meta or time.time() - float(meta.get("refreshed_at", 0)) > INDEX_REFRESH:
+        _refresh(r, user_id, youtube, playlist_id, meta)
+        meta = {_text(k): _text(v) for k, v in r.hgetall(meta_key).items()}
+
+    start = 0
+    if page_token:
+        rank = r.zrevrank(order_key, page_token)
+        if rank is None:
+            raise InvalidPageToken(page_token)
+        start = rank + 1
+
+    tail = meta.get("tail", "")
+    while tail and r.zcard(order_key) < start + max_results:
+        tail = _backfill(r, user_id, youtube, playlist_id, tail, _expires_at(meta))
+
+    ids = [_text(item_id) for item_id in r.zrevrange(order_key, start, start + max_results - 1)]
+    items = [json.loads(item) for item in r.hmget(items_key, ids) if item] if ids else []
+
+    response = {
+        "items": [_project(item, fields) for item in items],
+        "pageInfo": {"totalResults": int(meta.get("total", 0)), "resultsPerPage": max_results},
+    }
+    if ids and (tail or start + len(ids) < r.zcard(order_key)):
+        response["nextPageToken"] = ids[-1]
+    return response
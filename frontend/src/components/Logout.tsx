@@ -3,7 +3,22 @@ import { useNavigate } from 'react-router-dom';
 const Logout = () => {
   const navigate = useNavigate();
 
+  const API_BASE_URL = import.meta.env.VITE_API_BASE_URL;
+
   const handleLogout = () => {
+    // Revoke this login's tokens on the server, refresh token included
+    const JwtToken = sessionStorage.getItem('access_token');
+    if (JwtToken) {
+      fetch(`${API_BASE_URL}/auth/logout`, {
+        method: 'POST',
+        headers: {
+          Authorization: `Bearer ${JwtToken}`,
+        },
+      }).catch((err) => {
+        console.error('Error logging out:', err);
+      });
+    }
+
     // Remove tokens from sessionStorage
     sessionStorage.removeItem('access_token');
 
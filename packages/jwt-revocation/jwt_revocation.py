@@ -0,0 +1,75 @@
+"""Revoked JWTs and sessions, shared by every service that checks tokens.
+
+The auth service puts token ids (jti) and session ids (sid) on the list,
+as jwt:revoked:<id> keys in the Redis at REVOCATION_REDIS_URL, each
+expiring when the tokens it covers would. The backend and the gateway
+only read it. All of them go through this module, so they agree on the
+keys.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+KEY_PREFIX = 'jwt:revoked:'
+
+
+def revoked_key(token_or_session_id):
+    return f"{KEY_PREFIX}{token_or_session_id}"
+
+
+def lookup(r, claims):
+    """Whether the token's jti or session is on the list; raises redis.RedisError."""
+    keys = [revoked_key(claims[claim]) for claim in ('jti', 'sid') if claims.get(claim)]
+    return bool(keys) and r.exists(*keys) > 0
+
+
+class RevocationCache:
+    """Checks tokens against the list, answering most checks from an LRU.
+
+    A revoked result is kept until the token expires and a clean one for
+    recheck seconds, so a revocation made by another process takes effect
+    within that window. When Redis is unreachable checks fail open.
+    observe, if given, is called with where each check was answered:
+    cached, store or error.
+    """
+
+    def __init__(self, r, recheck=5, max_size=100000, observe=None):
+        self.r = r
+        self.recheck = recheck
+        self.max_size = max_size
+        self.observe = observe or (lambda source: None)
+        self._checks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_revoked(self, claims):
+        jti = claims['jti']
+        now = time.time()
+        with self._lock:
+            entry = self._checks.get(jti)
+            if entry is not None and entry[1] > now:
+                self._checks.move_to_end(jti)
+                self.observe('cached')
+                return entry[0]
+
+        try:
+            revoked = lookup(self.r, claims)
+        except redis.RedisError:
+            self.observe('error')
+            return False
+        self.observe('store')
+
+        until = claims.get('exp', now) if revoked else now + self.recheck
+        with self._lock:
+            self._checks[jti] = (revoked, until, claims.get('sid'))
+            self._checks.move_to_end(jti)
+            while len(self._checks) > self.max_size:
+                self._checks.popitem(last=False)
+        return revoked
+
+    def forget(self, token_or_session_id):
+        """Drop cached results for a token, or for every token of a session."""
+        with self._lock:
+            for jti in [jti for jti, entry in self._checks.items() if token_or_session_id in (jti, entry[2])]:
+                del self._checks[jti]
@@ -0,0 +1,88 @@
+import time
+
+import fakeredis
+import pytest
+import redis
+
+from jwt_revocation import RevocationCache, lookup, revoked_key
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+def claims(jti='token1', sid='session1', ttl=900):
+    return {'jti': jti, 'sid': sid, 'exp': time.time() + ttl}
+
+
+def test_lookup_matches_the_token_or_its_session(r):
+    assert not lookup(r, claims())
+
+    r.set(revoked_key('session1'), 1)
+    assert lookup(r, claims(jti='other'))
+
+    r.delete(revoked_key('session1'))
+    r.set(revoked_key('token1'), 1)
+    assert lookup(r, claims(sid=None))
+
+
+def test_lookup_without_ids_is_never_revoked(r):
+    assert not lookup(r, {})
+
+
+def test_revoked_result_is_kept_until_the_token_expires(r):
+    checks = RevocationCache(r, recheck=60)
+    r.set(revoked_key('token1'), 1)
+    assert checks.is_revoked(claims())
+
+    r.delete(revoked_key('token1'))
+    assert checks.is_revoked(claims())
+
+
+def test_clean_result_is_rechecked_after_recheck_seconds(r):
+    seen = []
+    checks = RevocationCache(r, recheck=0, observe=seen.append)
+    assert not checks.is_revoked(claims())
+
+    r.set(revoked_key('session1'), 1)
+    assert checks.is_revoked(claims())
+    assert seen == ['store', 'store']
+
+
+def test_forget_drops_every_token_of_a_session(r):
+    seen = []
+    checks = RevocationCache(r, recheck=60, observe=seen.append)
+    checks.is_revoked(claims(jti='token1'))
+    checks.is_revoked(claims(jti='token2'))
+    checks.is_revoked(claims(jti='token1'))
+    assert seen == ['store', 'store', 'cached']
+
+    r.set(revoked_key('session1'), 1)
+    checks.forget('session1')
+
+    assert checks.is_revoked(claims(jti='token1'))
+    assert checks.is_revoked(claims(jti='token2'))
+
+
+def test_lru_is_bounded(r):
+    checks = RevocationCache(r, recheck=60, max_size=2)
+    for jti in ('token1', 'token2', 'token3'):
+        checks.is_revoked(claims(jti=jti))
+
+    assert list(checks._checks) == ['token2', 'token3']
+
+
+class DownRedis:
+    def exists(self, *keys):
+        raise redis.ConnectionError('down')
+
+
+def test_checks_fail_open_when_redis_is_down():
+    seen = []
+    checks = RevocationCache(DownRedis(), observe=seen.append)
+
+    assert not checks.is_revoked(claims())
+    assert seen == ['error']
+    with pytest.raises(redis.RedisError):
+        lookup(DownRedis(), claims())